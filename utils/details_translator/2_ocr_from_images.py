@@ -1,13 +1,13 @@
 import os
 from pathlib import Path
 import pytesseract
-from PIL import Image
 import pandas as pd
 from tqdm import tqdm
 import sys
+from ocr_engine import open_ocr_engine, ocr_images, close_ocr_engine
 
 # === Путь до Tesseract ===
-pytesseract.pytesseract.tesseract_cmd = r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
+pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe")
 
 # === UTF-8 консоль для Windows ===
 if os.name == "nt":
@@ -19,54 +19,65 @@ if os.name == "nt":
 IMAGES_FOLDER = r"X:\\DATA_STORAGE\\Furnithai\\utils\\details_translator\\images"
 OUTPUT_CSV = r"X:\\DATA_STORAGE\\Furnithai\\utils\\details_translator\\ocr_results.csv"
 BASE_IMAGE_URL = "file:///" + IMAGES_FOLDER.replace("\\", "/")
+# Images handed to the OCR pool at once; their results are written before the next batch starts
+OCR_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', '64'))
 
-print(f"🔍 Сканируем изображения в папке: {IMAGES_FOLDER}")
+def main():
+    print(f"🔍 Сканируем изображения в папке: {IMAGES_FOLDER}")
 
-# === Список всех изображений ===
-image_files = []
-for root, _, files in os.walk(IMAGES_FOLDER):
-    for file in files:
-        if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-            image_files.append(Path(root) / file)
+    # === Список всех изображений ===
+    image_files = []
+    for root, _, files in os.walk(IMAGES_FOLDER):
+        for file in files:
+            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
+                image_files.append(Path(root) / file)
 
-print(f"📸 Найдено {len(image_files)} изображений")
+    print(f"📸 Найдено {len(image_files)} изображений")
 
-# === Подготовка CSV ===
-header_written = os.path.exists(OUTPUT_CSV)
+    # === Подготовка CSV ===
+    header_written = os.path.exists(OUTPUT_CSV)
 
-# === OCR ===
-for img_path in tqdm(image_files):
+    # === OCR ===
+    engine = open_ocr_engine(tesseract_cmd=pytesseract.pytesseract.tesseract_cmd)
     try:
-        product_id = img_path.parent.name
-        filename = img_path.name
-        image_index = int(filename.split('.')[0])
-        full_url = "file:///" + str(img_path).replace("\\", "/")
+        with tqdm(total=len(image_files)) as progress:
+            for start in range(0, len(image_files), OCR_BATCH_SIZE):
+                batch = image_files[start:start + OCR_BATCH_SIZE]
+                # Failed images are reported by the engine and have no words
+                for img_path, ocr_result in zip(batch, ocr_images(engine, batch)):
+                    try:
+                        product_id = img_path.parent.name
+                        filename = img_path.name
+                        image_index = int(filename.split('.')[0])
+                        full_url = "file:///" + str(img_path).replace("\\", "/")
 
-        print(f"➡️ Распознаем: {img_path}")
-        img = Image.open(img_path)
-        ocr_data = pytesseract.image_to_data(img, lang='chi_sim', output_type=pytesseract.Output.DICT)
+                        print(f"➡️ Распознаем: {img_path}")
+                        image_results = []
 
-        image_results = []
+                        for i, text_clean in ocr_result['words']:
+                            print(f"   ⤷ [{i}] '{text_clean}'")
+                            image_results.append({
+                                'product_id': product_id,
+                                'image_file': filename,
+                                'image_url': full_url,
+                                'image_index': image_index,
+                                'ocr_index': i,
+                                'text': text_clean
+                            })
 
-        for i, text in enumerate(ocr_data['text']):
-            text_clean = text.strip()
-            if text_clean:
-                print(f"   ⤷ [{i}] '{text_clean}'")
-                image_results.append({
-                    'product_id': product_id,
-                    'image_file': filename,
-                    'image_url': full_url,
-                    'image_index': image_index,
-                    'ocr_index': i,
-                    'text': text_clean
-                })
+                        if image_results:
+                            df = pd.DataFrame(image_results)
+                            df.to_csv(OUTPUT_CSV, mode='a', header=not header_written, index=False, encoding='utf-8-sig')
+                            header_written = True
 
-        if image_results:
-            df = pd.DataFrame(image_results)
-            df.to_csv(OUTPUT_CSV, mode='a', header=not header_written, index=False, encoding='utf-8-sig')
-            header_written = True
+                    except Exception as e:
+                        print(f"[!] Ошибка при обработке {img_path}: {e}")
+                progress.update(len(batch))
+    finally:
+        close_ocr_engine(engine)
 
-    except Exception as e:
-        print(f"[!] Ошибка при обработке {img_path}: {e}")
+    print(f"✅ Готово. Все результаты записаны в файл: {OUTPUT_CSV}")
 
-print(f"✅ Готово. Все результаты записаны в файл: {OUTPUT_CSV}")
+# Worker processes re-import this script, the run must not start at import
+if __name__ == "__main__":
+    main()
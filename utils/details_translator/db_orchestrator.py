@@ -6,13 +6,12 @@ from psycopg2.extras import execute_values
 import uuid
 from dotenv import load_dotenv
 import re
-import time
 from pathlib import Path
-import requests
 from bs4 import BeautifulSoup
 import pytesseract
-from PIL import Image
 import openai
+from image_downloader import open_downloader, download_images, close_downloader
+from ocr_engine import open_ocr_engine, ocr_images, ocr_result_text, close_ocr_engine
 
 # === UTF-8 console for Windows ===
 if os.name == "nt":
@@ -54,9 +53,6 @@ logistic_fields = [
     "logistics_notes"
 ]
 
-# HTTP Headers
-HEADERS = {"User-Agent": "Mozilla/5.0"}
-
 # Helper functions
 def generate_uuid():
     """Generate a UUID string"""
@@ -71,36 +67,6 @@ def is_missing(path):
     """Check if a file is missing"""
     return not Path(path).exists()
 
-def download_image(url, save_path):
-    """Download an image from URL"""
-    try:
-        r = requests.get(url, timeout=10, headers=HEADERS)
-        r.raise_for_status()
-        Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(save_path, "wb") as f:
-            f.write(r.content)
-        return True
-    except Exception as e:
-        print(f"[!] Error downloading image: {e}")
-        return False
-
-def perform_ocr(img_path):
-    """Perform OCR on an image"""
-    try:
-        img = Image.open(img_path)
-        ocr_data = pytesseract.image_to_data(img, lang='chi_sim', output_type=pytesseract.Output.DICT)
-        
-        text_results = []
-        for i, text in enumerate(ocr_data['text']):
-            text_clean = text.strip()
-            if text_clean:
-                text_results.append(text_clean)
-        
-        return " ".join(text_results)
-    except Exception as e:
-        print(f"[!] OCR error: {e}")
-        return ""
-
 def translate_text(text):
     """Translate text using OpenAI"""
     if not text.strip():
@@ -180,7 +146,7 @@ def get_products_with_html_details(conn):
     finally:
         cursor.close()
 
-def process_product_details(conn, product_id, collection_id, sku, html_details):
+def process_product_details(conn, product_id, collection_id, sku, html_details, downloader=None, ocr_engine=None):
     """Process product details through the entire pipeline"""
     print(f"\n=== Processing product {sku} (ID: {product_id}) ===")
     
@@ -200,15 +166,20 @@ def process_product_details(conn, product_id, collection_id, sku, html_details):
         product_images_folder = os.path.join(IMAGES_FOLDER, product_id)
         Path(product_images_folder).mkdir(parents=True, exist_ok=True)
         
-        for i, url in enumerate(image_urls):
-            local_path = os.path.join(product_images_folder, f"{i:02d}.jpg")
-            if is_missing(local_path):
-                print(f"Downloading image {i+1}/{len(image_urls)}")
-                if download_image(url, local_path):
-                    image_paths.append(local_path)
-                time.sleep(1)  # Avoid rate limiting
+        local_paths = [os.path.join(product_images_folder, f"{i:02d}.jpg") for i in range(len(image_urls))]
+        jobs = [(url, local_path) for url, local_path in zip(image_urls, local_paths) if is_missing(local_path)]
+        if jobs:
+            # Concurrent, rate limited per host by the downloader
+            print(f"Downloading {len(jobs)} of {len(image_urls)} images")
+            if downloader is None:
+                single_downloader = open_downloader()
+                try:
+                    download_images(single_downloader, jobs)
+                finally:
+                    close_downloader(single_downloader)
             else:
-                image_paths.append(local_path)
+                download_images(downloader, jobs)
+        image_paths = [local_path for local_path in local_paths if not is_missing(local_path)]
     else:
         print("Skipping image download (--skip-download flag is set)")
         # Still need to collect existing image paths
@@ -224,13 +195,17 @@ def process_product_details(conn, product_id, collection_id, sku, html_details):
     
     if not skip_ocr and image_paths:
         print("Performing OCR on images...")
-        ocr_results = []
-        for img_path in image_paths:
-            text = perform_ocr(img_path)
-            if text:
-                ocr_results.append(text)
+        # One result per image, in page order
+        if ocr_engine is None:
+            single_engine = open_ocr_engine(workers=1)
+            try:
+                ocr_results = [ocr_result_text(result) for result in ocr_images(single_engine, image_paths)]
+            finally:
+                close_ocr_engine(single_engine)
+        else:
+            ocr_results = [ocr_result_text(result) for result in ocr_images(ocr_engine, image_paths)]
         
-        combined_text = " ".join(ocr_results)
+        combined_text = " ".join(text for text in ocr_results if text)
         if not combined_text:
             print(f"No text extracted from images for product {sku}")
             return
@@ -375,17 +350,25 @@ def main():
     # Connect to database
     print("Connecting to database...")
     conn = psycopg2.connect(**DB_CONFIG)
+    downloader = None
+    ocr_engine = None
     
     try:
         # Get products with HTML details
         products = get_products_with_html_details(conn)
         print(f"Found {len(products)} products with HTML details")
         
+        # One connection pool for the image downloads of all products
+        if os.getenv('SKIP_DOWNLOAD', 'false').lower() != 'true':
+            downloader = open_downloader()
+        # OCR worker processes, one per core unless OCR_WORKERS is set
+        if os.getenv('SKIP_OCR', 'false').lower() != 'true':
+            ocr_engine = open_ocr_engine()
+        
         # Process each product
         for product in products:
             product_id, collection_id, sku, html_details = product
-            process_product_details(conn, product_id, collection_id, sku, html_details)
-            time.sleep(1)  # Avoid rate limiting
+            process_product_details(conn, product_id, collection_id, sku, html_details, downloader, ocr_engine)
         
         # Commit all changes (unless in dry run mode)
         if not DRY_RUN:
@@ -399,6 +382,10 @@ def main():
         conn.rollback()
         print(f"Error during ETL process: {e}")
     finally:
+        if downloader is not None:
+            close_downloader(downloader)
+        if ocr_engine is not None:
+            close_ocr_engine(ocr_engine)
         conn.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Async image downloader for the details translator.
+
+All downloads of a run share one aiohttp session, so connections to the
+image CDNs are pooled and kept alive between products. Every host gets
+its own concurrency limit and token bucket (requests per second with a
+small burst); 429 and 5xx responses are retried with exponential backoff,
+honoring Retry-After. Bodies are streamed to a .part file and renamed
+when complete, so an interrupted download never looks like an image.
+
+Usage:
+    downloader = open_downloader()
+    results = download_images(downloader, [(url, save_path), ...])
+    close_downloader(downloader)
+"""
+
+import os
+import time
+import random
+import asyncio
+from urllib.parse import urlsplit
+import aiohttp
+
+# Parallel connections per host and in total
+DOWNLOAD_CONCURRENCY_PER_HOST = int(os.getenv('DOWNLOAD_CONCURRENCY_PER_HOST', '4'))
+DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', '32'))
+# Token bucket per host: requests per second and burst size
+DOWNLOAD_RATE_PER_HOST = float(os.getenv('DOWNLOAD_RATE_PER_HOST', '8'))
+DOWNLOAD_BURST = int(os.getenv('DOWNLOAD_BURST', str(DOWNLOAD_CONCURRENCY_PER_HOST)))
+# Attempts after the first one, for 429/5xx responses and network errors
+DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', '4'))
+DOWNLOAD_TIMEOUT = float(os.getenv('DOWNLOAD_TIMEOUT', '30'))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# First backoff delay and upper bound, in seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+CHUNK_SIZE = 64 * 1024
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+def new_token_bucket(rate, capacity):
+    """Token bucket state: starts full"""
+    return {'rate': rate, 'capacity': capacity, 'tokens': float(capacity), 'updated': time.monotonic()}
+
+async def take_token(bucket):
+    """Wait until the bucket has a token and take it"""
+    while True:
+        now = time.monotonic()
+        bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return
+        await asyncio.sleep((1 - bucket['tokens']) / bucket['rate'])
+
+def host_limits(downloader, url):
+    """Semaphore and token bucket of the URL's host, created on first use"""
+    host = urlsplit(url).netloc.lower()
+    if host not in downloader['hosts']:
+        downloader['hosts'][host] = {
+            'semaphore': asyncio.Semaphore(DOWNLOAD_CONCURRENCY_PER_HOST),
+            'bucket': new_token_bucket(DOWNLOAD_RATE_PER_HOST, max(DOWNLOAD_BURST, 1)),
+        }
+    return downloader['hosts'][host]
+
+def backoff_delay(attempt, retry_after=None):
+    """Delay before the next attempt: Retry-After if the server sent one, else exponential with jitter"""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP date instead of seconds
+    delay = min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def fetch_to_file(downloader, url, save_path):
+    """Stream one URL to save_path, return True on success"""
+    limits = host_limits(downloader, url)
+    stats = downloader['stats']
+    tmp_path = save_path + '.part'
+
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        retry_after = None
+        try:
+            async with limits['semaphore']:
+                await take_token(limits['bucket'])
+                async with downloader['session'].get(url) as response:
+                    if response.status in RETRY_STATUSES:
+                        retry_after = response.headers.get('Retry-After')
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason)
+                    response.raise_for_status()
+
+                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                    with open(tmp_path, 'wb') as f:
+                        async for block in response.content.iter_chunked(CHUNK_SIZE):
+                            f.write(block)
+                            stats['bytes'] += len(block)
+            os.replace(tmp_path, save_path)
+            stats['downloaded'] += 1
+            return True
+        except aiohttp.ClientResponseError as e:
+            error = e
+            retryable = e.status in RETRY_STATUSES
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+            retryable = True
+        except OSError as e:
+            error = e
+            retryable = False
+
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if not retryable or attempt == DOWNLOAD_RETRIES:
+            print(f"[!] Error downloading image {url}: {error}")
+            stats['failed'] += 1
+            return False
+        stats['retries'] += 1
+        await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+async def open_session():
+    """Shared HTTP session with a keep-alive connection pool"""
+    connector = aiohttp.TCPConnector(limit=DOWNLOAD_CONCURRENCY, limit_per_host=DOWNLOAD_CONCURRENCY_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS)
+
+def open_downloader():
+    """Start the event loop and HTTP session used for all downloads of a run"""
+    loop = asyncio.new_event_loop()
+    return {
+        'loop': loop,
+        'session': loop.run_until_complete(open_session()),
+        'hosts': {},
+        'stats': {'downloaded': 0, 'failed': 0, 'retries': 0, 'bytes': 0},
+    }
+
+def download_images(downloader, jobs):
+    """Download (url, save_path) jobs concurrently, return a success flag per job in job order"""
+    async def run_jobs():
+        return await asyncio.gather(*(fetch_to_file(downloader, url, save_path) for url, save_path in jobs))
+    if not jobs:
+        return []
+    return downloader['loop'].run_until_complete(run_jobs())
+
+def close_downloader(downloader):
+    """Close the HTTP session and the event loop, print the download totals"""
+    loop = downloader['loop']
+    loop.run_until_complete(downloader['session'].close())
+    loop.close()
+    stats = downloader['stats']
+    print(f"Downloaded {stats['downloaded']} images ({stats['bytes'] / (1024 * 1024):.1f} MB), "
+          f"{stats['failed']} failed, {stats['retries']} retries")
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Image preparation ahead of OCR.
+
+Supplier detail images are often 750x15000 px strips. Tesseract is slow
+and memory hungry on those, so every image is converted to grayscale,
+downscaled to OCR_MAX_WIDTH and split into tiles of OCR_TILE_HEIGHT
+pixels that overlap by OCR_TILE_OVERLAP pixels. The tiles are OCR'd
+independently (in parallel by ocr_engine.py).
+
+Every tile owns the band between the middles of its overlaps with the
+previous and next tile, and only keeps the words whose vertical center
+lies in that band. A word cut by the edge of one tile lies whole in the
+neighbouring tile, so it is read there exactly once, as long as the
+line is shorter than half the overlap.
+"""
+
+import os
+from PIL import Image
+
+# Wider images are downscaled to this width; web images carry no usable DPI, so the
+# target resolution is a width (text of a 750-1000 px detail image is already legible)
+OCR_MAX_WIDTH = int(os.getenv('OCR_MAX_WIDTH', '1000'))
+# Tile height and overlap in pixels of the downscaled image
+OCR_TILE_HEIGHT = int(os.getenv('OCR_TILE_HEIGHT', '2000'))
+OCR_TILE_OVERLAP = int(os.getenv('OCR_TILE_OVERLAP', '150'))
+
+def preprocess_settings():
+    """Settings that change the OCR input, part of the OCR cache key"""
+    return {
+        'grayscale': True,
+        'max_width': OCR_MAX_WIDTH,
+        'tile_height': OCR_TILE_HEIGHT,
+        'tile_overlap': OCR_TILE_OVERLAP,
+    }
+
+def scaled_size(width, height):
+    """Size of the image after downscaling"""
+    if OCR_MAX_WIDTH <= 0 or width <= OCR_MAX_WIDTH:
+        return width, height
+    scale = OCR_MAX_WIDTH / width
+    return OCR_MAX_WIDTH, max(1, round(height * scale))
+
+def prepare_image(img):
+    """Grayscale, downscaled copy of the image"""
+    img = img.convert('L')
+    size = scaled_size(*img.size)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+def plan_tiles(height):
+    """Tiles of a prepared image of this height: {'top', 'bottom', 'own_top', 'own_bottom'}"""
+    if height <= OCR_TILE_HEIGHT:
+        return [{'top': 0, 'bottom': height, 'own_top': 0, 'own_bottom': height}]
+
+    step = max(OCR_TILE_HEIGHT - OCR_TILE_OVERLAP, 1)
+    tops = list(range(0, height - OCR_TILE_HEIGHT, step)) + [height - OCR_TILE_HEIGHT]
+    tiles = []
+    for i, top in enumerate(tops):
+        bottom = top + OCR_TILE_HEIGHT
+        # Ownership changes in the middle of the overlap with the next tile
+        own_bottom = (tops[i + 1] + bottom) // 2 if i + 1 < len(tops) else height
+        tiles.append({'top': top, 'bottom': bottom,
+                      'own_top': tiles[-1]['own_bottom'] if tiles else 0, 'own_bottom': own_bottom})
+    return tiles
+
+def owned_words(ocr_data, tile):
+    """Words of one tile's image_to_data output whose vertical center lies in the band the tile owns"""
+    words = []
+    for i, text in enumerate(ocr_data['text']):
+        text_clean = text.strip()
+        if not text_clean:
+            continue
+        center = tile['top'] + ocr_data['top'][i] + ocr_data['height'][i] / 2
+        if tile['own_top'] <= center < tile['own_bottom']:
+            words.append(text_clean)
+    return words
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent OCR result cache.
+
+Suppliers reuse the same banner and spec images across many listings, so
+OCR results are stored in a local SQLite file keyed by the SHA-256 of the
+image bytes and a key of the OCR settings (engine, version, language,
+preprocessing). Any product, collection or rerun that meets the same
+image with the same settings reuses the stored words; changing a setting
+simply starts a new set of keys.
+
+Set OCR_CACHE=false to OCR every image again.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime
+
+# Cache file, defaults to ocr_cache.sqlite next to this script
+OCR_CACHE_PATH = os.getenv('OCR_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocr_cache.sqlite'))
+OCR_CACHE_ENABLED = os.getenv('OCR_CACHE', 'true').lower() == 'true'
+
+# Lookups per SELECT, below the SQLite host parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+def image_content_hash(path):
+    """SHA-256 of the image bytes, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def ocr_settings_key(settings):
+    """Short stable key of the settings that change OCR output"""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def open_ocr_cache(path=None):
+    """Open (and create) the cache file, None when the cache is disabled"""
+    if not OCR_CACHE_ENABLED:
+        return None
+    path = path or OCR_CACHE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    # The orchestrator and the batch script may use the cache at the same time
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ocr_cache (
+        image_hash TEXT NOT NULL,
+        settings_key TEXT NOT NULL,
+        words TEXT NOT NULL,
+        created_on TEXT NOT NULL,
+        PRIMARY KEY (image_hash, settings_key)
+    )
+    """)
+    conn.commit()
+    return conn
+
+def lookup_cached_words(cache, image_hashes, settings_key):
+    """Stored words of the images, {image_hash: [(ocr_index, text), ...]}"""
+    found = {}
+    hashes = list(dict.fromkeys(image_hashes))
+    for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+        batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+        rows = cache.execute(f"""
+        SELECT image_hash, words FROM ocr_cache
+        WHERE settings_key = ? AND image_hash IN ({', '.join('?' * len(batch))})
+        """, [settings_key] + batch)
+        for image_hash, words in rows:
+            found[image_hash] = [tuple(word) for word in json.loads(words)]
+    return found
+
+def store_cached_words(cache, entries, settings_key):
+    """Store [(image_hash, words), ...] in one transaction"""
+    if not entries:
+        return
+    created_on = datetime.now().isoformat(timespec='seconds')
+    with cache:
+        cache.executemany("""
+        INSERT OR REPLACE INTO ocr_cache (image_hash, settings_key, words, created_on)
+        VALUES (?, ?, ?, ?)
+        """, [(image_hash, settings_key, json.dumps(words, ensure_ascii=False), created_on)
+              for image_hash, words in entries])
+
+def close_ocr_cache(cache):
+    """Close the cache file"""
+    if cache is not None:
+        cache.close()
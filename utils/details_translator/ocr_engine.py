@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+OCR engine of the details translator.
+
+Tesseract is CPU-bound and single image runs do not use more than one
+core, so images are OCR'd in a pool of worker processes, one per core by
+default. Results come back in the order of the input paths; an image
+that fails (unreadable file, Tesseract error, crashed worker) only yields
+an error for that image.
+
+Used by db_orchestrator.py and 2_ocr_from_images.py:
+    engine = open_ocr_engine()
+    results = ocr_images(engine, image_paths)
+    close_ocr_engine(engine)
+
+Images are prepared once (image_preprocessing.py) in the pool and come
+back split into overlapping tiles; the tiles are the units of work of the
+OCR, so a tall strip is OCR'd on several cores at once.
+
+Images that the text-presence check (text_presence.py) takes for plain
+photos are not OCR'd at all. The check runs in the pool on the image
+decoded for OCR; the Tesseract time it saves is estimated from the
+images that were OCR'd and printed with the totals.
+
+Results are kept in the OCR cache (ocr_cache.py), so an image is only
+OCR'd once per settings, whichever product or script meets it first.
+
+Scripts that open an engine must start from an `if __name__ == "__main__":`
+block, worker processes are spawned on Windows.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytesseract
+from PIL import Image
+from image_preprocessing import preprocess_settings, prepare_image, plan_tiles, owned_words
+from text_presence import TEXT_FILTER_ENABLED, TEXT_MIN_BLOCKS, text_score
+from ocr_cache import (image_content_hash, ocr_settings_key, open_ocr_cache, lookup_cached_words,
+                       store_cached_words, close_ocr_cache)
+
+# Worker processes, 1 runs OCR in the calling process
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '0')) or os.cpu_count() or 1
+OCR_LANG = os.getenv('OCR_LANG', 'chi_sim')
+
+def init_worker(tesseract_cmd):
+    """Worker setup: Tesseract path of the parent, one thread per Tesseract run"""
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    # The pool already uses every core, OpenMP threads inside Tesseract would compete for them
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+def prepare_tiles(img_path, min_text_blocks=None):
+    """Prepare an image once and cut it into tiles: {'tiles': [(tile, width, pixels), ...], 'error', 'skipped', 'seconds', 'filter_seconds'}
+
+    With min_text_blocks the text-presence check runs first on the same
+    decoded image; images scoring below it are skipped without tiles.
+    The pixels of a tile are the raw 8-bit grayscale bytes of its crop.
+    """
+    started = time.perf_counter()
+    filter_seconds = 0.0
+    try:
+        with Image.open(img_path) as img:
+            if min_text_blocks is not None:
+                text_found = text_score(img) >= min_text_blocks
+                filter_seconds = time.perf_counter() - started
+                if not text_found:
+                    return {'tiles': [], 'error': None, 'skipped': True, 'seconds': 0.0, 'filter_seconds': filter_seconds}
+            prepared = prepare_image(img)
+        tiles = [(tile, prepared.width, prepared.crop((0, tile['top'], prepared.width, tile['bottom'])).tobytes())
+                 for tile in plan_tiles(prepared.height)]
+        return {'tiles': tiles, 'error': None, 'skipped': False,
+                'seconds': time.perf_counter() - started - filter_seconds, 'filter_seconds': filter_seconds}
+    except Exception as e:
+        return {'tiles': [], 'error': str(e), 'skipped': False,
+                'seconds': time.perf_counter() - started - filter_seconds, 'filter_seconds': filter_seconds}
+
+def ocr_tile(tile, width, pixels, lang):
+    """OCR one prepared tile: {'words': [text, ...], 'error', 'seconds'}, only the words the tile owns"""
+    started = time.perf_counter()
+    try:
+        tile_img = Image.frombytes('L', (width, tile['bottom'] - tile['top']), pixels)
+        ocr_data = pytesseract.image_to_data(tile_img, lang=lang, output_type=pytesseract.Output.DICT)
+        return {'words': owned_words(ocr_data, tile), 'error': None, 'seconds': time.perf_counter() - started}
+    except (Exception, SystemExit) as e:
+        # pytesseract raises SystemExit for an unusable Tesseract binary
+        return {'words': [], 'error': str(e), 'seconds': time.perf_counter() - started}
+
+def ocr_result_text(result):
+    """Words of an OCR result joined into one text"""
+    return " ".join(text for _, text in result['words'])
+
+def tesseract_version(tesseract_cmd):
+    """Version of the Tesseract binary, None if it cannot be run"""
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except (Exception, SystemExit):
+        return None
+
+def open_ocr_engine(workers=None, lang=None, tesseract_cmd=None, text_filter=None):
+    """Start the OCR worker pool and open the OCR cache"""
+    workers = workers or OCR_WORKERS
+    tesseract_cmd = tesseract_cmd or pytesseract.pytesseract.tesseract_cmd
+    engine = {
+        'workers': workers,
+        'lang': lang or OCR_LANG,
+        'tesseract_cmd': tesseract_cmd,
+        'pool': None,
+        'cache': open_ocr_cache(),
+        'text_filter': TEXT_FILTER_ENABLED if text_filter is None else text_filter,
+        'text_min_blocks': TEXT_MIN_BLOCKS,
+        'stats': {'images': 0, 'failed': 0, 'cached': 0, 'skipped': 0,
+                  'ocr_images': 0, 'ocr_seconds': 0.0, 'filter_seconds': 0.0},
+    }
+    # Everything that changes the words of an image belongs in the cache key
+    engine['settings_key'] = ocr_settings_key({
+        'engine': 'tesseract',
+        'version': tesseract_version(tesseract_cmd),
+        'lang': engine['lang'],
+        'preprocess': preprocess_settings(),
+    })
+    if workers > 1:
+        engine['pool'] = new_pool(engine)
+    print(f"OCR engine: {workers} worker{'s' if workers > 1 else ''}, lang {engine['lang']}, "
+          f"cache {'on' if engine['cache'] is not None else 'off'}")
+    return engine
+
+def new_pool(engine):
+    """Process pool of the engine"""
+    return ProcessPoolExecutor(max_workers=engine['workers'], initializer=init_worker,
+                               initargs=(engine['tesseract_cmd'],))
+
+def collect_results(engine, func, tasks, positions):
+    """Submit the tasks at positions to the pool: ({position: result}, [positions lost to a crashed worker])"""
+    futures = [(position, engine['pool'].submit(func, *tasks[position])) for position in positions]
+    results = {}
+    crashed = []
+    for position, future in futures:
+        try:
+            results[position] = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory) and took every pending task of the pool with it
+            crashed.append(position)
+    return results, crashed
+
+def restart_pool(engine):
+    """Replace a broken pool by a fresh one"""
+    engine['pool'].shutdown(wait=False)
+    engine['pool'] = new_pool(engine)
+
+def retry_crashed(engine, func, tasks, positions, results, failure):
+    """Rerun crashed tasks together in a fresh pool, halving the ones that crash again
+
+    Only the task that kills a worker ends up alone and fails, after about
+    log2(len(positions)) pools instead of one pool per task.
+    """
+    restart_pool(engine)
+    done, crashed = collect_results(engine, func, tasks, positions)
+    results.update(done)
+    if not crashed:
+        return
+    if len(positions) == 1:
+        results[positions[0]] = {**failure, 'error': "OCR worker crashed"}
+        return
+    half = max(len(crashed) // 2, 1)
+    for group in (crashed[:half], crashed[half:]):
+        if group:
+            retry_crashed(engine, func, tasks, group, results, failure)
+
+def run_tasks(engine, func, tasks, failure):
+    """Run func over argument tuples in the pool (or in this process), one result per task in order
+
+    A task whose worker crashes gets the failure result with an error.
+    """
+    if engine['pool'] is None:
+        init_worker(engine['tesseract_cmd'])
+        return [func(*args) for args in tasks]
+
+    results, crashed = collect_results(engine, func, tasks, range(len(tasks)))
+    if crashed:
+        retry_crashed(engine, func, tasks, crashed, results, failure)
+        # The last retry may have left a broken pool behind
+        restart_pool(engine)
+    return [results[position] for position in range(len(tasks))]
+
+def run_ocr(engine, image_paths):
+    """OCR the images tile by tile, one result per path in input order"""
+    # Every image is decoded once in the pool: text check, then conversion, downscaling and tiling
+    min_text_blocks = engine['text_min_blocks'] if engine['text_filter'] else None
+    prepared = run_tasks(engine, prepare_tiles, [(img_path, min_text_blocks) for img_path in image_paths],
+                         {'tiles': [], 'skipped': False, 'seconds': 0.0, 'filter_seconds': 0.0})
+    tasks = [(tile, width, pixels, engine['lang']) for image in prepared for tile, width, pixels in image['tiles']]
+    task_results = iter(run_tasks(engine, ocr_tile, tasks, {'words': [], 'seconds': 0.0}))
+
+    results = []
+    for img_path, image in zip(image_paths, prepared):
+        result = {'path': str(img_path), 'words': [], 'error': image['error'], 'seconds': image['seconds'],
+                  'filter_seconds': image['filter_seconds']}
+        if image['skipped']:
+            results.append({**result, 'skipped': True})
+            continue
+        if image['error']:
+            results.append(result)
+            continue
+        # Tiles come back top to bottom, their owned words do not overlap
+        tile_results = [next(task_results) for _ in image['tiles']]
+        result['seconds'] += sum(tile_result['seconds'] for tile_result in tile_results)
+        errors = [tile_result['error'] for tile_result in tile_results if tile_result['error']]
+        if errors:
+            results.append({**result, 'error': errors[0]})
+            continue
+        texts = [text for tile_result in tile_results for text in tile_result['words']]
+        results.append({**result, 'words': list(enumerate(texts))})
+    return results
+
+def ocr_images(engine, image_paths):
+    """OCR the images in parallel, return one result per path in input order
+
+    Images already in the OCR cache are not OCR'd again, identical images
+    in one call are OCR'd once and images without text (text_presence.py)
+    are skipped with no words.
+    """
+    stats = engine['stats']
+    cache = engine['cache']
+    results = [None] * len(image_paths)
+
+    image_hashes = [None] * len(image_paths)
+    if cache is not None:
+        for position, img_path in enumerate(image_paths):
+            try:
+                image_hashes[position] = image_content_hash(img_path)
+            except OSError as e:
+                results[position] = {'path': str(img_path), 'words': [], 'error': str(e)}
+        cached = lookup_cached_words(cache, [h for h in image_hashes if h], engine['settings_key'])
+        for position, image_hash in enumerate(image_hashes):
+            if image_hash in cached:
+                results[position] = {'path': str(image_paths[position]), 'words': cached[image_hash],
+                                     'error': None, 'cached': True}
+                stats['cached'] += 1
+
+    # First position of every image still to OCR, duplicates share its result
+    pending = {}
+    for position, result in enumerate(results):
+        if result is None:
+            pending.setdefault(image_hashes[position] or position, position)
+
+    ocr_results = run_ocr(engine, [image_paths[position] for position in pending.values()])
+    for result in ocr_results:
+        stats['filter_seconds'] += result['filter_seconds']
+        # Only images OCR'd to the end give the average time a skipped photo saves
+        if not result['error'] and not result.get('skipped'):
+            stats['ocr_images'] += 1
+            stats['ocr_seconds'] += result['seconds']
+    by_key = dict(zip(pending, ocr_results))
+    for position, result in enumerate(results):
+        if result is None:
+            result = by_key[image_hashes[position] or position]
+            results[position] = {**result, 'path': str(image_paths[position])}
+
+    if cache is not None:
+        # Skipped images are not stored, the text threshold may change between runs
+        store_cached_words(cache, [(key, result['words']) for key, result in by_key.items()
+                                   if isinstance(key, str) and not result['error'] and not result.get('skipped')],
+                           engine['settings_key'])
+
+    for result in results:
+        stats['images'] += 1
+        if result.get('skipped'):
+            stats['skipped'] += 1
+        if result['error']:
+            stats['failed'] += 1
+            print(f"[!] OCR error {result['path']}: {result['error']}")
+    return results
+
+def close_ocr_engine(engine):
+    """Stop the worker pool, print the OCR totals"""
+    if engine['pool'] is not None:
+        engine['pool'].shutdown()
+        engine['pool'] = None
+    close_ocr_cache(engine['cache'])
+    stats = engine['stats']
+    print(f"OCR'd {stats['images']} images ({stats['cached']} from cache, {stats['skipped']} without text), "
+          f"{stats['failed']} failed")
+    if engine['text_filter'] and stats['ocr_images']:
+        # Skipped photos are assumed to cost as much as the images that were OCR'd
+        average = stats['ocr_seconds'] / stats['ocr_images']
+        print(f"Text filter: {stats['skipped']} images skipped, {stats['filter_seconds']:.1f} s of checks in the workers, "
+              f"saving about {stats['skipped'] * average:.0f} s of OCR ({average:.1f} s per image)")
@@ -46,6 +46,24 @@ def main():
     parser.add_argument('--tesseract-path', type=str,
                         help='Path to the Tesseract OCR executable')
     
+    parser.add_argument('--download-concurrency', type=int,
+                        help='Parallel image downloads per host (default: 4)')
+    
+    parser.add_argument('--download-rate', type=float,
+                        help='Image requests per second per host (default: 8)')
+    
+    parser.add_argument('--ocr-workers', type=int,
+                        help='OCR worker processes (default: one per CPU core)')
+    
+    parser.add_argument('--no-ocr-cache', action='store_true',
+                        help='OCR every image again instead of reusing cached results')
+    
+    parser.add_argument('--text-threshold', type=int,
+                        help='Text blocks an image needs to be OCR\'d, higher skips more photos (default: 3)')
+    
+    parser.add_argument('--no-text-filter', action='store_true',
+                        help='OCR every image, including those that look like plain photos')
+    
     args = parser.parse_args()
     
     # Set environment variables based on arguments
@@ -81,6 +99,24 @@ def main():
     if args.tesseract_path:
         os.environ['TESSERACT_CMD'] = args.tesseract_path
     
+    if args.download_concurrency:
+        os.environ['DOWNLOAD_CONCURRENCY_PER_HOST'] = str(args.download_concurrency)
+    
+    if args.download_rate:
+        os.environ['DOWNLOAD_RATE_PER_HOST'] = str(args.download_rate)
+    
+    if args.ocr_workers:
+        os.environ['OCR_WORKERS'] = str(args.ocr_workers)
+    
+    if args.no_ocr_cache:
+        os.environ['OCR_CACHE'] = 'false'
+    
+    if args.text_threshold is not None:
+        os.environ['TEXT_MIN_BLOCKS'] = str(args.text_threshold)
+    
+    if args.no_text_filter:
+        os.environ['TEXT_FILTER'] = 'false'
+    
     # Import and run the orchestrator
     from db_orchestrator import main as run_orchestrator
     run_orchestrator()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+# === UTF-8 console for Windows ===
+if os.name == "nt":
+    import ctypes
+    ctypes.windll.kernel32.SetConsoleOutputCP(65001)
+    sys.stdout.reconfigure(encoding='utf-8')
+
+from image_downloader import new_token_bucket, take_token, backoff_delay
+import ocr_cache
+from ocr_cache import ocr_settings_key, open_ocr_cache, lookup_cached_words, store_cached_words, close_ocr_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from image_preprocessing import preprocess_settings, prepare_image, plan_tiles, owned_words, OCR_TILE_HEIGHT, OCR_TILE_OVERLAP
+import ocr_engine
+from ocr_engine import open_ocr_engine, close_ocr_engine, prepare_tiles, ocr_images, run_tasks
+from text_presence import text_score, has_text
+
+def test_token_bucket():
+    """Test that a host gets its burst at once and the rest at the bucket rate"""
+    bucket = new_token_bucket(rate=20, capacity=3)
+
+    async def take(count):
+        started = time.monotonic()
+        times = []
+        for _ in range(count):
+            await take_token(bucket)
+            times.append(time.monotonic() - started)
+        return times
+
+    times = asyncio.run(take(7))
+    assert times[2] < 0.03, f"The burst of 3 must not wait, took {times[2]:.3f} s"
+    # 4 tokens beyond the burst at 20 per second
+    assert 0.18 <= times[-1] < 0.5, f"Expected about 0.2 s for 7 tokens, took {times[-1]:.3f} s"
+    assert bucket['tokens'] < 1, "Bucket must be drained"
+
+    assert backoff_delay(0, retry_after='2') == 2.0, "Retry-After seconds not honoured"
+    assert 0 < backoff_delay(3, retry_after='Wed, 21 Oct 2026 07:28:00 GMT'), "HTTP date Retry-After must fall back to backoff"
+
+    print("✅ token bucket tests passed")
+
+def test_ocr_cache_key():
+    """Test that every OCR setting is part of the cache key and a changed key misses the cache"""
+    settings = {'engine': 'tesseract', 'version': '5.3.0', 'lang': 'chi_sim', 'preprocess': preprocess_settings()}
+    key = ocr_settings_key(settings)
+    assert ocr_settings_key(dict(reversed(list(settings.items())))) == key, "Key must not depend on the order of the settings"
+    assert ocr_settings_key({**settings, 'lang': 'chi_sim+eng'}) != key, "Language not in the key"
+    assert ocr_settings_key({**settings, 'version': '5.4.0'}) != key, "Tesseract version not in the key"
+    assert ocr_settings_key({**settings, 'version': None}) != key, "A missing Tesseract must not share the key"
+    changed = {**settings, 'preprocess': {**settings['preprocess'], 'tile_overlap': 200}}
+    assert ocr_settings_key(changed) != key, "Tiling not in the key"
+
+    work_dir = tempfile.TemporaryDirectory()
+    cache_settings = ocr_cache.OCR_CACHE_ENABLED, ocr_cache.OCR_CACHE_PATH
+    ocr_cache.OCR_CACHE_ENABLED = True
+    ocr_cache.OCR_CACHE_PATH = os.path.join(work_dir.name, 'ocr_cache.sqlite')
+    try:
+        # The engine builds its key from the language and the installed Tesseract
+        keys = []
+        for lang in ['chi_sim', 'eng']:
+            engine = open_ocr_engine(workers=1, lang=lang, tesseract_cmd=os.path.join(work_dir.name, 'no-tesseract'))
+            keys.append(engine['settings_key'])
+            close_ocr_engine(engine)
+        assert keys[0] == ocr_settings_key({**settings, 'version': None}), "Engine key not built from the OCR settings"
+        assert keys[0] != keys[1], "Engines with different languages share the cache key"
+
+        cache = open_ocr_cache()
+        store_cached_words(cache, [('hash-1', [(0, '实木'), (1, '餐桌')])], key)
+        assert lookup_cached_words(cache, ['hash-1', 'hash-2'], key) == {'hash-1': [(0, '实木'), (1, '餐桌')]}, "Stored words not found"
+        assert lookup_cached_words(cache, ['hash-1'], ocr_settings_key(changed)) == {}, "Other settings must miss the cache"
+        close_ocr_cache(cache)
+    finally:
+        ocr_cache.OCR_CACHE_ENABLED, ocr_cache.OCR_CACHE_PATH = cache_settings
+        work_dir.cleanup()
+
+    print("✅ OCR cache key tests passed")
+
+def test_tiles():
+    """Test that every word is read exactly once across tile boundaries"""
+    assert plan_tiles(OCR_TILE_HEIGHT) == [{'top': 0, 'bottom': OCR_TILE_HEIGHT, 'own_top': 0, 'own_bottom': OCR_TILE_HEIGHT}], "Short image must be one tile"
+
+    line_height = OCR_TILE_OVERLAP // 2
+    for height in [OCR_TILE_HEIGHT + 1, 2 * OCR_TILE_HEIGHT, 7 * OCR_TILE_HEIGHT + 123]:
+        tiles = plan_tiles(height)
+        assert tiles[0]['top'] == 0 and tiles[-1]['bottom'] == height, f"Tiles of {height} px do not cover the image"
+        assert all(a['own_bottom'] == b['own_top'] for a, b in zip(tiles, tiles[1:])), "Owned bands must be adjacent"
+        assert all(a['bottom'] - b['top'] >= OCR_TILE_OVERLAP for a, b in zip(tiles, tiles[1:])), "Tiles must overlap"
+
+        # A line every 7 px, so lines straddle every tile edge and ownership boundary
+        lines = [(f"w{top}", top) for top in range(0, height - line_height, 7)]
+        words = []
+        for tile in tiles:
+            # Tesseract only reads the lines that lie whole in the tile, positions relative to the tile
+            inside = [(text, top - tile['top']) for text, top in lines if top >= tile['top'] and top + line_height <= tile['bottom']]
+            ocr_data = {'text': [text for text, _ in inside] + ['  '],
+                        'top': [top for _, top in inside] + [0],
+                        'height': [line_height] * len(inside) + [line_height]}
+            words += owned_words(ocr_data, tile)
+        assert words == [text for text, _ in lines], f"Words lost or duplicated in a {height} px image"
+
+    # Tiles are cut from the image prepared once
+    work_dir = tempfile.TemporaryDirectory()
+    try:
+        img_path = os.path.join(work_dir.name, 'strip.png')
+        pixels = (np.random.RandomState(0).rand(3 * OCR_TILE_HEIGHT, 750, 3) * 255).astype('uint8')
+        Image.fromarray(pixels).save(img_path)
+        prepared = prepare_tiles(img_path)
+        with Image.open(img_path) as img:
+            whole = prepare_image(img)
+        assert prepared['error'] is None and len(prepared['tiles']) == len(plan_tiles(whole.height)), "Unexpected tiles"
+        for tile, width, tile_pixels in prepared['tiles']:
+            expected = whole.crop((0, tile['top'], whole.width, tile['bottom'])).tobytes()
+            assert width == whole.width and tile_pixels == expected, f"Tile at {tile['top']} differs from the prepared image"
+        assert prepare_tiles(os.path.join(work_dir.name, 'missing.png'))['error'], "Unreadable image must yield an error"
+        # The text check runs on the same decoded image, a photo-like strip gets no tiles
+        skipped = prepare_tiles(img_path, min_text_blocks=1)
+        assert skipped['skipped'] and skipped['tiles'] == [] and skipped['error'] is None, "Image without text not skipped"
+    finally:
+        work_dir.cleanup()
+
+    print("✅ tile tests passed")
+
+def text_page():
+    """White page with lines of text"""
+    img = Image.new('RGB', (750, 1000), 'white')
+    draw = ImageDraw.Draw(img)
+    for i in range(12):
+        draw.text((40, 60 + i * 40), "Dimensions 120x60x75 cm  solid oak frame", fill=(20, 20, 20), font=ImageFont.load_default())
+    return img
+
+def test_text_score():
+    """Test that text scores above the threshold and photo-like images do not"""
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[0:1000, 0:750]
+    gradient = Image.fromarray((120 + 60 * np.sin(x / 200) + 40 * np.cos(y / 150)).astype('uint8'))
+    fabric = Image.fromarray(rng.normal(128, 45, (1000, 750)).clip(0, 255).astype('uint8'))
+    grid = Image.new('L', (750, 1000), 230)
+    draw = ImageDraw.Draw(grid)
+    for position in range(0, 1000, 12):
+        draw.line([position, 0, position, 1000], fill=40, width=2)
+        draw.line([0, position, 750, position], fill=40, width=2)
+
+    assert text_score(text_page()) >= 50, f"Text page scored {text_score(text_page())}"
+    for name, img in [('blank', Image.new('RGB', (750, 1000), 'white')), ('gradient', gradient),
+                      ('fabric', fabric), ('grid', grid), ('tiny', Image.new('L', (20, 20)))]:
+        assert text_score(img) == 0, f"{name} image scored {text_score(img)}"
+    assert has_text('missing.jpg') == (True, None), "Unreadable images must be left to OCR"
+
+    print("✅ text score tests passed")
+
+def test_failed_images():
+    """Test that failing images yield error results and do not count in the OCR time average"""
+    work_dir = tempfile.TemporaryDirectory()
+    cache_enabled = ocr_cache.OCR_CACHE_ENABLED
+    ocr_cache.OCR_CACHE_ENABLED = False
+    try:
+        broken_path = os.path.join(work_dir.name, 'broken.jpg')
+        with open(broken_path, 'wb') as f:
+            f.write(b'not an image')
+        blank_path = os.path.join(work_dir.name, 'blank.jpg')
+        Image.new('RGB', (750, 1000), 'white').save(blank_path)
+        text_path = os.path.join(work_dir.name, 'text.png')
+        text_page().save(text_path)
+
+        # Without a Tesseract binary the text page fails in OCR, the broken file already in preparation
+        engine = open_ocr_engine(workers=1, tesseract_cmd=os.path.join(work_dir.name, 'no-tesseract'), text_filter=True)
+        results = ocr_images(engine, [broken_path, blank_path, text_path])
+        close_ocr_engine(engine)
+
+        assert [result['path'] for result in results] == [broken_path, blank_path, text_path], "Results out of order"
+        assert results[0]['error'] and results[2]['error'], "Failing images must yield an error"
+        assert results[1]['error'] is None and results[1].get('skipped'), "Blank image must be skipped"
+        assert all(result['words'] == [] for result in results), "Failed and skipped images have no words"
+        stats = engine['stats']
+        assert stats['failed'] == 2 and stats['skipped'] == 1, f"Unexpected totals {stats}"
+        assert stats['ocr_images'] == 0 and stats['ocr_seconds'] == 0, "Failed images must not count in the OCR average"
+    finally:
+        ocr_cache.OCR_CACHE_ENABLED = cache_enabled
+        work_dir.cleanup()
+
+    print("✅ failed image tests passed")
+
+def exit_on_zero(value):
+    """Pool task that kills its worker process for 0"""
+    if value == 0:
+        os._exit(1)
+    return {'value': value, 'error': None}
+
+def test_crashed_worker():
+    """Test that a task killing its worker fails alone, without a new pool per lost task"""
+    spawned = []
+    new_pool = ocr_engine.new_pool
+    ocr_engine.new_pool = lambda engine: spawned.append(1) or new_pool(engine)
+    engine = {'workers': 2, 'tesseract_cmd': 'tesseract', 'pool': None}
+    try:
+        engine['pool'] = ocr_engine.new_pool(engine)
+        tasks = [(value,) for value in range(40)]
+        results = run_tasks(engine, exit_on_zero, tasks, {'value': None})
+        engine['pool'].shutdown()
+    finally:
+        ocr_engine.new_pool = new_pool
+
+    assert results[0] == {'value': None, 'error': "OCR worker crashed"}, f"Unexpected result {results[0]}"
+    assert [result['value'] for result in results[1:]] == list(range(1, 40)), "Other tasks must succeed"
+    # Initial pool, halving retries down to the crashing task, final fresh pool
+    assert len(spawned) <= 16, f"{len(spawned)} pools for one crashing task"
+
+    print("✅ crashed worker tests passed")
+
+def run_tests():
+    """Run all tests"""
+    print("Running details translator tests...\n")
+
+    test_token_bucket()
+    test_ocr_cache_key()
+    test_tiles()
+    test_text_score()
+    test_failed_images()
+    test_crashed_worker()
+
+    print("\n✅ All tests passed!")
+
+if __name__ == "__main__":
+    run_tests()
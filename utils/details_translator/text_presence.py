@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap text-presence check ahead of OCR.
+
+Many detail images are plain product photos; this check marks them so
+they can skip Tesseract. It works on strong-edge statistics in 16x16
+blocks of a grayscale copy (NumPy only, a few ms per image):
+
+- a text block has strong edges in both directions (strokes), but is
+  not covered by them (noise, fabric)
+- text lines are separated by gaps: at least 3 pixel rows without any
+  edge close above or below the block (rules out grids such as rattan)
+- text runs horizontally: only runs of at least 3 adjacent text blocks
+  count (rules out isolated corners of product outlines)
+
+The score is the number of blocks in such runs; images scoring below
+TEXT_MIN_BLOCKS are treated as photos. Raise it to skip more images,
+set TEXT_FILTER=false to OCR everything.
+"""
+
+import os
+import numpy as np
+from PIL import Image
+
+TEXT_FILTER_ENABLED = os.getenv('TEXT_FILTER', 'true').lower() == 'true'
+TEXT_MIN_BLOCKS = int(os.getenv('TEXT_MIN_BLOCKS', '3'))
+
+# Wider images are analysed at this width
+ANALYSIS_WIDTH = 800
+BLOCK_SIZE = 16
+# Gray level step over 2 pixels that counts as an edge
+EDGE_THRESHOLD = 60
+# Share of edge pixels a text block has in each direction, and at most in total
+MIN_DIRECTION_DENSITY = 0.03
+MAX_EDGE_DENSITY = 0.6
+# Quiet pixel rows in a row that make a gap between text lines
+MIN_GAP_ROWS = 3
+# Adjacent text blocks that make a run
+MIN_RUN_BLOCKS = 3
+
+def block_means(mask):
+    """Share of True pixels per BLOCK_SIZE x BLOCK_SIZE block"""
+    rows, cols = mask.shape[0] // BLOCK_SIZE, mask.shape[1] // BLOCK_SIZE
+    return mask[:rows * BLOCK_SIZE, :cols * BLOCK_SIZE].reshape(rows, BLOCK_SIZE, cols, BLOCK_SIZE).mean(axis=(1, 3))
+
+def runs_of(mask, length):
+    """Cells of mask that belong to a horizontal run of at least length True cells"""
+    if mask.shape[1] < length:
+        return np.zeros_like(mask)
+    windows = mask[:, :mask.shape[1] - length + 1].copy()
+    for offset in range(1, length):
+        windows &= mask[:, offset:mask.shape[1] - length + 1 + offset]
+    in_run = np.zeros_like(mask)
+    for offset in range(length):
+        in_run[:, offset:mask.shape[1] - length + 1 + offset] |= windows
+    return in_run
+
+def text_score(img):
+    """Number of blocks of a PIL image that look like lines of text"""
+    gray = img.convert('L')
+    if gray.width > ANALYSIS_WIDTH:
+        gray = gray.resize((ANALYSIS_WIDTH, max(1, round(gray.height * ANALYSIS_WIDTH / gray.width))), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    if pixels.shape[0] < 2 * BLOCK_SIZE or pixels.shape[1] < MIN_RUN_BLOCKS * BLOCK_SIZE:
+        return 0
+
+    # Edges across columns (vertical strokes) and across rows (horizontal strokes), on a common grid;
+    # steps over 2 pixels, so anti-aliased low contrast text still counts
+    edges_x = np.abs(pixels[:-2, 2:] - pixels[:-2, :-2]) > EDGE_THRESHOLD
+    edges_y = np.abs(pixels[2:, :-2] - pixels[:-2, :-2]) > EDGE_THRESHOLD
+    density_x = block_means(edges_x)
+    density_y = block_means(edges_y)
+    text_blocks = ((density_x >= MIN_DIRECTION_DENSITY) & (density_y >= MIN_DIRECTION_DENSITY)
+                   & (density_x + density_y <= MAX_EDGE_DENSITY))
+
+    # Pixel rows without edges within each block column, and gaps of MIN_GAP_ROWS of them
+    rows, cols = text_blocks.shape
+    edges = (edges_x | edges_y)[:rows * BLOCK_SIZE, :cols * BLOCK_SIZE]
+    quiet = ~edges.reshape(rows * BLOCK_SIZE, cols, BLOCK_SIZE).any(axis=2)
+    gaps = quiet[:quiet.shape[0] - MIN_GAP_ROWS + 1].copy()
+    for offset in range(1, MIN_GAP_ROWS):
+        gaps &= quiet[offset:quiet.shape[0] - MIN_GAP_ROWS + 1 + offset]
+    gaps = np.vstack([gaps, np.zeros((MIN_GAP_ROWS - 1, cols), dtype=bool)])
+    gap_blocks = gaps.reshape(rows, BLOCK_SIZE, cols).any(axis=1)
+    # A gap in the block itself or in the block above or below
+    near_gap = gap_blocks.copy()
+    near_gap[1:] |= gap_blocks[:-1]
+    near_gap[:-1] |= gap_blocks[1:]
+
+    return int(runs_of(text_blocks & near_gap, MIN_RUN_BLOCKS).sum())
+
+def has_text(img_path, min_blocks=None):
+    """(True if the image likely contains text, its score); unreadable images count as text"""
+    min_blocks = TEXT_MIN_BLOCKS if min_blocks is None else min_blocks
+    try:
+        with Image.open(img_path) as img:
+            score = text_score(img)
+    except Exception:
+        # Let OCR report the error
+        return True, None
+    return score >= min_blocks, score
@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import io
+import json
+import hashlib
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_values, execute_batch
 import uuid
 from dotenv import load_dotenv
 import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice, chain
+from raw_data_cache import (load_raw_frame, iter_raw_chunks, read_raw_columns, file_content_hash,
+                            FILE_HASH_CACHE, open_record_reader, read_record_fields, close_record_reader)
+from etl_metrics import (stage, count_statement, count_rows, statement_table, count_master_groups, connect_db,
+                         reset_run_stats, merge_run_stats, build_run_summary, print_run_summary, write_run_summary, save_run_summary, RUN_STATS)
 
 # === UTF-8 консоль для Windows ===
 if os.name == "nt":
@@ -31,6 +43,61 @@ DB_CONFIG = {
 RAW_CSV_PATH = os.getenv('RAW_CSV_PATH', 'x:\\DATA_STORAGE\\Furnithai\\RAW_WXW\\latest_Raw Data.csv')
 MAPPING_CSV_PATH = os.getenv('MAPPING_CSV_PATH', 'x:\\DATA_STORAGE\\Furnithai\\utils\\importer\\map.csv')
 DRY_RUN = os.getenv('DRY_RUN', 'false').lower() == 'true'
+# Bulk mode: COPY into staging tables + one INSERT ... ON CONFLICT per table
+BULK_LOAD = os.getenv('BULK_LOAD', 'false').lower() == 'true'
+# Streaming mode: read the CSV in chunks of this many rows (0 = read the whole file)
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '0'))
+# Parallel mode: number of worker processes, master codes are hash-partitioned between them
+WORKERS = int(os.getenv('ETL_WORKERS', '1'))
+# Incremental mode: skip master codes whose content fingerprint did not change since the last run
+INCREMENTAL = os.getenv('INCREMENTAL', 'false').lower() == 'true'
+# Planning mode: one read-only snapshot, insert/update/skip plan computed in memory, nothing written
+PLAN_ONLY = os.getenv('PLAN_ONLY', 'false').lower() == 'true'
+# Checkpointed mode: commit every N master codes and record the progress in etl_checkpoint
+COMMIT_EVERY = int(os.getenv('COMMIT_EVERY', '0'))
+# Resume from the checkpoint of the same raw file instead of starting over
+RESUME = os.getenv('RESUME', 'false').lower() == 'true'
+# Two-pass mode: heavy raw text columns are read from the CSV by byte offset, for template rows only
+LAZY_HEAVY_COLUMNS = os.getenv('LAZY_HEAVY_COLUMNS', 'false').lower() == 'true'
+# Raw text columns with at most this share of distinct values are held as categoricals (0 = keep plain text)
+CATEGORICAL_MAX_RATIO = float(os.getenv('CATEGORICAL_MAX_RATIO', '0.5'))
+# Row-by-row writes are queued as prepared statements and sent in pages of this many statements
+WRITE_BATCH_SIZE = max(int(os.getenv('WRITE_BATCH_SIZE', '500')), 1)
+PLAN_REPORT_PATH = os.getenv('PLAN_REPORT_PATH', 'etl_plan.json')
+# Offline mode: write COPY-ready files per target table to this directory instead of the database
+STAGE_DIR = os.getenv('STAGE_DIR')
+
+# Chinese language ID - should be configurable
+ZH_LANG_ID = "365d96e3-9f08-4d2e-bf17-18a26a5072f7"
+# Existing category translation used as a placeholder to avoid the FK constraint
+CATEGORY_PLACEHOLDER_TRANS_ID = "646b58d9-de22-4459-b4f1-8302e8d64c7d"
+
+# Unique indexes required by the ON CONFLICT clauses of the bulk mode
+UPSERT_INDEXES_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_upsert_indexes.sql')
+UPSERT_INDEXES = ['ux_product_collection_master_code', 'ux_product_collection_sku', 'ux_product_collection_translations_key']
+# content_hash columns and unique indexes of the content-addressed blob tables, required by every mode
+CONTENT_HASH_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_content_hash_columns.sql')
+CONTENT_HASH_TABLES = ['product_collection_img_array', 'custom_attributes_raw', 'details_html',
+                       'product_attributes_raw_collection']
+# Fingerprint table of the incremental mode
+IMPORT_STATE_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_import_state_table.sql')
+# Progress table of the checkpointed mode
+CHECKPOINT_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_etl_checkpoint_table.sql')
+
+# Optional path of a JSON file receiving the run summary (the summary is always printed and stored in etl_run)
+SUMMARY_PATH = os.getenv('ETL_SUMMARY_PATH')
+
+# Raw columns read by the importer in addition to the ones listed in map.csv
+COLLECTION_RAW_COLUMNS = ['Master Code', 'Product Image', 'Category Name', 'Custom Attributes', 'Web Page Details', 'Video']
+PRODUCT_RAW_COLUMNS = ['Master Code', 'SKU Code', 'Sku Attribute']
+# Large unmapped text columns that are only used from the template row of a master code
+HEAVY_RAW_COLUMNS = ['Web Page Details', 'Custom Attributes']
+# Key columns, stripped even when unmapped (all raw columns are read as text)
+RAW_KEY_COLUMNS = ['Master Code', 'SKU Code']
+# Collection fields copied into every product of the collection
+INHERITED_COLUMNS = ['product_collection_url', 'product_collection_image', 'images']
+# Product fields that use a decimal comma in the supplier export
+DECIMAL_COMMA_FIELDS = ['product_selling_price']
 
 # Helper functions
 def generate_uuid():
@@ -59,7 +126,7 @@ def parse_array(array_str):
     """Parse array strings like '[url1, url2, url3]' into Python lists"""
     if not array_str or not isinstance(array_str, str):
         return []
-    
+
     # Extract URLs using regex
     urls = re.findall(r'https?://[^\s,\]]+', array_str)
     return urls
@@ -68,7 +135,7 @@ def parse_attributes(attr_str):
     """Parse custom attributes string into key-value pairs"""
     if not attr_str or not isinstance(attr_str, str):
         return []
-    
+
     result = []
     # Split by dash and then by colon
     for pair in attr_str.split('-'):
@@ -82,555 +149,2176 @@ def parse_attributes(attr_str):
                 result.append((k.strip(), v.strip()))
     return result
 
-def main():
-    print("Starting ETL process...")
-    
-    if DRY_RUN:
-        print("DRY RUN MODE: No changes will be committed to the database")
-    
-    # 1. Load mapping configuration
-    print("Loading mapping configuration...")
-    df_map = pd.read_csv(MAPPING_CSV_PATH, encoding='utf-8')
+def load_mapping(mapping_path):
+    """Load map.csv into {raw column: {'table': ..., 'column': ...}}"""
+    df_map = pd.read_csv(mapping_path, encoding='utf-8')
     mapping = {}
     for _, row in df_map.iterrows():
         raw_col = str(row['raw_input_field']).strip()
         table = str(row['db_table']).strip()
         column = str(row['field']).strip() if not pd.isna(row['field']) else ""
         mapping[raw_col] = {'table': table, 'column': column}
-    
-    # 2. Read CSV data
-    print(f"Reading data from {RAW_CSV_PATH}...")
-    raw_df = pd.read_csv(RAW_CSV_PATH, sep=';', encoding='utf-8')
-    
-    # Connect to database
-    print("Connecting to database...")
-    conn = psycopg2.connect(**DB_CONFIG)
+    return mapping
+
+def compile_mapping(mapping, columns):
+    """Compile map.csv against the CSV header into per-table column lists
+
+    Only columns present in the file are kept, so the row loop never has
+    to consult the mapping again.
+    """
+    def mapped(table, require_field=True):
+        return [(col, mapping[col]['column']) for col in columns
+                if col in mapping and mapping[col]['table'] == table
+                and (mapping[col]['column'] or not require_field)]
+
+    field_map = {
+        'product_collection': mapped('product_collection'),
+        'product_collection_translations': [col for col, _ in mapped('product_collection_translations', require_field=False)],
+        'product': mapped('product'),
+    }
+
+    collection_columns = [col for col, _ in field_map['product_collection']] + field_map['product_collection_translations']
+    product_columns = [col for col, _ in field_map['product']]
+
+    # Mapped values are stripped, raw blobs (HTML, attributes) are stored as they are
+    field_map['strip_columns'] = [col for col in columns
+                                  if col in collection_columns or col in product_columns or col in RAW_KEY_COLUMNS]
+    field_map['decimal_comma_columns'] = [col for col, db_col in field_map['product'] if db_col in DECIMAL_COMMA_FIELDS]
+    field_map['collection_fingerprint'] = [col for col in columns if col in collection_columns or col in COLLECTION_RAW_COLUMNS]
+    field_map['product_fingerprint'] = [col for col in columns if col in product_columns or col in PRODUCT_RAW_COLUMNS]
+    # Columns actually read from the raw file, everything else is pruned
+    field_map['columns'] = [col for col in columns
+                            if col in field_map['collection_fingerprint'] or col in field_map['product_fingerprint']]
+    # Heavy columns can be loaded lazily, unless they are mapped and normalized like the rest
+    field_map['heavy_columns'] = [col for col in field_map['columns']
+                                  if col in HEAVY_RAW_COLUMNS and col not in field_map['strip_columns']]
+    field_map['narrow_columns'] = [col for col in field_map['columns'] if col not in field_map['heavy_columns']]
+    return field_map
+
+def read_columns(field_map):
+    """Columns loaded into the DataFrame: all used columns, or only the narrow ones in two-pass mode"""
+    return field_map['narrow_columns'] if LAZY_HEAVY_COLUMNS else field_map['columns']
+
+def attach_heavy_columns(master_groups, csv_path, field_map):
+    """Second pass of the two-pass mode: add the heavy columns to every group's template row
+
+    Each template row is read from the CSV by its byte offset (row labels
+    are record numbers), so heavy values of variation rows are never
+    loaded and only the groups in flight hold any heavy text.
+    """
+    heavy_columns = field_map['heavy_columns']
+    if not LAZY_HEAVY_COLUMNS or not heavy_columns:
+        yield from master_groups
+        return
+
+    with stage('read_heavy_columns'):
+        reader = open_record_reader(csv_path)
+    try:
+        for master_code, master_rows in master_groups:
+            template_label = master_rows.index[0]
+            with stage('read_heavy_columns'):
+                values = read_record_fields(reader, template_label, heavy_columns + ['Master Code'])
+            if str(values['Master Code']).strip() != str(master_code):
+                raise ValueError(f"Record {template_label} of {csv_path} is not master code {master_code}, "
+                                 "run without --lazy-heavy-columns to import this file")
+
+            master_rows = master_rows.copy()
+            for col in heavy_columns:
+                master_rows[col] = pd.Series([values[col]] + [None] * (len(master_rows) - 1),
+                                             index=master_rows.index, dtype=object)
+            yield master_code, master_rows
+    finally:
+        close_record_reader(reader)
+
+def normalize_frame(raw_df, field_map):
+    """Whole-column type normalization before the row loop
+
+    Strips mapped text columns, turns decimal-comma prices into dots and
+    replaces NaN / numpy scalars with None / native Python values.
+    """
+    raw_df = raw_df.astype(object)
+
+    for col in field_map['strip_columns']:
+        series = raw_df[col]
+        is_text = series.map(type) == str
+        raw_df[col] = series.where(~is_text, series[is_text].str.strip())
+
+    for col in field_map['decimal_comma_columns']:
+        series = raw_df[col]
+        is_text = series.map(type) == str
+        raw_df[col] = series.where(~is_text, series[is_text].str.replace(',', '.', regex=False))
+
+    return raw_df.where(raw_df.notna(), None)
+
+def compact_frame(raw_df, max_ratio=None):
+    """Hold repetitive text columns as categoricals, report the memory before and after
+
+    A column qualifies when its distinct values are at most max_ratio of
+    its rows: every distinct string is then stored once and the rows only
+    keep small integer codes. iter_master_groups() hands the groups out as
+    plain text again.
+    """
+    max_ratio = CATEGORICAL_MAX_RATIO if max_ratio is None else max_ratio
+    if max_ratio <= 0 or raw_df.empty:
+        return raw_df
+
+    before = raw_df.memory_usage(deep=True).sum()
+    compacted = []
+    for col in raw_df.columns:
+        if raw_df[col].nunique() <= max_ratio * len(raw_df):
+            raw_df[col] = raw_df[col].astype('category')
+            compacted.append(col)
+    after = raw_df.memory_usage(deep=True).sum()
+
+    RUN_STATS['frame_memory_mb'] = {'before': round(before / 2 ** 20, 1), 'after': round(after / 2 ** 20, 1)}
+    print(f"Raw data in memory: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB "
+          f"({len(compacted)} categorical columns: {', '.join(compacted)})")
+    return raw_df
+
+def iter_master_groups(raw_df):
+    """Yield (master_code, rows) once per master code, in file order
+
+    The frame is partitioned in a single pass, the first row of every
+    partition is the collection template and the rest are its variations.
+    """
+    if any(isinstance(dtype, pd.CategoricalDtype) for dtype in raw_df.dtypes):
+        yield from iter_compact_groups(raw_df)
+        return
+
+    for master_code, master_rows in raw_df.groupby('Master Code', sort=False):
+        yield master_code, master_rows
+
+def iter_compact_groups(raw_df):
+    """iter_master_groups() for a compact_frame(): groups come out as plain text, None for missing values
+
+    Every column is decoded once into a value lookup (categoricals) or an
+    object array, each group is then built from its row positions only.
+    """
+    columns = {}
+    for col in raw_df.columns:
+        series = raw_df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # code -> value, the extra last entry maps the missing code -1 to None
+            lookup = np.append(np.asarray(series.cat.categories, dtype=object), None)
+            columns[col] = (lookup, series.cat.codes.to_numpy())
+        else:
+            columns[col] = (None, series.to_numpy(dtype=object))
+
+    # Group numbers in order of first appearance, rows without a master code are dropped like groupby() does
+    group_ids, master_codes = pd.factorize(raw_df['Master Code'])
+    order = np.argsort(group_ids, kind='stable')
+    order = order[group_ids[order] >= 0]
+    boundaries = np.flatnonzero(np.diff(group_ids[order])) + 1
+
+    for positions in np.split(order, boundaries):
+        if not len(positions):
+            continue
+        data = {col: lookup[array[positions]] if lookup is not None else array[positions]
+                for col, (lookup, array) in columns.items()}
+        yield master_codes[group_ids[positions[0]]], pd.DataFrame(data, index=raw_df.index[positions], dtype=object)
+
+def iter_master_groups_chunked(csv_path, chunk_size, field_map):
+    """Stream the CSV in chunks of chunk_size rows and yield complete master code groups
+
+    Rows of a master code are expected to be contiguous in the export. The
+    last master code of every chunk may continue in the next one, so its
+    rows are carried over instead of being yielded early. Peak memory is
+    bounded by the chunk size plus the largest single group.
+    """
+    carry = None
+    seen_master_codes = set()
+
+    def complete_groups(rows):
+        for master_code, master_rows in iter_master_groups(rows):
+            key = str(master_code)
+            if key in seen_master_codes:
+                raise ValueError(f"Master code {master_code} is not contiguous in {csv_path}, "
+                                 "run without --chunk-size to import this file")
+            seen_master_codes.add(key)
+            yield master_code, master_rows
+
+    raw_chunks = iter_raw_chunks(csv_path, chunk_size, read_columns(field_map))
+    while True:
+        # Only the read itself is timed, not the consumer of the yielded groups
+        with stage('read_csv'):
+            chunk = next(raw_chunks, None)
+            if chunk is not None:
+                chunk = normalize_frame(chunk[chunk['Master Code'].notna()], field_map)
+        if chunk is None:
+            break
+
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if chunk.empty:
+            continue
+
+        last_master_code = chunk['Master Code'].iloc[-1]
+        is_open_group = chunk['Master Code'] == last_master_code
+        carry = chunk[is_open_group]
+        yield from complete_groups(chunk[~is_open_group])
+
+    if carry is not None and not carry.empty:
+        yield from complete_groups(carry)
+
+def extract_collection_data(row, field_map):
+    """Build the product_collection record from the template row of a master code"""
+    collection_data = {}
+    for raw_col, db_col in field_map['product_collection']:
+        value = row[raw_col]
+
+        # Special handling for arrays
+        if db_col == 'product_collection_img_array':
+            value = parse_array(value)
+
+        collection_data[db_col] = value
+
+    collection_data['id'] = generate_uuid()
+    # Generate UUID for product_collection_name
+    collection_data['product_collection_name'] = generate_uuid()
+    return collection_data
+
+def extract_collection_translation(row, field_map):
+    """Return the product_collection_name translation value of a template row"""
+    translation = None
+    for raw_col in field_map['product_collection_translations']:
+        value = row[raw_col]
+        if value:
+            translation = value
+    return translation
+
+def extract_product_data(var_row, field_map):
+    """Build the product record for a variation row (empty values are skipped)"""
+    product_data = {}
+    for raw_col, db_col in field_map['product']:
+        value = var_row[raw_col]
+        if value:  # Only update if value is not empty
+            product_data[db_col] = value
+
+    product_data['id'] = generate_uuid()
+
+    # Store master code for easier querying
+    row_master_code = var_row.get('Master Code')
+    if row_master_code:
+        product_data['product_collection_master_code'] = row_master_code
+
+    # Extract SKU code
+    sku_code = var_row.get('SKU Code')
+    if sku_code:
+        product_data['product_collection_sku'] = sku_code
+
+    return product_data
+
+# === Lookup cache ===
+def load_lookup_cache(cur):
+    """Prefetch master_code -> collection ID, SKU -> product ID and category lookups
+
+    Keys are stored as text so numeric codes read from the CSV match the
+    values stored in the database. The writers keep the maps up to date.
+    """
+    cache = {
+        'collection_ids': {},
+        'product_ids': {},
+        # collection_id -> ID of its zh product_collection_name translation
+        'translation_ids': {},
+        # content_hash -> ID of the product_attributes_raw_collection row with that Sku Attribute
+        'sku_attribute_ids': {},
+        'category_ids': load_category_ids(cur),
+        # (collection_id, category_name) pairs waiting for link_categories()
+        'category_links': [],
+        # Queued statements, flushed with flush_writer()
+        'writer': new_writer(cur)
+    }
+
+    cur.execute("""
+    SELECT master_code, id FROM product_collection
+    WHERE master_code IS NOT NULL
+    """)
+    for master_code, collection_id in cur.fetchall():
+        cache['collection_ids'][str(master_code)] = collection_id
+
+    cur.execute("""
+    SELECT product_collection_sku, id FROM product
+    WHERE product_collection_sku IS NOT NULL
+    """)
+    for sku, product_id in cur.fetchall():
+        cache['product_ids'][str(sku)] = product_id
+
+    cur.execute("""
+    SELECT product_id, id FROM product_collection_translations
+    WHERE lang_id = %s AND field_name = %s
+    """, (ZH_LANG_ID, "product_collection_name"))
+    for collection_id, translation_id in cur.fetchall():
+        cache['translation_ids'][str(collection_id)] = translation_id
+
+    cur.execute("""
+    SELECT content_hash, id FROM product_attributes_raw_collection
+    WHERE content_hash IS NOT NULL
+    """)
+    cache['sku_attribute_ids'] = dict(cur.fetchall())
+
+    print(f"Lookup cache: {len(cache['collection_ids'])} collections, {len(cache['product_ids'])} products")
+    return cache
+
+# === Batched writer: prepared statements sent in pages ===
+# Queues are flushed parents first, so foreign keys between queued rows resolve
+WRITER_FLUSH_ORDER = ['product_collection', 'product_collection_translations', 'links',
+                      'product_attributes_raw_collection', 'product']
+
+def new_writer(cur, batch_size=None):
+    """Create a statement queue for cur
+
+    Statements are written with %s placeholders, prepared once per SQL
+    text (PREPARE) and executed in pages with execute_batch, so a page
+    costs one round trip and no parsing.
+    """
+    # Prepared statements live for the session, drop the ones of a previous writer
+    cur.execute("DEALLOCATE ALL")
+    return {
+        'cur': cur,
+        'batch_size': batch_size or WRITE_BATCH_SIZE,
+        'prepared': {},
+        'queues': {group: [] for group in WRITER_FLUSH_ORDER},
+        'pending': 0,
+    }
+
+def prepared_statement(writer, table, sql):
+    """Name of the prepared statement for sql, preparing it on first use"""
+    name = writer['prepared'].get(sql)
+    if name is None:
+        # Named after the table so the run statistics can attribute EXECUTE statements
+        name = f"etl_{table}_{len(writer['prepared'])}"
+        counter = iter(range(1, sql.count('%s') + 1))
+        writer['cur'].execute(f"PREPARE {name} AS {re.sub('%s', lambda _: f'${next(counter)}', sql)}")
+        writer['prepared'][sql] = name
+    return name
+
+def queue_statement(writer, group, table, sql, params):
+    """Queue one execution of sql, flushing every batch_size statements"""
+    name = prepared_statement(writer, table, sql)
+    writer['queues'][group].append((name, params))
+    writer['pending'] += 1
+    if writer['pending'] >= writer['batch_size']:
+        flush_writer(writer)
+
+def flush_writer(writer):
+    """Send every queued statement: groups in WRITER_FLUSH_ORDER, queue order within a group"""
+    if not writer['pending']:
+        return
+    with stage('flush_writes'):
+        for group in WRITER_FLUSH_ORDER:
+            queue = writer['queues'][group]
+            start = 0
+            while start < len(queue):
+                # One execute_batch per run of the same statement
+                name = queue[start][0]
+                end = start
+                while end < len(queue) and queue[end][0] == name:
+                    end += 1
+                params = [item[1] for item in queue[start:end]]
+                placeholders = ', '.join(['%s'] * len(params[0]))
+                execute_batch(writer['cur'], f"EXECUTE {name} ({placeholders})", params, page_size=writer['batch_size'])
+                # The hook only sees the rowcount of the last EXECUTE of a page
+                count_rows(statement_table(f"EXECUTE {name}"), len(params))
+                start = end
+            queue.clear()
+    writer['pending'] = 0
+
+# === Row-by-row writers ===
+def upsert_collection(cur, collection_data, cache):
+    """Insert or update a product_collection by master_code, return its ID"""
+    columns = list(collection_data.keys())
+    values = [collection_data[col] for col in columns]
+    master_code = str(collection_data['master_code'])
+
+    # Check if collection exists first
+    collection_id = cache['collection_ids'].get(master_code)
+
+    if collection_id:
+        # Update existing collection
+        update_cols = [col for col in columns if col != 'id' and col != 'master_code']
+
+        if update_cols:
+            update_query = f"""
+            UPDATE product_collection SET
+            {', '.join([f"{col} = %s" for col in update_cols])}
+            WHERE id = %s
+            """
+
+            update_values = [collection_data[col] for col in update_cols]
+            update_values.append(collection_id)
+
+            queue_statement(cache['writer'], 'product_collection', 'product_collection', update_query, update_values)
+    else:
+        # Insert new collection, its ID is generated here
+        query = f"""
+        INSERT INTO product_collection ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        """
+
+        queue_statement(cache['writer'], 'product_collection', 'product_collection', query, values)
+        collection_id = collection_data['id']
+        cache['collection_ids'][master_code] = collection_id
+
+    return collection_id
+
+def content_hash(value):
+    """SHA-256 hex digest of a text blob, lists are hashed as newline-joined items"""
+    if isinstance(value, (list, tuple)):
+        value = '\n'.join(value)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+def get_or_insert_blob(cur, table, blob_column, blob_value, blob_hash):
+    """Return the ID of the row holding this content, inserting it only if it is new"""
+    cur.execute(f"""
+    WITH inserted AS (
+        INSERT INTO {table} (id, {blob_column}, content_hash)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (content_hash) DO NOTHING
+        RETURNING id
+    )
+    SELECT id FROM inserted
+    UNION ALL
+    SELECT id FROM {table} WHERE content_hash = %s
+    LIMIT 1
+    """, (generate_uuid(), blob_value, blob_hash, blob_hash))
+    result = cur.fetchone()
+
+    if not result:
+        # The conflicting row was committed by a parallel worker after this statement started
+        cur.execute(f"""
+        SELECT id FROM {table} WHERE content_hash = %s
+        """, (blob_hash,))
+        result = cur.fetchone()
+
+    return result[0]
+
+def set_collection_link(cur, writer, link_table, child_column, collection_id, child_id):
+    """Point the collection's link to child_id, touching the table only when it changed"""
+    cur.execute(f"""
+    SELECT {child_column} FROM {link_table}
+    WHERE product_collection_id = %s
+    """, (collection_id,))
+
+    current_links = [str(link[0]) for link in cur.fetchall()]
+    if current_links == [str(child_id)]:
+        return
+
+    if current_links:
+        # The content changed, drop the links to the previous versions
+        queue_statement(writer, 'links', link_table, f"""
+        DELETE FROM {link_table}
+        WHERE product_collection_id = %s
+        """, (collection_id,))
+
+    queue_statement(writer, 'links', link_table, f"""
+    INSERT INTO {link_table}
+    (id, product_collection_id, {child_column})
+    VALUES (%s, %s, %s)
+    """, (generate_uuid(), collection_id, child_id))
+
+def collection_image_urls(product_images):
+    """Split the 'Product Image' cell into the stored list of URLs"""
+    return [url.strip() for url in product_images.split(',') if url.strip()]
+
+def insert_collection_images(cur, writer, collection_id, product_images):
+    """Store the 'Product Image' list (deduplicated by content) and link it to the collection"""
+    # Create array of image URLs
+    image_urls = collection_image_urls(product_images)
+    if not image_urls:
+        return
+
+    # Reuse the product_collection_img_array row with the same URLs
+    img_array_db_id = get_or_insert_blob(cur, 'product_collection_img_array', 'product_collection_img_array',
+                                         image_urls, content_hash(image_urls))
+
+    # Link to product_collection
+    set_collection_link(cur, writer, 'product_collection_product_collection_img_array', 'product_collection_img_array',
+                        collection_id, img_array_db_id)
+
+def upsert_collection_translation(collection_id, value, cache):
+    """Insert or update the zh product_collection_name translation"""
+    field_name = "product_collection_name"
+
+    # Existing translations come from the lookup cache
+    existing_trans = cache['translation_ids'].get(str(collection_id))
+
+    if existing_trans:
+        # Update existing translation
+        queue_statement(cache['writer'], 'product_collection_translations', 'product_collection_translations', """
+        UPDATE product_collection_translations
+        SET value = %s
+        WHERE id = %s
+        """, (value, existing_trans))
+    else:
+        # Insert new translation
+        trans_id = generate_uuid()
+        queue_statement(cache['writer'], 'product_collection_translations', 'product_collection_translations', """
+        INSERT INTO product_collection_translations
+        (id, product_id, lang_id, field_name, value)
+        VALUES (%s, %s, %s, %s, %s)
+        """, (trans_id, collection_id, ZH_LANG_ID, field_name, value))
+        cache['translation_ids'][str(collection_id)] = trans_id
+
+def load_category_ids(cur):
+    """Load every zh category_name translation into {name: category_id} in one query"""
+    cur.execute("""
+    SELECT value, category_id
+    FROM category_translations
+    WHERE lang_id = %s AND field_name = %s
+    """, (ZH_LANG_ID, "category_name"))
+
+    category_ids = {}
+    for category_name, category_id in cur.fetchall():
+        category_ids.setdefault(category_name, category_id)
+
+    print(f"Loaded {len(category_ids)} existing categories")
+    return category_ids
+
+def category_constraints_deferrable(cur):
+    """Check whether the category <-> category_translations foreign keys are DEFERRABLE"""
+    cur.execute("""
+    SELECT COUNT(*), bool_and(condeferrable)
+    FROM pg_constraint
+    WHERE contype = 'f'
+      AND conrelid IN ('category'::regclass, 'category_translations'::regclass)
+      AND confrelid IN ('category'::regclass, 'category_translations'::regclass)
+    """)
+    constraint_count, all_deferrable = cur.fetchone()
+    return constraint_count == 0 or bool(all_deferrable)
+
+def create_categories(cur, category_names, category_ids):
+    """Create every category name missing from category_ids in one batch
+
+    With deferrable foreign keys both sides of the category <->
+    translation cycle are inserted with their final IDs and checked
+    together. Otherwise the placeholder translation is used, still with
+    one statement per step for the whole batch.
+    """
+    new_names = [name for name in dict.fromkeys(category_names) if name not in category_ids]
+    if not new_names:
+        return
+
+    # (category_id, translation_id, name)
+    new_categories = [(generate_uuid(), generate_uuid(), name) for name in new_names]
+    translations = [(trans_id, category_id, ZH_LANG_ID, "category_name", name)
+                    for category_id, trans_id, name in new_categories]
+
+    if category_constraints_deferrable(cur):
+        cur.execute("SET CONSTRAINTS ALL DEFERRED")
+        execute_values(cur, """
+        INSERT INTO category (id, category_name) VALUES %s
+        """, [(category_id, trans_id) for category_id, trans_id, _ in new_categories])
+        execute_values(cur, """
+        INSERT INTO category_translations (id, category_id, lang_id, field_name, value) VALUES %s
+        """, translations)
+        # Both sides exist now, check the constraints before going on
+        cur.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    else:
+        # Step 1: Insert into category table with existing translation as placeholder
+        execute_values(cur, """
+        INSERT INTO category (id, category_name) VALUES %s
+        """, [(category_id, CATEGORY_PLACEHOLDER_TRANS_ID) for category_id, _, _ in new_categories])
+
+        # Step 2: Insert the real category translations
+        execute_values(cur, """
+        INSERT INTO category_translations (id, category_id, lang_id, field_name, value) VALUES %s
+        """, translations)
+
+        # Step 3: Point the categories to the real translations
+        staging_table = copy_to_staging(cur, 'category', ['id', 'category_name'],
+                                        [{'id': category_id, 'category_name': trans_id}
+                                         for category_id, trans_id, _ in new_categories])
+        cur.execute(f"""
+        UPDATE category SET category_name = s.category_name
+        FROM {staging_table} s
+        WHERE category.id = s.id
+        """)
+
+    for category_id, _, name in new_categories:
+        category_ids[name] = category_id
+
+    print(f"Created {len(new_categories)} new categories")
+
+def link_categories(cur, category_links, category_ids):
+    """Create unseen categories in one batch, then link all (collection_id, category_name) pairs"""
+    create_categories(cur, [category_name for _, category_name in category_links], category_ids)
+    bulk_insert_links(cur, 'product_collection_category', 'product_collection_id', 'category_id',
+                      [(collection_id, category_ids[category_name]) for collection_id, category_name in category_links])
+
+def insert_custom_attributes(cur, writer, collection_id, custom_attrs):
+    """Store the raw 'Custom Attributes' string (deduplicated by content) and link it to the collection"""
+    attrs_collection_id = get_or_insert_blob(cur, 'custom_attributes_raw', 'custom_attributes_raw',
+                                             custom_attrs, content_hash(custom_attrs))
+
+    # Link attributes to collection using the linking table
+    set_collection_link(cur, writer, 'product_collection_custom_attributes_raw', 'custom_attributes_raw_id',
+                        collection_id, attrs_collection_id)
+
+def get_details_html_placeholder(cur):
+    """Return an existing details_html_translations ID, creating one if the table is empty"""
+    # Get an existing translation ID to use as placeholder
+    cur.execute("""
+    SELECT id FROM details_html_translations LIMIT 1
+    """)
+    placeholder_result = cur.fetchone()
+
+    if placeholder_result:
+        return placeholder_result[0]
+
+    # If no existing translations, create a minimal one first
+    placeholder_trans_id = generate_uuid()
+    placeholder_html_id = generate_uuid()
+
+    # Insert placeholder details_html record
+    cur.execute("""
+    INSERT INTO details_html (id, details_html)
+    VALUES (%s, %s)
+    """, (placeholder_html_id, placeholder_trans_id))
+
+    # Insert placeholder translation
+    cur.execute("""
+    INSERT INTO details_html_translations
+    (id, details_html_id, lang_id, field_name, value)
+    VALUES (%s, %s, %s, %s, %s)
+    """, (placeholder_trans_id, placeholder_html_id, ZH_LANG_ID, "placeholder", "placeholder"))
+
+    return placeholder_trans_id
+
+def find_details_html(cur, html_hash):
+    """Return the details_html ID stored for this content hash, if any"""
+    cur.execute("""
+    SELECT id FROM details_html WHERE content_hash = %s
+    """, (html_hash,))
+    existing = cur.fetchone()
+    return existing[0] if existing else None
+
+def insert_web_page_details(cur, writer, collection_id, web_page_details):
+    """Store the 'Web Page Details' HTML as details_html + zh translation, reusing identical content"""
+    html_hash = content_hash(web_page_details)
+    details_html_db_id = find_details_html(cur, html_hash)
+
+    if not details_html_db_id:
+        # Step 1: Create IDs
+        trans_id = generate_uuid()
+        details_html_id = generate_uuid()
+        field_name = "details_html"
+
+        # Step 2: Use existing translation as temporary placeholder
+        placeholder_trans_id = get_details_html_placeholder(cur)
+
+        # Step 3: Insert details_html record with placeholder
+        cur.execute("""
+        INSERT INTO details_html (id, details_html, content_hash)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (content_hash) DO NOTHING
+        RETURNING id
+        """, (details_html_id, placeholder_trans_id, html_hash))
+
+        inserted = cur.fetchone()
+        if inserted:
+            details_html_db_id = inserted[0]
+
+            # Step 4: Insert actual translation
+            cur.execute("""
+            INSERT INTO details_html_translations
+            (id, details_html_id, lang_id, field_name, value)
+            VALUES (%s, %s, %s, %s, %s)
+            """, (trans_id, details_html_db_id, ZH_LANG_ID, field_name, web_page_details))
+
+            # Step 5: Update details_html to point to actual translation
+            cur.execute("""
+            UPDATE details_html SET details_html = %s WHERE id = %s
+            """, (trans_id, details_html_db_id))
+
+            print(f"Inserted web page details for collection {collection_id}")
+        else:
+            # Stored by a parallel worker in the meantime
+            details_html_db_id = find_details_html(cur, html_hash)
+
+    # Link details to collection
+    set_collection_link(cur, writer, 'product_collection_details_html', 'details_html_id',
+                        collection_id, details_html_db_id)
+
+def write_collection_extras(cur, collection_id, row, cache):
+    """Write images, custom attributes and HTML details of a collection, queue its category link"""
+    # Process product images array after collection is inserted
+    product_images = row.get('Product Image')
+    if product_images and isinstance(product_images, str):
+        insert_collection_images(cur, cache['writer'], collection_id, product_images)
+
+    # Process category: linked in one batch by link_categories() at the end of the run
+    category_name = row.get('Category Name')
+    if category_name and isinstance(category_name, str):
+        cache['category_links'].append((collection_id, category_name))
+
+    # Process custom attributes
+    custom_attrs = row.get('Custom Attributes')
+    if custom_attrs and isinstance(custom_attrs, str):
+        insert_custom_attributes(cur, cache['writer'], collection_id, custom_attrs)
+
+    # Process web page details
+    web_page_details = row.get('Web Page Details')
+    if web_page_details and isinstance(web_page_details, str):
+        insert_web_page_details(cur, cache['writer'], collection_id, web_page_details)
+
+def resolve_inherited_fields(cur, collection_data, collection_id):
+    """Resolve the url/image/images a collection passes on to its products, once per master code
+
+    Mapped columns come from the collection record itself. A column the
+    mapping does not write keeps its stored value, read with one query
+    for collections that already existed.
+    """
+    inherited = {col: collection_data[col] for col in INHERITED_COLUMNS if col in collection_data}
+    stored_columns = [col for col in INHERITED_COLUMNS if col not in collection_data]
+    # New collections get the ID of their record, nothing is stored for them yet
+    if stored_columns and str(collection_id) != str(collection_data['id']):
+        cur.execute(f"""
+        SELECT {', '.join(stored_columns)}
+        FROM product_collection
+        WHERE id = %s
+        """, (collection_id,))
+        stored = cur.fetchone()
+        if stored:
+            inherited.update(zip(stored_columns, stored))
+    return inherited
+
+def inherit_collection_fields(product_data, inherited_fields):
+    """Copy the resolved url/image/images of the parent collection into the product"""
+    for col, value in inherited_fields.items():
+        if value:
+            product_data[col] = value
+
+def product_write_columns(field_map):
+    """Product columns the row writers set, in a fixed order (besides id and product_collection_sku)"""
+    columns = [db_col for _, db_col in field_map['product']]
+    columns += ['product_collection_master_code', 'product_attributes_raw_collection_id'] + INHERITED_COLUMNS
+    return [col for col in dict.fromkeys(columns) if col not in ('id', 'product_collection_sku')]
+
+def upsert_product(cur, product_data, cache, columns):
+    """Insert or update a product by product_collection_sku, return its ID
+
+    Every row uses the same column list, so the writer prepares one INSERT
+    and one UPDATE and batches them across rows with different empty
+    fields; empty values are NULL and never overwrite stored data.
+    """
+    sku = product_data['product_collection_sku']
+    # Columns outside the fixed list would be lost, they get their own statement shape
+    columns = columns + [col for col in product_data if col not in columns and col not in ('id', 'product_collection_sku')]
+
+    # Check if product exists
+    existing_product_id = cache['product_ids'].get(str(sku))
+
+    if existing_product_id:
+        # Update existing product
+        update_query = f"""
+        UPDATE product SET
+        {', '.join([f"{col} = COALESCE(%s, {col})" for col in columns])}
+        WHERE product_collection_sku = %s
+        """
+        update_values = [product_data.get(col) for col in columns]
+        update_values.append(sku)
+
+        queue_statement(cache['writer'], 'product', 'product', update_query, update_values)
+        return existing_product_id
+
+    # Insert new product
+    columns = ['id', 'product_collection_sku'] + columns
+    values = [product_data.get(col) for col in columns]
+
+    query = f"""
+    INSERT INTO product ({', '.join(columns)})
+    VALUES ({', '.join(['%s'] * len(columns))})
+    """
+
+    queue_statement(cache['writer'], 'product', 'product', query, values)
+    cache['product_ids'][str(sku)] = product_data['id']
+    return product_data['id']
+
+def sku_attribute_id(sku_attr, cache):
+    """ID of the product_attributes_raw_collection row holding sku_attr, queued for insert if the content is new"""
+    attr_hash = content_hash(sku_attr)
+    attrs_id = cache['sku_attribute_ids'].get(attr_hash)
+    if attrs_id is None:
+        attrs_id = generate_uuid()
+        queue_statement(cache['writer'], 'product_attributes_raw_collection', 'product_attributes_raw_collection', """
+        INSERT INTO product_attributes_raw_collection
+        (id, product_attributes_collection, content_hash)
+        VALUES (%s, %s, %s)
+        """, (attrs_id, sku_attr, attr_hash))
+        cache['sku_attribute_ids'][attr_hash] = attrs_id
+    return attrs_id
+
+def store_blobs(cur, table, blob_column, values):
+    """Insert the new distinct values of a content-hash table in one batch, return the staging table (None if empty)"""
+    rows = {}
+    for value in values:
+        rows.setdefault(content_hash(value), value)
+    if not rows:
+        return None
+
+    staging_table = copy_to_staging(cur, table, ['id', blob_column, 'content_hash'],
+                                    [{'id': generate_uuid(), blob_column: value, 'content_hash': value_hash}
+                                     for value_hash, value in rows.items()])
+    cur.execute(f"""
+    INSERT INTO {table} (id, {blob_column}, content_hash)
+    SELECT id, {blob_column}, content_hash FROM {staging_table}
+    ON CONFLICT (content_hash) DO NOTHING
+    """)
+    print(f"Stored {cur.rowcount} new of {len(rows)} distinct {table} rows")
+    return staging_table
+
+def store_details_html(cur, html_values):
+    """Insert the new distinct 'Web Page Details' HTML with their zh translations in one batch, return the staging table (None if empty)"""
+    rows = {}
+    for html in html_values:
+        rows.setdefault(content_hash(html), html)
+    if not rows:
+        return None
+
+    # New rows point to the placeholder until their translation exists, like insert_web_page_details()
+    placeholder_trans_id = get_details_html_placeholder(cur)
+    details = [{'id': generate_uuid(), 'details_html': generate_uuid(), 'content_hash': html_hash, 'value': html}
+               for html_hash, html in rows.items()]
+    html_table = copy_to_staging(cur, 'details_html', ['id', 'details_html', 'content_hash'], details)
+    trans_table = copy_to_staging(cur, 'details_html_translations', ['id', 'details_html_id', 'value'],
+                                  [{'id': row['details_html'], 'details_html_id': row['id'], 'value': row['value']}
+                                   for row in details])
+    cur.execute(f"""
+    INSERT INTO details_html (id, details_html, content_hash)
+    SELECT id, %s, content_hash FROM {html_table}
+    ON CONFLICT (content_hash) DO NOTHING
+    """, (placeholder_trans_id,))
+    print(f"Stored {cur.rowcount} new of {len(rows)} distinct details_html rows")
+
+    # Only the rows inserted above still point to the placeholder
+    cur.execute(f"""
+    INSERT INTO details_html_translations (id, details_html_id, lang_id, field_name, value)
+    SELECT t.id, t.details_html_id, %s, 'details_html', t.value
+    FROM {trans_table} t
+    JOIN details_html d ON d.id = t.details_html_id AND d.details_html = %s
+    """, (ZH_LANG_ID, placeholder_trans_id))
+    cur.execute(f"""
+    UPDATE details_html SET details_html = s.details_html
+    FROM {html_table} s
+    WHERE details_html.id = s.id AND details_html.details_html = %s
+    """, (placeholder_trans_id,))
+    return html_table
+
+def store_sku_attributes(cur, sku_attrs):
+    """Insert the new distinct Sku Attribute strings in one batch, return {content_hash: id} for all of them"""
+    staging_table = store_blobs(cur, 'product_attributes_raw_collection', 'product_attributes_collection', sku_attrs)
+    return blob_ids(cur, 'product_attributes_raw_collection', staging_table)
+
+def blob_ids(cur, table, staging_table):
+    """{content_hash: id} of the stored rows holding the contents of a staging table, in one query"""
+    if staging_table is None:
+        return {}
+    cur.execute(f"""
+    SELECT b.content_hash, b.id
+    FROM {table} b
+    JOIN {staging_table} s ON s.content_hash = b.content_hash
+    """)
+    return dict(cur.fetchall())
+
+def apply_collection_links(cur, link_table, child_column, staging_table):
+    """Point collection links to the children in staging_table (id, product_collection_id, child), dropping links to previous versions"""
+    cur.execute(f"""
+    DELETE FROM {link_table} l
+    USING {staging_table} s
+    WHERE l.product_collection_id = s.product_collection_id AND l.{child_column} <> s.{child_column}
+    """)
+    cur.execute(f"""
+    INSERT INTO {link_table} (id, product_collection_id, {child_column})
+    SELECT s.id, s.product_collection_id, s.{child_column}
+    FROM {staging_table} s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {link_table} l
+        WHERE l.product_collection_id = s.product_collection_id AND l.{child_column} = s.{child_column}
+    )
+    """)
+    print(f"Linked {cur.rowcount} new rows in {link_table}")
+
+def link_collection_blobs(cur, link_table, child_column, links):
+    """Replace the links [(collection_id, child_id), ...] of the collections in one batch"""
+    if not links:
+        return
+    staging_table = copy_to_staging(cur, link_table, ['id', 'product_collection_id', child_column],
+                                    [{'id': generate_uuid(), 'product_collection_id': collection_id, child_column: child_id}
+                                     for collection_id, child_id in links])
+    apply_collection_links(cur, link_table, child_column, staging_table)
+
+def process_master_group(cur, master_rows, field_map, cache):
+    """Import one master code: the collection from its first row, products from the rest"""
+    row = master_rows.iloc[0]  # Use first row as template
+    collection_data = extract_collection_data(row, field_map)
+    master_code = collection_data.get('master_code')
+
+    # Insert collection first to ensure it exists before linking
+    if not master_code:
+        return
+
+    with stage('collections'):
+        collection_id = upsert_collection(cur, collection_data, cache)
+        print(f"Inserted/Updated collection with master_code: {master_code}, ID: {collection_id}")
+
+        # Process video URL
+        video_url = row.get('Video')
+        if video_url and isinstance(video_url, str):
+            # Update collection with video URL
+            queue_statement(cache['writer'], 'product_collection', 'product_collection', """
+            UPDATE product_collection
+            SET video = %s
+            WHERE id = %s
+            """, (video_url, collection_id))
+
+    # Process collection translations
+    with stage('translations'):
+        translation = extract_collection_translation(row, field_map)
+        if translation:
+            upsert_collection_translation(collection_id, translation, cache)
+
+    with stage('collection_extras'):
+        write_collection_extras(cur, collection_id, row, cache)
+
+    # Process product variations for this specific master code
+    print(f"Processing product variations for master code: {master_code}")
+
+    with stage('variations'):
+        inherited_fields = resolve_inherited_fields(cur, collection_data, collection_id)
+        process_variations(cur, master_rows, field_map, cache, collection_id, inherited_fields)
+
+def process_variations(cur, master_rows, field_map, cache, collection_id, inherited_fields):
+    """Import the product variations of one master code"""
+    product_columns = product_write_columns(field_map)
+    for _, var_row in master_rows.iloc[1:].iterrows():  # Skip the master row we just processed
+        product_data = extract_product_data(var_row, field_map)
+
+        # Link product to collection using master_code
+        # Extract master code from the current row to find the correct collection
+        row_master_code = var_row.get('Master Code')
+        if row_master_code:
+            # Find the collection ID for this master code
+            # Fallback: use the collection_id from the master row processing
+            product_data['product_attributes_raw_collection_id'] = cache['collection_ids'].get(str(row_master_code), collection_id)
+
+            # Inherit fields from parent collection
+            inherit_collection_fields(product_data, inherited_fields)
+        else:
+            # Fallback: use the collection_id from the master row processing
+            product_data['product_attributes_raw_collection_id'] = collection_id
+
+        # Insert product
+        if 'product_collection_sku' in product_data:
+            # Identical Sku Attribute strings share one row, linked by the product upsert itself
+            sku_attr = var_row.get('Sku Attribute')
+            if sku_attr and isinstance(sku_attr, str):
+                product_data['product_attributes_raw_collection_id'] = sku_attribute_id(sku_attr, cache)
+
+            upsert_product(cur, product_data, cache, product_columns)
+            print(f"Inserted/Updated product with SKU: {product_data['product_collection_sku']}")
+
+# === Bulk mode: COPY into staging tables + set-based upserts ===
+def format_copy_value(value):
+    """Render a Python value as a field of COPY ... (FORMAT text)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        # PostgreSQL array literal: {"a","b"}
+        items = ['"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in value]
+        value = '{' + ','.join(items) + '}'
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_to_staging(cur, target_table, columns, rows):
+    """COPY rows into a temp table shaped like target_table(columns), return its name"""
+    staging_table = f"stage_{target_table}"
+    cur.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    # Column types come from the target table, constraints do not
+    cur.execute(f"""
+    CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+    SELECT {', '.join(columns)} FROM {target_table} WITH NO DATA
+    """)
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(format_copy_value(row.get(col)) for col in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    cur.copy_expert(f"COPY {staging_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)", buffer)
+    # COPY does not go through the statement hook of the connection
+    count_statement(staging_table, len(rows))
+    return staging_table
+
+def bulk_upsert(cur, target_table, rows, conflict_columns, keep_existing_on_null=False, returning=None,
+                keep_existing_columns=()):
+    """Stage rows with COPY and apply them with one INSERT ... ON CONFLICT DO UPDATE
+
+    keep_existing_columns are only set where a row has a value, for columns
+    some rows of a batch do not carry at all.
+    """
+    if not rows:
+        return []
+
+    # Last row wins for duplicate keys, a single statement may touch a row only once
+    unique_rows = {}
+    for row in rows:
+        unique_rows[tuple(row.get(col) for col in conflict_columns)] = row
+    rows = list(unique_rows.values())
+
+    columns = []
+    for row in rows:
+        for col in row:
+            if col not in columns:
+                columns.append(col)
+
+    staging_table = copy_to_staging(cur, target_table, columns, rows)
+
+    update_cols = [col for col in columns if col != 'id' and col not in conflict_columns]
+    # Same as the row mode: empty values do not overwrite existing data
+    assignments = [f"{col} = COALESCE(EXCLUDED.{col}, {target_table}.{col})"
+                   if keep_existing_on_null or col in keep_existing_columns else f"{col} = EXCLUDED.{col}"
+                   for col in update_cols]
+
+    if assignments:
+        conflict_action = f"DO UPDATE SET {', '.join(assignments)}"
+    else:
+        conflict_action = "DO NOTHING"
+
+    query = f"""
+    INSERT INTO {target_table} ({', '.join(columns)})
+    SELECT {', '.join(columns)} FROM {staging_table}
+    ON CONFLICT ({', '.join(conflict_columns)}) {conflict_action}
+    """
+    if returning:
+        query += f" RETURNING {', '.join(returning)}"
+
+    cur.execute(query)
+    print(f"Bulk upserted {cur.rowcount} rows into {target_table}")
+    return cur.fetchall() if returning else []
+
+def bulk_insert_links(cur, link_table, parent_column, child_column, links):
+    """Insert (parent, child) link rows that do not exist yet in one statement"""
+    if not links:
+        return
+
+    rows = [{'id': generate_uuid(), parent_column: parent, child_column: child} for parent, child in set(links)]
+    staging_table = copy_to_staging(cur, link_table, ['id', parent_column, child_column], rows)
+    cur.execute(f"""
+    INSERT INTO {link_table} (id, {parent_column}, {child_column})
+    SELECT s.id, s.{parent_column}, s.{child_column}
+    FROM {staging_table} s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {link_table} l
+        WHERE l.{parent_column} = s.{parent_column} AND l.{child_column} = s.{child_column}
+    )
+    """)
+    print(f"Bulk inserted {cur.rowcount} links into {link_table}")
+
+def ensure_content_hash_columns(cur):
+    """Apply add_content_hash_columns.sql unless every blob table already has its content_hash index
+
+    The migration backfills hashes over whole tables, so it only runs when needed.
+    """
+    cur.execute("""
+    SELECT count(*) FROM pg_indexes
+    WHERE schemaname = current_schema() AND indexname = ANY(%s)
+    """, ([f"ux_{table}_content_hash" for table in CONTENT_HASH_TABLES],))
+    if cur.fetchone()[0] == len(CONTENT_HASH_TABLES):
+        return
+    print("Applying add_content_hash_columns.sql (content hashes of the blob tables)...")
+    with open(CONTENT_HASH_SQL_PATH, 'r', encoding='utf-8') as f:
+        cur.execute(f.read())
+
+def pending_migrations(cur):
+    """Migration files this run would apply, checked without changing anything"""
+    indexes = [f"ux_{table}_content_hash" for table in CONTENT_HASH_TABLES]
+    if BULK_LOAD:
+        indexes += UPSERT_INDEXES
+    cur.execute("""
+    SELECT indexname FROM pg_indexes
+    WHERE schemaname = current_schema() AND indexname = ANY(%s)
+    """, (indexes,))
+    existing = {row[0] for row in cur.fetchall()}
+
+    pending = []
+    if any(f"ux_{table}_content_hash" not in existing for table in CONTENT_HASH_TABLES):
+        pending.append(os.path.basename(CONTENT_HASH_SQL_PATH))
+    if BULK_LOAD and any(index not in existing for index in UPSERT_INDEXES):
+        pending.append(os.path.basename(UPSERT_INDEXES_SQL_PATH))
+    if INCREMENTAL:
+        cur.execute("SELECT to_regclass('etl_import_state') IS NULL")
+        if cur.fetchone()[0]:
+            pending.append(os.path.basename(IMPORT_STATE_SQL_PATH))
+    return pending
+
+def ensure_upsert_indexes(cur):
+    """Create the unique indexes the ON CONFLICT targets rely on"""
+    ensure_content_hash_columns(cur)
+    with open(UPSERT_INDEXES_SQL_PATH, 'r', encoding='utf-8') as f:
+        cur.execute(f.read())
+
+def run_bulk_load(cur, master_groups, field_map, flush_rows=0, category_ids=None):
+    """Import master code groups with one staged upsert per target table
+
+    With flush_rows=0 the whole file is applied in a single batch,
+    otherwise a batch is flushed every time it holds flush_rows CSV rows.
+    The unique indexes from ensure_upsert_indexes() must already exist.
+    """
+    if category_ids is None:
+        category_ids = load_category_ids(cur)
+    batch = []
+    batch_rows = 0
+    for master_code, master_rows in master_groups:
+        batch.append(master_rows)
+        batch_rows += len(master_rows)
+        if flush_rows and batch_rows >= flush_rows:
+            bulk_load_batch(cur, batch, field_map, category_ids)
+            batch = []
+            batch_rows = 0
+
+    if batch:
+        bulk_load_batch(cur, batch, field_map, category_ids)
+
+def bulk_load_batch(cur, batch, field_map, category_ids):
+    """Apply a list of master code groups with one staged upsert per target table"""
+    # 1. Resolve every row into table records
+    with stage('prepare_rows'):
+        collections = []
+        template_rows = {}
+        variation_rows = []
+        for master_rows in batch:
+            row = master_rows.iloc[0]
+            collection_data = extract_collection_data(row, field_map)
+            if not collection_data.get('master_code'):
+                continue
+
+            video_url = row.get('Video')
+            if video_url and isinstance(video_url, str):
+                collection_data['video'] = video_url
+
+            collections.append(collection_data)
+            template_rows[collection_data['master_code']] = row
+            variation_rows.extend((collection_data['master_code'], var_row) for _, var_row in master_rows.iloc[1:].iterrows())
+
+    # 2. product_collection by master_code
+    with stage('collections'):
+        # Only collections with a video carry the column, the others keep their stored one
+        returned = bulk_upsert(cur, 'product_collection', collections, ['master_code'], returning=['id', 'master_code'],
+                               keep_existing_columns=['video'])
+        # Keys as text: the CSV may hand master codes over as numbers
+        collection_ids = {str(master_code): collection_id for collection_id, master_code in returned}
+
+    # 3. product_collection_translations by (product_id, lang_id, field_name)
+    with stage('translations'):
+        translations = []
+        for master_code, row in template_rows.items():
+            value = extract_collection_translation(row, field_map)
+            if value:
+                translations.append({
+                    'id': generate_uuid(),
+                    'product_id': collection_ids[str(master_code)],
+                    'lang_id': ZH_LANG_ID,
+                    'field_name': 'product_collection_name',
+                    'value': value
+                })
+        bulk_upsert(cur, 'product_collection_translations', translations, ['product_id', 'lang_id', 'field_name'])
+
+    # 4. Categories: unseen names created in one batch, links in one statement
+    with stage('categories'):
+        category_links = []
+        for master_code, row in template_rows.items():
+            category_name = row.get('Category Name')
+            if category_name and isinstance(category_name, str):
+                category_links.append((collection_ids[str(master_code)], category_name))
+        link_categories(cur, category_links, category_ids)
+
+    # 5. Images, raw attributes and HTML details: stored once per content, linked with one statement per table
+    with stage('collection_extras'):
+        images = []
+        attributes = []
+        details = []
+        for master_code, row in template_rows.items():
+            collection_id = collection_ids[str(master_code)]
+            product_images = row.get('Product Image')
+            if product_images and isinstance(product_images, str):
+                image_urls = collection_image_urls(product_images)
+                if image_urls:
+                    images.append((collection_id, image_urls))
+            custom_attrs = row.get('Custom Attributes')
+            if custom_attrs and isinstance(custom_attrs, str):
+                attributes.append((collection_id, custom_attrs))
+            web_page_details = row.get('Web Page Details')
+            if web_page_details and isinstance(web_page_details, str):
+                details.append((collection_id, web_page_details))
+
+        image_ids = blob_ids(cur, 'product_collection_img_array', store_blobs(
+            cur, 'product_collection_img_array', 'product_collection_img_array', [urls for _, urls in images]))
+        link_collection_blobs(cur, 'product_collection_product_collection_img_array', 'product_collection_img_array',
+                              [(collection_id, image_ids[content_hash(urls)]) for collection_id, urls in images])
+        attribute_ids = blob_ids(cur, 'custom_attributes_raw', store_blobs(
+            cur, 'custom_attributes_raw', 'custom_attributes_raw', [attrs for _, attrs in attributes]))
+        link_collection_blobs(cur, 'product_collection_custom_attributes_raw', 'custom_attributes_raw_id',
+                              [(collection_id, attribute_ids[content_hash(attrs)]) for collection_id, attrs in attributes])
+        details_ids = blob_ids(cur, 'details_html', store_details_html(cur, [html for _, html in details]))
+        link_collection_blobs(cur, 'product_collection_details_html', 'details_html_id',
+                              [(collection_id, details_ids[content_hash(html)]) for collection_id, html in details])
+
+    # 6. Sku attributes are stored once per distinct string, their IDs go straight into the product rows
+    with stage('sku_attributes'):
+        products = []
+        product_sku_attrs = []
+        for master_code, var_row in variation_rows:
+            product_data = extract_product_data(var_row, field_map)
+            if 'product_collection_sku' not in product_data:
+                continue
+            product_data['product_attributes_raw_collection_id'] = collection_ids[str(master_code)]
+
+            sku_attr = var_row.get('Sku Attribute')
+            if sku_attr and isinstance(sku_attr, str):
+                product_sku_attrs.append((product_data, sku_attr))
+            products.append(product_data)
+
+        sku_attribute_ids = store_sku_attributes(cur, [sku_attr for _, sku_attr in product_sku_attrs])
+        for product_data, sku_attr in product_sku_attrs:
+            product_data['product_attributes_raw_collection_id'] = sku_attribute_ids[content_hash(sku_attr)]
+
+    # 7. product by product_collection_sku
+    with stage('variations'):
+        bulk_upsert(cur, 'product', products, ['product_collection_sku'], keep_existing_on_null=True)
+
+    # 8. Inherit collection fields for the staged products in one statement
+    with stage('inheritance'):
+        if products:
+            inherit_staged_collection_fields(cur, 'stage_product')
+
+    print(f"Bulk batch applied: {len(collections)} collections, {len(products)} products")
+
+def inherit_staged_collection_fields(cur, staging_table):
+    """Copy the inherited collection fields to the products of a staging table, in one statement"""
+    assignments = ',\n        '.join(f"{col} = COALESCE(pc.{col}, product.{col})" for col in INHERITED_COLUMNS)
+    cur.execute(f"""
+    UPDATE product
+    SET
+        {assignments}
+    FROM product_collection pc, {staging_table} s
+    WHERE product.product_collection_sku = s.product_collection_sku
+      AND pc.master_code = product.product_collection_master_code
+    """)
+
+# === Incremental import: content fingerprints per master code and SKU ===
+def row_fingerprint(row, columns):
+    """Stable SHA-256 of the (already normalized) values of columns"""
+    values = [[col, row[col]] for col in columns]
+    payload = json.dumps(values, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def group_fingerprints(master_code, master_rows, field_map):
+    """Return the ('collection'|'product', key) -> fingerprint pairs of a master code group"""
+    fingerprints = {('collection', str(master_code)): row_fingerprint(master_rows.iloc[0], field_map['collection_fingerprint'])}
+    for _, var_row in master_rows.iloc[1:].iterrows():
+        sku = var_row.get('SKU Code')
+        if sku:
+            fingerprints[('product', str(sku))] = row_fingerprint(var_row, field_map['product_fingerprint'])
+    return fingerprints
+
+def ensure_import_state_table(cur):
+    """Create the etl_import_state table if needed"""
+    with open(IMPORT_STATE_SQL_PATH, 'r', encoding='utf-8') as f:
+        cur.execute(f.read())
+
+def load_import_state(cur):
+    """Load all stored fingerprints into {(entity_type, entity_key): fingerprint}"""
+    cur.execute("""
+    SELECT entity_type, entity_key, fingerprint FROM etl_import_state
+    """)
+    return {(entity_type, entity_key): fingerprint for entity_type, entity_key, fingerprint in cur.fetchall()}
+
+def save_import_state(cur, fingerprints):
+    """Upsert the fingerprints of the imported groups"""
+    if not fingerprints:
+        return
+    execute_values(cur, """
+    INSERT INTO etl_import_state (entity_type, entity_key, fingerprint)
+    VALUES %s
+    ON CONFLICT (entity_type, entity_key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, modified_on = CURRENT_TIMESTAMP
+    """, [(entity_type, entity_key, fingerprint) for (entity_type, entity_key), fingerprint in fingerprints.items()], page_size=1000)
+
+def filter_changed_groups(master_groups, field_map, import_state, pending_state, counts):
+    """Yield only new or changed master code groups
+
+    A group is unchanged when its collection fingerprint and the fingerprint
+    of every SKU in it match the stored state. The fingerprints of the
+    yielded groups are collected in pending_state and saved after they are
+    written, in the same transaction.
+    """
+    for master_code, master_rows in master_groups:
+        with stage('fingerprints'):
+            fingerprints = group_fingerprints(master_code, master_rows, field_map)
+
+        if ('collection', str(master_code)) not in import_state:
+            counts['new'] += 1
+        elif all(import_state.get(key) == fingerprint for key, fingerprint in fingerprints.items()):
+            counts['unchanged'] += 1
+            continue
+        else:
+            counts['changed'] += 1
+
+        pending_state.update(fingerprints)
+        yield master_code, master_rows
+
+# === Planning mode: insert/update/skip plan from one key snapshot ===
+# Link tables of the content-addressed blobs: (link table, child column, blob table)
+PLAN_BLOB_LINKS = {
+    'images': ('product_collection_product_collection_img_array', 'product_collection_img_array', 'product_collection_img_array'),
+    'custom_attributes': ('product_collection_custom_attributes_raw', 'custom_attributes_raw_id', 'custom_attributes_raw'),
+    'details_html': ('product_collection_details_html', 'details_html_id', 'details_html'),
+}
+# content_hash of a blob row as backfilled by add_content_hash_columns.sql, for tables not migrated yet
+PLAN_BLOB_HASHES = {
+    'product_collection_img_array': "encode(sha256(convert_to(array_to_string(b.product_collection_img_array, E'\\n'), 'UTF8')), 'hex')",
+    'custom_attributes_raw': "encode(sha256(convert_to(b.custom_attributes_raw, 'UTF8')), 'hex')",
+    'details_html': """(SELECT encode(sha256(convert_to(dht.value, 'UTF8')), 'hex') FROM details_html_translations dht
+                        WHERE dht.id = b.details_html AND dht.field_name = 'details_html' AND dht.value IS NOT NULL LIMIT 1)""",
+}
+# Generated or derived columns that are not compared
+PLAN_IGNORED_COLUMNS = ['id', 'master_code', 'product_collection_name', 'product_collection_sku',
+                        'product_attributes_raw_collection_id']
+
+def load_plan_snapshot(cur, field_map):
+    """Read everything the plan is compared against, one query per key set"""
+    collection_columns = [db_col for _, db_col in field_map['product_collection'] if db_col not in PLAN_IGNORED_COLUMNS] + ['video']
+    product_columns = [db_col for _, db_col in field_map['product'] if db_col not in PLAN_IGNORED_COLUMNS]
+    snapshot = {'collection_columns': collection_columns, 'product_columns': product_columns}
+
+    cur.execute(f"""
+    SELECT master_code, {', '.join(collection_columns)} FROM product_collection
+    WHERE master_code IS NOT NULL
+    """)
+    snapshot['collections'] = {str(row[0]): dict(zip(collection_columns, row[1:])) for row in cur.fetchall()}
+
+    cur.execute(f"""
+    SELECT p.product_collection_sku, p.product_collection_master_code, parc.product_attributes_collection
+           {''.join(f', p.{col}' for col in product_columns)}
+    FROM product p
+    LEFT JOIN product_attributes_raw_collection parc ON parc.id = p.product_attributes_raw_collection_id
+    WHERE p.product_collection_sku IS NOT NULL
+    """)
+    snapshot['products'] = {
+        str(row[0]): dict(zip(['product_collection_master_code', 'sku_attribute'] + product_columns, row[1:]))
+        for row in cur.fetchall()
+    }
+
+    cur.execute("""
+    SELECT pc.master_code, t.value
+    FROM product_collection_translations t
+    JOIN product_collection pc ON pc.id = t.product_id
+    WHERE t.lang_id = %s AND t.field_name = %s
+    """, (ZH_LANG_ID, 'product_collection_name'))
+    snapshot['translations'] = {str(master_code): value for master_code, value in cur.fetchall()}
+
+    snapshot['category_ids'] = load_category_ids(cur)
+    cur.execute("""
+    SELECT pc.master_code, pcc.category_id
+    FROM product_collection_category pcc
+    JOIN product_collection pc ON pc.id = pcc.product_collection_id
+    """)
+    snapshot['category_links'] = {(str(master_code), str(category_id)) for master_code, category_id in cur.fetchall()}
+
+    # Before add_content_hash_columns.sql the hashes are computed the way its backfill does
+    cur.execute("""
+    SELECT table_name FROM information_schema.columns
+    WHERE table_schema = current_schema() AND column_name = 'content_hash' AND table_name = ANY(%s)
+    """, ([blob_table for _, _, blob_table in PLAN_BLOB_LINKS.values()],))
+    hashed_tables = {row[0] for row in cur.fetchall()}
+    snapshot['pending_migrations'] = []
+    if len(hashed_tables) < len(PLAN_BLOB_LINKS):
+        snapshot['pending_migrations'].append(os.path.basename(CONTENT_HASH_SQL_PATH))
+        print(f"Migration pending: {os.path.basename(CONTENT_HASH_SQL_PATH)} not applied, blob hashes are computed in the snapshot")
+
+    for name, (link_table, child_column, blob_table) in PLAN_BLOB_LINKS.items():
+        blob_hash = 'b.content_hash' if blob_table in hashed_tables else PLAN_BLOB_HASHES[blob_table]
+        cur.execute(f"""
+        SELECT pc.master_code, {blob_hash}
+        FROM {link_table} l
+        JOIN product_collection pc ON pc.id = l.product_collection_id
+        JOIN {blob_table} b ON b.id = l.{child_column}
+        """)
+        links = {}
+        for master_code, blob_hash in cur.fetchall():
+            links.setdefault(str(master_code), []).append(blob_hash)
+        snapshot[name] = links
+
+    print(f"Plan snapshot: {len(snapshot['collections'])} collections, {len(snapshot['products'])} products, "
+          f"{len(snapshot['category_ids'])} categories, {len(snapshot['translations'])} translations")
+    return snapshot
+
+def plan_value(value):
+    """Comparable form of a database or CSV value: numbers by value, lists item by item, text stripped"""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [plan_value(item) for item in value]
+    text = str(value).strip()
+    if text == '':
+        return None
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return text
+
+def plan_field_changes(current, record, columns, keep_existing_on_null=False):
+    """{column: [old, new]} for the columns whose value would change"""
+    changes = {}
+    for col in columns:
+        if col not in record:
+            continue
+        new = record[col]
+        if keep_existing_on_null and plan_value(new) is None:
+            continue
+        if plan_value(current.get(col)) != plan_value(new):
+            changes[col] = [current.get(col), new]
+    return changes
+
+def record_plan_action(plan, entity, action, key, fields=None):
+    """Count an action, and keep inserts and updates for the diff report"""
+    counts = plan['summary'].setdefault(entity, {'insert': 0, 'update': 0, 'skip': 0})
+    counts[action] += 1
+    if action != 'skip':
+        change = {'entity': entity, 'action': action, 'key': key}
+        if fields:
+            change['fields'] = fields
+        plan['changes'].append(change)
+
+def plan_master_group(master_rows, field_map, snapshot, plan):
+    """Add what the importer would do for one master code to the plan"""
+    row = master_rows.iloc[0]
+    collection_data = extract_collection_data(row, field_map)
+    master_code = collection_data.get('master_code')
+    if not master_code:
+        return
+    key = str(master_code)
+
+    video_url = row.get('Video')
+    if video_url and isinstance(video_url, str):
+        collection_data['video'] = video_url
+
+    current = snapshot['collections'].get(key)
+    if current is None:
+        record_plan_action(plan, 'product_collection', 'insert', key)
+    else:
+        changes = plan_field_changes(current, collection_data, snapshot['collection_columns'])
+        record_plan_action(plan, 'product_collection', 'update' if changes else 'skip', key, changes)
+
+    translation = extract_collection_translation(row, field_map)
+    if translation:
+        old = snapshot['translations'].get(key)
+        if old is None:
+            record_plan_action(plan, 'product_collection_translations', 'insert', key)
+        elif plan_value(old) != plan_value(translation):
+            record_plan_action(plan, 'product_collection_translations', 'update', key, {'value': [old, translation]})
+        else:
+            record_plan_action(plan, 'product_collection_translations', 'skip', key)
+
+    category_name = row.get('Category Name')
+    if category_name and isinstance(category_name, str):
+        category_id = snapshot['category_ids'].get(category_name)
+        if category_id is None:
+            if category_name not in plan['new_categories']:
+                plan['new_categories'].append(category_name)
+            record_plan_action(plan, 'product_collection_category', 'insert', key, {'category': [None, category_name]})
+        elif (key, str(category_id)) in snapshot['category_links']:
+            record_plan_action(plan, 'product_collection_category', 'skip', key)
+        else:
+            record_plan_action(plan, 'product_collection_category', 'insert', key, {'category': [None, category_name]})
+
+    blob_values = {
+        'images': collection_image_urls(row['Product Image']) if isinstance(row.get('Product Image'), str) else None,
+        'custom_attributes': row.get('Custom Attributes') if isinstance(row.get('Custom Attributes'), str) else None,
+        'details_html': row.get('Web Page Details') if isinstance(row.get('Web Page Details'), str) else None,
+    }
+    for name, value in blob_values.items():
+        if not value:
+            continue
+        current_hashes = snapshot[name].get(key, [])
+        if current_hashes == [content_hash(value)]:
+            record_plan_action(plan, name, 'skip', key)
+        else:
+            record_plan_action(plan, name, 'update' if current_hashes else 'insert', key)
+
+    for _, var_row in master_rows.iloc[1:].iterrows():
+        product_data = extract_product_data(var_row, field_map)
+        sku = product_data.get('product_collection_sku')
+        if not sku:
+            continue
+        sku_key = str(sku)
+        current = snapshot['products'].get(sku_key)
+        if current is None:
+            record_plan_action(plan, 'product', 'insert', sku_key)
+            continue
+
+        # Empty CSV values never overwrite product fields
+        changes = plan_field_changes(current, product_data, snapshot['product_columns'] + ['product_collection_master_code'],
+                                     keep_existing_on_null=True)
+        sku_attr = var_row.get('Sku Attribute')
+        if sku_attr and isinstance(sku_attr, str) and plan_value(current['sku_attribute']) != plan_value(sku_attr):
+            changes['sku_attribute'] = [current['sku_attribute'], sku_attr]
+        record_plan_action(plan, 'product', 'update' if changes else 'skip', sku_key, changes)
+
+def write_plan_report(plan, report_path):
+    """Print the plan summary and write the full diff report as JSON"""
+    print("\nImport plan (insert / update / skip):")
+    for entity, counts in plan['summary'].items():
+        print(f"  {entity:<35} {counts['insert']:>8} {counts['update']:>8} {counts['skip']:>8}")
+    print(f"  New categories: {len(plan['new_categories'])}")
+    for migration in plan['pending_migrations']:
+        print(f"  Migration pending: {migration} (applied by the first import)")
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2, default=str)
+    print(f"Plan report with {len(plan['changes'])} changes written to {report_path}")
+
+def run_plan(field_map):
+    """Planning mode: snapshot the keys in one read-only transaction, plan everything in memory"""
+    print("PLAN MODE: one read-only snapshot, nothing is written to the database")
+    conn = connect_db(DB_CONFIG)
+    # REPEATABLE READ: every snapshot query sees the same committed state, not just each query on its own
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
     cur = conn.cursor()
-    
+    try:
+        with stage('snapshot'):
+            snapshot = load_plan_snapshot(cur, field_map)
+    finally:
+        # The connection is released before the CSV is processed, no locks are held
+        cur.close()
+        conn.rollback()
+        conn.close()
+
+    plan = {
+        'generated_on': datetime.now().isoformat(),
+        'csv_path': RAW_CSV_PATH,
+        'pending_migrations': snapshot['pending_migrations'],
+        'summary': {},
+        'new_categories': [],
+        'changes': [],
+    }
+    with stage('plan'):
+        master_groups = attach_heavy_columns(open_master_groups(RAW_CSV_PATH, field_map), RAW_CSV_PATH, field_map)
+        for master_code, master_rows in count_master_groups(master_groups):
+            plan_master_group(master_rows, field_map, snapshot, plan)
+
+    write_plan_report(plan, PLAN_REPORT_PATH)
+
+# === Offline mode: COPY-ready staging files, loaded by load_staging_files.py ===
+STAGING_MANIFEST = 'manifest.json'
+STAGING_FILE_EXTENSION = '.copy'
+
+def staging_columns(field_map):
+    """Columns of every staging file, in load order (parents first)"""
+    collection_columns = ['id', 'master_code'] + [db_col for _, db_col in field_map['product_collection']]
+    collection_columns += ['product_collection_name', 'video']
+    product_columns = ['id'] + [db_col for _, db_col in field_map['product']]
+    product_columns += ['product_collection_master_code', 'product_collection_sku', 'product_attributes_raw_collection_id']
+    product_columns += INHERITED_COLUMNS
+    return {
+        'product_collection': list(dict.fromkeys(collection_columns)),
+        'product_collection_translations': ['id', 'product_id', 'lang_id', 'field_name', 'value'],
+        # Category names are resolved against the dictionary by the loader
+        'product_collection_category': ['product_collection_id', 'category_name'],
+        'product_collection_img_array': ['id', 'product_collection_img_array', 'content_hash'],
+        'product_collection_product_collection_img_array': ['id', 'product_collection_id', 'product_collection_img_array'],
+        'custom_attributes_raw': ['id', 'custom_attributes_raw', 'content_hash'],
+        'product_collection_custom_attributes_raw': ['id', 'product_collection_id', 'custom_attributes_raw_id'],
+        'details_html': ['id', 'details_html', 'content_hash'],
+        'details_html_translations': ['id', 'details_html_id', 'lang_id', 'field_name', 'value'],
+        'product_collection_details_html': ['id', 'product_collection_id', 'details_html_id'],
+        'product_attributes_raw_collection': ['id', 'product_attributes_collection', 'content_hash'],
+        'product': list(dict.fromkeys(product_columns)),
+    }
+
+def open_staging_files(stage_dir, columns):
+    """Open one COPY file per target table, return the staging state"""
+    os.makedirs(stage_dir, exist_ok=True)
+    # Without a manifest the directory is never loaded, a half-written set included
+    manifest_path = os.path.join(stage_dir, STAGING_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    return {
+        'dir': stage_dir,
+        'columns': columns,
+        'files': {table: open(os.path.join(stage_dir, table + STAGING_FILE_EXTENSION), 'w', encoding='utf-8', newline='')
+                  for table in columns},
+        'rows': {table: 0 for table in columns},
+        # table -> {content_hash: id}, every blob is written once per file set
+        'blob_ids': {},
+    }
+
+def write_staging_row(staging, table, row):
+    """Append one row to the COPY file of table"""
+    staging['files'][table].write('\t'.join(format_copy_value(row.get(col)) for col in staging['columns'][table]) + '\n')
+    staging['rows'][table] += 1
+
+def stage_blob(staging, table, blob_column, value):
+    """Write a content-addressed blob unless the file set already has it, return its ID"""
+    blob_hash = content_hash(value)
+    blob_ids = staging['blob_ids'].setdefault(table, {})
+    if blob_hash not in blob_ids:
+        blob_ids[blob_hash] = generate_uuid()
+        write_staging_row(staging, table, {'id': blob_ids[blob_hash], blob_column: value, 'content_hash': blob_hash})
+    return blob_ids[blob_hash]
+
+def stage_details_html(staging, web_page_details):
+    """Write the details_html row and its zh translation unless the file set already has them, return its ID"""
+    html_hash = content_hash(web_page_details)
+    blob_ids = staging['blob_ids'].setdefault('details_html', {})
+    if html_hash not in blob_ids:
+        details_html_id = generate_uuid()
+        trans_id = generate_uuid()
+        blob_ids[html_hash] = details_html_id
+        write_staging_row(staging, 'details_html', {'id': details_html_id, 'details_html': trans_id, 'content_hash': html_hash})
+        write_staging_row(staging, 'details_html_translations', {
+            'id': trans_id, 'details_html_id': details_html_id, 'lang_id': ZH_LANG_ID,
+            'field_name': 'details_html', 'value': web_page_details})
+    return blob_ids[html_hash]
+
+def stage_master_group(staging, master_rows, field_map):
+    """Resolve one master code into staging rows, with every ID assigned here"""
+    row = master_rows.iloc[0]
+    collection_data = extract_collection_data(row, field_map)
+    if not collection_data.get('master_code'):
+        return
+
+    video_url = row.get('Video')
+    if video_url and isinstance(video_url, str):
+        collection_data['video'] = video_url
+    collection_id = collection_data['id']
+    write_staging_row(staging, 'product_collection', collection_data)
+
+    translation = extract_collection_translation(row, field_map)
+    if translation:
+        write_staging_row(staging, 'product_collection_translations', {
+            'id': generate_uuid(), 'product_id': collection_id, 'lang_id': ZH_LANG_ID,
+            'field_name': 'product_collection_name', 'value': translation})
+
+    category_name = row.get('Category Name')
+    if category_name and isinstance(category_name, str):
+        write_staging_row(staging, 'product_collection_category', {'product_collection_id': collection_id, 'category_name': category_name})
+
+    product_images = row.get('Product Image')
+    image_urls = collection_image_urls(product_images) if product_images and isinstance(product_images, str) else []
+    if image_urls:
+        img_array_id = stage_blob(staging, 'product_collection_img_array', 'product_collection_img_array', image_urls)
+        write_staging_row(staging, 'product_collection_product_collection_img_array', {
+            'id': generate_uuid(), 'product_collection_id': collection_id, 'product_collection_img_array': img_array_id})
+
+    custom_attrs = row.get('Custom Attributes')
+    if custom_attrs and isinstance(custom_attrs, str):
+        attrs_id = stage_blob(staging, 'custom_attributes_raw', 'custom_attributes_raw', custom_attrs)
+        write_staging_row(staging, 'product_collection_custom_attributes_raw', {
+            'id': generate_uuid(), 'product_collection_id': collection_id, 'custom_attributes_raw_id': attrs_id})
+
+    web_page_details = row.get('Web Page Details')
+    if web_page_details and isinstance(web_page_details, str):
+        details_html_id = stage_details_html(staging, web_page_details)
+        write_staging_row(staging, 'product_collection_details_html', {
+            'id': generate_uuid(), 'product_collection_id': collection_id, 'details_html_id': details_html_id})
+
+    for _, var_row in master_rows.iloc[1:].iterrows():
+        product_data = extract_product_data(var_row, field_map)
+        if 'product_collection_sku' not in product_data:
+            continue
+        product_data['product_attributes_raw_collection_id'] = collection_id
+
+        # Inherited from the collection record of the same file
+        inherit_collection_fields(product_data, {col: collection_data.get(col) for col in INHERITED_COLUMNS})
+
+        sku_attr = var_row.get('Sku Attribute')
+        if sku_attr and isinstance(sku_attr, str):
+            product_data['product_attributes_raw_collection_id'] = stage_blob(
+                staging, 'product_attributes_raw_collection', 'product_attributes_collection', sku_attr)
+        write_staging_row(staging, 'product', product_data)
+
+def close_staging_files(staging):
+    """Close the COPY files"""
+    for f in staging['files'].values():
+        f.close()
+
+def write_staging_manifest(staging, csv_path):
+    """Write the manifest the loader reads, it marks the file set as complete"""
+    manifest = {
+        'created_on': datetime.now().isoformat(),
+        'csv_path': csv_path,
+        'csv_hash': file_content_hash(csv_path),
+        'master_codes': RUN_STATS.get('master_codes', 0),
+        'rows': RUN_STATS.get('rows', 0),
+        'tables': [{'table': table, 'file': table + STAGING_FILE_EXTENSION, 'columns': columns, 'rows': staging['rows'][table]}
+                   for table, columns in staging['columns'].items()],
+    }
+    with open(os.path.join(staging['dir'], STAGING_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    for entry in manifest['tables']:
+        print(f"  {entry['file']:<60} {entry['rows']:>10} rows")
+    print(f"Staging files written to {staging['dir']}, load them with: python load_staging_files.py --stage-dir {staging['dir']}")
+
+def run_staging(field_map):
+    """Offline mode: transform the CSV into COPY files, without a database connection"""
+    print(f"STAGING MODE: writing COPY files to {STAGE_DIR}, nothing is written to the database")
+    staging = open_staging_files(STAGE_DIR, staging_columns(field_map))
+    try:
+        with stage('staging_files'):
+            master_groups = attach_heavy_columns(open_master_groups(RAW_CSV_PATH, field_map), RAW_CSV_PATH, field_map)
+            for master_code, master_rows in count_master_groups(master_groups):
+                stage_master_group(staging, master_rows, field_map)
+    finally:
+        close_staging_files(staging)
+    write_staging_manifest(staging, RAW_CSV_PATH)
+
+# === Run orchestration ===
+def open_master_groups(csv_path, field_map):
+    """Return the normalized master code groups of the raw CSV, streamed when CHUNK_SIZE is set"""
+    if CHUNK_SIZE > 0:
+        print(f"Streaming data from {csv_path} in chunks of {CHUNK_SIZE} rows...")
+        return iter_master_groups_chunked(csv_path, CHUNK_SIZE, field_map)
+
+    print(f"Reading data from {csv_path}...")
+    with stage('read_csv'):
+        raw_df = load_raw_frame(csv_path, read_columns(field_map))
+        raw_df = normalize_frame(raw_df, field_map)
+    with stage('compact_frame'):
+        raw_df = compact_frame(raw_df)
+    print(f"Found {raw_df['Master Code'].nunique()} unique master codes to process")
+    # Group the rows by master code once
+    return iter_master_groups(raw_df)
+
+def open_import_context(cur):
+    """Lookups shared by all commit batches of a run, loaded once
+
+    Row mode gets the lookup cache with its batched writer, bulk mode the
+    category IDs and the incremental mode the stored fingerprints. The
+    writers keep them up to date, so later batches see earlier ones.
+    """
+    context = {}
+    if INCREMENTAL:
+        with stage('import_state'):
+            context['import_state'] = load_import_state(cur)
+    if BULK_LOAD:
+        context['category_ids'] = load_category_ids(cur)
+    else:
+        # Existing collections and products are looked up in memory
+        with stage('lookup_cache'):
+            context['cache'] = load_lookup_cache(cur)
+    return context
+
+def import_master_groups(cur, master_groups, field_map, context=None):
+    """Write master code groups with the configured mode (bulk or row-by-row)"""
+    if context is None:
+        context = open_import_context(cur)
+
+    # Two-pass mode: heavy columns are attached to every group before the incremental filter,
+    # they are part of the collection fingerprint; only one group at a time holds them
+    master_groups = attach_heavy_columns(master_groups, RAW_CSV_PATH, field_map)
+
+    if INCREMENTAL:
+        print("INCREMENTAL MODE: unchanged master codes are skipped")
+        import_state = context['import_state']
+        pending_state = {}
+        counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+        write_master_groups(cur, filter_changed_groups(master_groups, field_map, import_state, pending_state, counts),
+                            field_map, context)
+        with stage('import_state'):
+            save_import_state(cur, pending_state)
+        import_state.update(pending_state)
+        totals = RUN_STATS.setdefault('incremental', {'new': 0, 'changed': 0, 'unchanged': 0})
+        for key, count in counts.items():
+            totals[key] += count
+        print(f"Incremental summary: {counts['new']} new, {counts['changed']} changed, {counts['unchanged']} unchanged master codes")
+    else:
+        write_master_groups(cur, master_groups, field_map, context)
+
+def write_master_groups(cur, master_groups, field_map, context):
+    """Write master code groups in bulk or row-by-row mode"""
+    master_groups = count_master_groups(master_groups)
+
+    if BULK_LOAD:
+        print("BULK LOAD MODE: staging tables + INSERT ... ON CONFLICT")
+        run_bulk_load(cur, master_groups, field_map, flush_rows=CHUNK_SIZE, category_ids=context['category_ids'])
+        return
+
+    # 3. Process product collections (master rows)
+    print("Processing product collections...")
+    cache = context['cache']
+
+    for master_code, master_rows in master_groups:
+        process_master_group(cur, master_rows, field_map, cache)
+
+    # Category links reference the queued collections
+    flush_writer(cache['writer'])
+
+    with stage('categories'):
+        link_categories(cur, cache['category_links'], cache['category_ids'])
+    cache['category_links'] = []
+
+def ensure_default_lang(conn, cur):
+    """Return the 'en' language ID, creating the language if needed"""
     # Get default language ID (assuming 'en' is the default language)
     cur.execute("""
     SELECT id FROM lang WHERE lang_code = 'en'
     """)
     default_lang_id_result = cur.fetchone()
     if default_lang_id_result:
-        default_lang_id = default_lang_id_result[0]
+        return default_lang_id_result[0]
+
+    # If 'en' language doesn't exist, create it
+    default_lang_id = generate_uuid()
+    cur.execute("""
+    INSERT INTO lang (id, lang_code)
+    VALUES (%s, %s)
+    """, (default_lang_id, 'en'))
+    conn.commit()
+    return default_lang_id
+
+def finish_transaction(conn):
+    """Commit, or roll back in dry run mode"""
+    with stage('commit'):
+        if not DRY_RUN:
+            conn.commit()
+        else:
+            conn.rollback()
+
+# === Checkpointed commits: one transaction per batch of master codes ===
+def checkpoints_enabled():
+    """Checkpoints are written for --commit-every and --resume, never in dry runs"""
+    return (COMMIT_EVERY > 0 or RESUME) and not DRY_RUN
+
+def ensure_checkpoint_table(cur):
+    """Create the etl_checkpoint table if needed"""
+    with open(CHECKPOINT_SQL_PATH, 'r', encoding='utf-8') as f:
+        cur.execute(f.read())
+
+def load_checkpoint(cur, csv_hash, partition):
+    """Return (master_codes_done, last_master_code, status) of a partition, or None"""
+    cur.execute("""
+    SELECT master_codes_done, last_master_code, status FROM etl_checkpoint
+    WHERE csv_hash = %s AND partition = %s
+    """, (csv_hash, partition))
+    return cur.fetchone()
+
+def save_checkpoint(cur, csv_hash, partition, master_codes_done, last_master_code, status):
+    """Record the progress of a partition, committed together with the batch it describes"""
+    cur.execute("""
+    INSERT INTO etl_checkpoint (csv_hash, partition, csv_path, master_codes_done, last_master_code, status, modified_on)
+    VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (csv_hash, partition) DO UPDATE SET
+        csv_path = EXCLUDED.csv_path,
+        master_codes_done = EXCLUDED.master_codes_done,
+        last_master_code = EXCLUDED.last_master_code,
+        status = EXCLUDED.status,
+        modified_on = EXCLUDED.modified_on
+    """, (csv_hash, partition, RAW_CSV_PATH, master_codes_done, last_master_code, status))
+
+def skip_committed_groups(master_groups, master_codes_done, last_master_code):
+    """Drop the first master_codes_done groups, checking they end where the checkpoint says"""
+    for position, (master_code, master_rows) in enumerate(master_groups):
+        if position < master_codes_done:
+            if position == master_codes_done - 1 and str(master_code) != str(last_master_code):
+                raise ValueError(f"Checkpoint ends at master code {last_master_code} but the file has {master_code} "
+                                 "at that position, run without --resume to start over")
+            continue
+        yield master_code, master_rows
+
+def counted_groups(master_groups, progress):
+    """Pass master code groups through, counting them and keeping the last master code"""
+    for master_code, master_rows in master_groups:
+        progress['master_codes'] += 1
+        progress['last_master_code'] = str(master_code)
+        yield master_code, master_rows
+
+def import_with_checkpoints(conn, cur, master_groups, field_map, csv_hash, partition='all'):
+    """Import in transactions of COMMIT_EVERY master codes, each committed with its checkpoint
+
+    A failure only rolls back the current batch. With RESUME the groups
+    already committed for this file version and partition are skipped.
+    """
+    master_codes_done = 0
+    last_master_code = None
+    if RESUME:
+        checkpoint = load_checkpoint(cur, csv_hash, partition)
+        if checkpoint:
+            master_codes_done, last_master_code, status = checkpoint
+            print(f"Resuming partition {partition} after {master_codes_done} master codes "
+                  f"(last: {last_master_code}, status: {status})")
+            master_groups = skip_committed_groups(master_groups, master_codes_done, last_master_code)
+        else:
+            print(f"No checkpoint for partition {partition} of this file, starting from the beginning")
+
+    # Caches and the writer are built once and carried over the commits
+    context = open_import_context(cur)
+    master_groups = iter(master_groups)
+    while True:
+        first = next(master_groups, None)
+        if first is None:
+            break
+        # Batches stream from the reader like an import without checkpoints, one batch is the whole file without COMMIT_EVERY
+        rest = islice(master_groups, COMMIT_EVERY - 1) if COMMIT_EVERY > 0 else master_groups
+        progress = {'master_codes': 0, 'last_master_code': None}
+        import_master_groups(cur, counted_groups(chain([first], rest), progress), field_map, context)
+        master_codes_done += progress['master_codes']
+        last_master_code = progress['last_master_code']
+        save_checkpoint(cur, csv_hash, partition, master_codes_done, last_master_code, 'running')
+        finish_transaction(conn)
+        print(f"Checkpoint: {master_codes_done} master codes committed (last: {last_master_code})")
+
+        if COMMIT_EVERY <= 0:
+            break
+
+    save_checkpoint(cur, csv_hash, partition, master_codes_done, last_master_code, 'done')
+    finish_transaction(conn)
+
+def import_file(conn, cur, master_groups, field_map, csv_hash=None, partition='all'):
+    """Import master code groups in one transaction, or checkpointed batches when enabled"""
+    if checkpoints_enabled():
+        import_with_checkpoints(conn, cur, master_groups, field_map, csv_hash, partition)
     else:
-        # If 'en' language doesn't exist, create it
-        default_lang_id = generate_uuid()
-        cur.execute("""
-        INSERT INTO lang (id, lang_code)
-        VALUES (%s, %s)
-        """, (default_lang_id, 'en'))
-        conn.commit()
-    
-    try:
-        # 3. Process product collections (master rows)
-        print("Processing product collections...")
-        
-        # Get unique master codes to process each collection
-        unique_master_codes = raw_df['Master Code'].dropna().unique()
-        print(f"Found {len(unique_master_codes)} unique master codes to process")
-        
-        for master_code in unique_master_codes:
-            # Get the first row for this master code as the collection template
-            master_rows = raw_df[raw_df['Master Code'] == master_code]
-            if master_rows.empty:
-                continue
-                
-            row = master_rows.iloc[0]  # Use first row as template
-            collection_data = {}
-            collection_id = generate_uuid()
-            
-            # Extract collection data
-            for col in raw_df.columns:
-                if col in mapping and mapping[col]['table'] == 'product_collection' and mapping[col]['column']:
-                    db_col = mapping[col]['column']
-                    value = convert_numpy_types(row[col])
-                    
-                    # Special handling for arrays
-                    if db_col == 'product_collection_img_array':
-                        value = parse_array(value)
-                    
-                    collection_data[db_col] = value
-            
-            # Add collection ID
-            collection_data['id'] = collection_id
-            master_code = collection_data.get('master_code')
-            collection_sku = collection_data.get('product_collection_sku', '')
-            
-            # Generate UUID for product_collection_name
-            product_name_id = generate_uuid()
-            collection_data['product_collection_name'] = product_name_id
-            
-            # Insert collection first to ensure it exists before linking
-            if master_code:
-                columns = list(collection_data.keys())
-                values = [collection_data[col] for col in columns]
-                
-                # Check if collection exists first
-                cur.execute("""
-                SELECT id FROM product_collection 
-                WHERE master_code = %s
-                """, (master_code,))
-                
-                existing_collection = cur.fetchone()
-                
-                if existing_collection:
-                    # Update existing collection
-                    collection_id = existing_collection[0]
-                    update_cols = [col for col in columns if col != 'id' and col != 'master_code']
-                    
-                    if update_cols:
-                        update_query = f"""
-                        UPDATE product_collection SET 
-                        {', '.join([f"{col} = %s" for col in update_cols])}
-                        WHERE id = %s
-                        """
-                        
-                        update_values = [collection_data[col] for col in update_cols]
-                        update_values.append(collection_id)
-                        
-                        cur.execute(update_query, update_values)
-                else:
-                    # Insert new collection
-                    query = f"""
-                    INSERT INTO product_collection ({', '.join(columns)})
-                    VALUES ({', '.join(['%s'] * len(columns))})
-                    RETURNING id
-                    """
-                    
-                    cur.execute(query, values)
-                    collection_id = cur.fetchone()[0]
-                
-                print(f"Inserted/Updated collection with master_code: {master_code}, ID: {collection_id}")
-                
-                # Process product images array after collection is inserted
-                product_images = row.get('Product Image')
-                if product_images and isinstance(product_images, str):
-                    # Create array of image URLs
-                    image_urls = [url.strip() for url in product_images.split(',') if url.strip()]
-                    
-                    if image_urls:
-                        # Insert into product_collection_img_array
-                        img_array_id = generate_uuid()
-                        cur.execute("""
-                        INSERT INTO product_collection_img_array 
-                        (id, product_collection_img_array)
-                        VALUES (%s, %s)
-                        RETURNING id
-                        """, (img_array_id, image_urls))
-                        
-                        img_array_db_id = cur.fetchone()[0]
-                        
-                        # Link to product_collection
-                        # Check if link already exists
-                        cur.execute("""
-                        SELECT id FROM product_collection_product_collection_img_array 
-                        WHERE product_collection_id = %s AND product_collection_img_array = %s
-                        """, (collection_id, img_array_db_id))
-                        
-                        existing_link = cur.fetchone()
-                        
-                        if not existing_link:
-                            # Create new link
-                            link_id = generate_uuid()
-                            cur.execute("""
-                            INSERT INTO product_collection_product_collection_img_array 
-                            (id, product_collection_id, product_collection_img_array)
-                            VALUES (%s, %s, %s)
-                            """, (link_id, collection_id, img_array_db_id))
-                
-                # Process collection translations
-                for col in raw_df.columns:
-                    if col in mapping and mapping[col]['table'] == 'product_collection_translations':
-                        value = clean_string(row[col])
-                        if value:
-                            trans_id = generate_uuid()
-                            # Chinese language ID - should be configurable
-                            lang_id = "365d96e3-9f08-4d2e-bf17-18a26a5072f7"
-                            field_name = "product_collection_name"
-                            
-                            # Check if translation exists
-                            cur.execute("""
-                            SELECT id FROM product_collection_translations 
-                            WHERE product_id = %s AND lang_id = %s AND field_name = %s
-                            """, (collection_id, lang_id, field_name))
-                            
-                            existing_trans = cur.fetchone()
-                            
-                            if existing_trans:
-                                # Update existing translation
-                                cur.execute("""
-                                UPDATE product_collection_translations 
-                                SET value = %s
-                                WHERE id = %s
-                                """, (value, existing_trans[0]))
-                            else:
-                                # Insert new translation
-                                cur.execute("""
-                                INSERT INTO product_collection_translations 
-                                (id, product_id, lang_id, field_name, value)
-                                VALUES (%s, %s, %s, %s, %s)
-                                """, (trans_id, collection_id, lang_id, field_name, value))
-                    
-                    print(f"Inserted/Updated collection with master_code: {master_code}, ID: {collection_id}")
-                    
-                    # Process collection translations
-                    for col in raw_df.columns:
-                        if col in mapping and mapping[col]['table'] == 'product_collection_translations':
-                            value = clean_string(row[col])
-                            if value:
-                                trans_id = generate_uuid()
-                                # Chinese language ID - should be configurable
-                                lang_id = "365d96e3-9f08-4d2e-bf17-18a26a5072f7"
-                                field_name = "product_collection_name"
-                                
-                                # Check if translation exists
-                                cur.execute("""
-                                SELECT id FROM product_collection_translations 
-                                WHERE product_id = %s AND lang_id = %s AND field_name = %s
-                                """, (collection_id, lang_id, field_name))
-                                
-                                existing_trans = cur.fetchone()
-                                
-                                if existing_trans:
-                                    # Update existing translation
-                                    cur.execute("""
-                                    UPDATE product_collection_translations 
-                                    SET value = %s
-                                    WHERE id = %s
-                                    """, (value, existing_trans[0]))
-                                else:
-                                    # Insert new translation
-                                    cur.execute("""
-                                    INSERT INTO product_collection_translations 
-                                    (id, product_id, lang_id, field_name, value)
-                                    VALUES (%s, %s, %s, %s, %s)
-                                    """, (trans_id, collection_id, lang_id, field_name, value))
-                    
-                    # Process category
-                    category_name = row.get('Category Name')
-                    if category_name and isinstance(category_name, str):
-                        # First check if category exists by name
-                        cur.execute("""
-                        SELECT ct.category_id 
-                        FROM category_translations ct
-                        WHERE ct.value = %s AND ct.lang_id = %s AND ct.field_name = %s
-                        """, (category_name, "365d96e3-9f08-4d2e-bf17-18a26a5072f7", "category_name"))
-                        
-                        category_result = cur.fetchone()
-                        category_id = None
-                        
-                        if category_result:
-                            # Category exists, use its ID
-                            category_id = category_result[0]
-                            print(f"Found existing category: {category_name}, ID: {category_id}")
-                        else:
-                            # Create new category using existing translation as temporary placeholder
-                            category_id = generate_uuid()
-                            trans_id = generate_uuid()
-                            # Use existing translation as placeholder to avoid FK constraint
-                            placeholder_trans_id = "646b58d9-de22-4459-b4f1-8302e8d64c7d"
-                            
-                            # Step 1: Insert into category table with existing translation as placeholder
-                            cur.execute("""
-                            INSERT INTO category (id, category_name)
-                            VALUES (%s, %s)
-                            """, (category_id, placeholder_trans_id))
-                            
-                            # Step 2: Insert the real category translation
-                            cur.execute("""
-                            INSERT INTO category_translations 
-                            (id, category_id, lang_id, field_name, value)
-                            VALUES (%s, %s, %s, %s, %s)
-                            """, (trans_id, category_id, "365d96e3-9f08-4d2e-bf17-18a26a5072f7", "category_name", category_name))
-                            
-                            # Step 3: Update category to point to the real translation
-                            cur.execute("""
-                            UPDATE category SET category_name = %s WHERE id = %s
-                            """, (trans_id, category_id))
-                            
-                            print(f"Created new category: {category_name}, ID: {category_id}")
-                        
-                        # Link category to collection
-                        if category_id:
-                            # Check if link already exists
-                            cur.execute("""
-                            SELECT id FROM product_collection_category 
-                            WHERE product_collection_id = %s AND category_id = %s
-                            """, (collection_id, category_id))
-                            
-                            existing_link = cur.fetchone()
-                            
-                            if not existing_link:
-                                # Create new link
-                                link_id = generate_uuid()
-                                cur.execute("""
-                                INSERT INTO product_collection_category 
-                                (id, product_collection_id, category_id)
-                                VALUES (%s, %s, %s)
-                                """, (link_id, collection_id, category_id))
-                    
-                    # Process custom attributes
-                    custom_attrs = row.get('Custom Attributes')
-                    if custom_attrs and isinstance(custom_attrs, str):
-                        attrs_id = generate_uuid()
-                        cur.execute("""
-                        INSERT INTO custom_attributes_raw 
-                        (id, custom_attributes_raw)
-                        VALUES (%s, %s)
-                        RETURNING id
-                        """, (attrs_id, custom_attrs))
-                        
-                        attrs_collection_id = cur.fetchone()[0]
-                        
-                        # Link attributes to collection using the linking table
-                        link_id = generate_uuid()
-                        cur.execute("""
-                        INSERT INTO product_collection_custom_attributes_raw
-                        (id, product_collection_id, custom_attributes_raw_id)
-                        VALUES (%s, %s, %s)
-                        """, (link_id, collection_id, attrs_collection_id))
-                        
-                    # Process web page details
-                    web_page_details = row.get('Web Page Details')
-                    if web_page_details and isinstance(web_page_details, str):
-                        # Step 1: Create IDs
-                        trans_id = generate_uuid()
-                        details_html_id = generate_uuid()
-                        lang_id = "365d96e3-9f08-4d2e-bf17-18a26a5072f7"  # Chinese language ID
-                        field_name = "details_html"
-                        
-                        # Step 2: Use existing translation as temporary placeholder
-                        # Get an existing translation ID to use as placeholder
-                        cur.execute("""
-                        SELECT id FROM details_html_translations LIMIT 1
-                        """)
-                        placeholder_result = cur.fetchone()
-                        
-                        if placeholder_result:
-                            placeholder_trans_id = placeholder_result[0]
-                        else:
-                            # If no existing translations, create a minimal one first
-                            placeholder_trans_id = generate_uuid()
-                            placeholder_html_id = generate_uuid()
-                            
-                            # Insert placeholder details_html record
-                            cur.execute("""
-                            INSERT INTO details_html (id, details_html)
-                            VALUES (%s, %s)
-                            """, (placeholder_html_id, placeholder_trans_id))
-                            
-                            # Insert placeholder translation
-                            cur.execute("""
-                            INSERT INTO details_html_translations 
-                            (id, details_html_id, lang_id, field_name, value)
-                            VALUES (%s, %s, %s, %s, %s)
-                            """, (placeholder_trans_id, placeholder_html_id, lang_id, "placeholder", "placeholder"))
-                        
-                        # Step 3: Insert details_html record with placeholder
-                        cur.execute("""
-                        INSERT INTO details_html (id, details_html)
-                        VALUES (%s, %s)
-                        RETURNING id
-                        """, (details_html_id, placeholder_trans_id))
-                        
-                        details_html_db_id = cur.fetchone()[0]
-                        
-                        # Step 4: Insert actual translation
-                        cur.execute("""
-                        INSERT INTO details_html_translations 
-                        (id, details_html_id, lang_id, field_name, value)
-                        VALUES (%s, %s, %s, %s, %s)
-                        """, (trans_id, details_html_db_id, lang_id, field_name, web_page_details))
-                        
-                        # Step 5: Update details_html to point to actual translation
-                        cur.execute("""
-                        UPDATE details_html SET details_html = %s WHERE id = %s
-                        """, (trans_id, details_html_db_id))
-                        
-                        print(f"Inserted web page details for collection {collection_id}")
-                        
-                        # Link details to collection
-                        # Check if link already exists
-                        cur.execute("""
-                        SELECT id FROM product_collection_details_html 
-                        WHERE product_collection_id = %s AND details_html_id = %s
-                        """, (collection_id, details_html_db_id))
-                        
-                        existing_link = cur.fetchone()
-                        
-                        if not existing_link:
-                            # Create new link
-                            link_id = generate_uuid()
-                            cur.execute("""
-                            INSERT INTO product_collection_details_html 
-                            (id, product_collection_id, details_html_id)
-                            VALUES (%s, %s, %s)
-                            """, (link_id, collection_id, details_html_db_id))
-                
-                # Process video URL
-                video_url = row.get('Video')
-                if video_url and isinstance(video_url, str):
-                    # Update collection with video URL
-                    cur.execute("""
-                    UPDATE product_collection 
-                    SET video = %s
-                    WHERE id = %s
-                    """, (video_url, collection_id))
-                
-                # Process product variations for this specific master code
-                print(f"Processing product variations for master code: {master_code}")
-                
-                # Filter variations that belong to this master code
-                master_variations = raw_df[raw_df['Master Code'] == master_code]
-                
-                for var_idx, var_row in master_variations.iterrows():
-                    # Skip the first row (master row) for this master code
-                    if var_idx == master_variations.index[0]:
-                        continue  # Skip the master row we just processed
-                    
-                    product_data = {}
-                    product_id = generate_uuid()
-                    
-                    # Extract product data
-                    for col in raw_df.columns:
-                        if col in mapping and mapping[col]['table'] == 'product' and mapping[col]['column']:
-                            db_col = mapping[col]['column']
-                            value = clean_string(convert_numpy_types(var_row[col]))
-                            if value:  # Only update if value is not empty
-                                # Handle numeric values with comma decimal separator
-                                if db_col in ['product_selling_price'] and isinstance(value, str):
-                                    value = value.replace(',', '.')
-                                product_data[db_col] = value
-                    
-                    # Add product ID and required fields
-                    product_data['id'] = product_id
-                    
-                    # Link product to collection using master_code
-                    # Extract master code from the current row to find the correct collection
-                    row_master_code = var_row.get('Master Code')
-                    if row_master_code:
-                        # Find the collection ID for this master code
-                        cur.execute("""
-                        SELECT id FROM product_collection 
-                        WHERE master_code = %s
-                        """, (row_master_code,))
-                        
-                        collection_result = cur.fetchone()
-                        if collection_result:
-                            # Use the actual collection ID instead of random UUID
-                            product_data['product_attributes_raw_collection_id'] = collection_result[0]
-                        else:
-                            # Fallback: use the collection_id from the master row processing
-                            product_data['product_attributes_raw_collection_id'] = collection_id
-                    else:
-                        # Fallback: use the collection_id from the master row processing
-                        product_data['product_attributes_raw_collection_id'] = collection_id
-                    
-                    # Store master code for easier querying
-                    if row_master_code:
-                        product_data['product_collection_master_code'] = row_master_code
-                    
-                    # Extract SKU code
-                    sku_code = var_row.get('SKU Code')
-                    if sku_code:
-                        product_data['product_collection_sku'] = sku_code
-                    
-                    # Inherit fields from parent collection
-                    if row_master_code:
-                        cur.execute("""
-                        SELECT product_collection_url, product_collection_image, images 
-                        FROM product_collection 
-                        WHERE master_code = %s
-                        """, (row_master_code,))
-                        
-                        collection_fields = cur.fetchone()
-                        if collection_fields:
-                            # Inherit collection fields into product
-                            if collection_fields[0]:  # product_collection_url
-                                product_data['product_collection_url'] = collection_fields[0]
-                            if collection_fields[1]:  # product_collection_image
-                                product_data['product_collection_image'] = collection_fields[1]
-                            if collection_fields[2]:  # images array
-                                product_data['images'] = collection_fields[2]
-                    
-                    # Insert product
-                    if product_data and 'product_collection_sku' in product_data:
-                        sku = product_data['product_collection_sku']
-                        
-                        # Check if product exists
-                        cur.execute("""
-                        SELECT id FROM product 
-                        WHERE product_collection_sku = %s
-                        """, (sku,))
-                        
-                        existing_product = cur.fetchone()
-                        
-                        if existing_product:
-                            # Update existing product
-                            update_cols = [col for col in product_data.keys() if col != 'id' and col != 'product_collection_sku']
-                            
-                            if update_cols:
-                                update_query = f"""
-                                UPDATE product SET 
-                                {', '.join([f"{col} = %s" for col in update_cols])}
-                                WHERE product_collection_sku = %s
-                                """
-                                
-                                update_values = [product_data[col] for col in update_cols]
-                                update_values.append(sku)
-                                
-                                cur.execute(update_query, update_values)
-                        else:
-                            # Insert new product
-                            columns = list(product_data.keys())
-                            values = [product_data[col] for col in columns]
-                            
-                            query = f"""
-                            INSERT INTO product ({', '.join(columns)})
-                            VALUES ({', '.join(['%s'] * len(columns))})
-                            """
-                            
-                            cur.execute(query, values)
-                        
-                        print(f"Inserted/Updated product with SKU: {sku_code}")
-                        
-                        # Process Sku Attribute if available
-                        sku_attr = var_row.get('Sku Attribute')
-                        if sku_attr and isinstance(sku_attr, str):
-                            # Store product attributes in product_attributes_raw_collection
-                            attrs_id = generate_uuid()
-                            cur.execute("""
-                            INSERT INTO product_attributes_raw_collection 
-                            (id, product_attributes_collection)
-                            VALUES (%s, %s)
-                            RETURNING id
-                            """, (attrs_id, sku_attr))
-                            
-                            attrs_collection_id = cur.fetchone()[0]
-                            
-                            # Link attributes to product
-                            cur.execute("""
-                            UPDATE product 
-                            SET product_attributes_raw_collection_id = %s
-                            WHERE id = %s
-                            """, (attrs_collection_id, product_id))
-        
+        import_master_groups(cur, master_groups, field_map)
         # Commit all changes (unless in dry run mode)
+        finish_transaction(conn)
+
+# === Parallel mode: one process per hash partition of master codes ===
+def master_code_partition(master_code, workers):
+    """Stable hash partition of a master code, identical in every process"""
+    return zlib.crc32(str(master_code).encode('utf-8')) % workers
+
+# Template rows whose blobs are stored per batch while preparing the workers
+PREPARE_BLOB_BATCH = 5000
+
+def prepare_shared_dictionaries(cur, csv_path, field_map):
+    """Create the shared rows of the import before the workers start
+
+    Categories, Sku Attributes, image lists, custom attributes, HTML
+    details and the details placeholder are all stored here, so workers
+    only find existing rows. Otherwise two workers inserting the same
+    content would each wait for the other's uncommitted partition, and
+    two such waits in opposite directions deadlock. Also builds the raw
+    data cache once, so the workers only read it.
+    """
+    raw_rows = normalize_frame(load_raw_frame(csv_path, read_columns(field_map)), field_map)
+    raw_rows = raw_rows.reindex(columns=['Master Code', 'Category Name', 'Sku Attribute', 'Product Image',
+                                         'Custom Attributes', 'Web Page Details'])
+    raw_rows = raw_rows.dropna(subset=['Master Code'])
+    is_variation = raw_rows['Master Code'].duplicated()
+    template_rows = raw_rows[~is_variation]
+
+    category_names = [name for name in template_rows['Category Name'].dropna().unique() if isinstance(name, str)]
+    print(f"Preparing {len(category_names)} categories for the workers...")
+    create_categories(cur, category_names, load_category_ids(cur))
+
+    sku_attrs = [value for value in raw_rows.loc[is_variation, 'Sku Attribute'].dropna().unique() if isinstance(value, str)]
+    store_sku_attributes(cur, sku_attrs)
+
+    get_details_html_placeholder(cur)
+
+    # Blobs of the template rows; in two-pass mode the heavy columns are read by record offset
+    heavy_columns = field_map['heavy_columns'] if LAZY_HEAVY_COLUMNS else []
+    reader = open_record_reader(csv_path) if heavy_columns else None
+    try:
+        for start in range(0, len(template_rows), PREPARE_BLOB_BATCH):
+            batch = template_rows.iloc[start:start + PREPARE_BLOB_BATCH]
+            if reader is not None:
+                batch = batch.copy()
+                heavy_values = [read_record_fields(reader, label, heavy_columns) for label in batch.index]
+                for col in heavy_columns:
+                    batch[col] = [values[col] for values in heavy_values]
+
+            image_lists = [collection_image_urls(value) for value in batch['Product Image'] if value and isinstance(value, str)]
+            store_blobs(cur, 'product_collection_img_array', 'product_collection_img_array',
+                        [image_urls for image_urls in image_lists if image_urls])
+            store_blobs(cur, 'custom_attributes_raw', 'custom_attributes_raw',
+                        [value for value in batch['Custom Attributes'] if value and isinstance(value, str)])
+            store_details_html(cur, [value for value in batch['Web Page Details'] if value and isinstance(value, str)])
+    finally:
+        if reader is not None:
+            close_record_reader(reader)
+
+def run_worker(worker_index, workers, field_map, csv_hash=None, file_hashes=None):
+    """Import one partition of master codes with its own connection and transaction"""
+    started = time.time()
+    stats = {'worker': worker_index, 'master_codes': 0, 'rows': 0, 'seconds': 0.0, 'error': None}
+    # Forked workers inherit the parent's counters
+    reset_run_stats()
+    # The parent already hashed the CSV, spawned workers would read all of it again
+    FILE_HASH_CACHE.update(file_hashes or {})
+
+    def partition_groups():
+        for master_code, master_rows in open_master_groups(RAW_CSV_PATH, field_map):
+            if master_code_partition(master_code, workers) == worker_index:
+                stats['master_codes'] += 1
+                stats['rows'] += len(master_rows)
+                yield master_code, master_rows
+
+    conn = connect_db(DB_CONFIG)
+    cur = conn.cursor()
+    try:
+        import_file(conn, cur, partition_groups(), field_map, csv_hash, f"{worker_index}/{workers}")
+    except Exception as e:
+        conn.rollback()
+        stats['error'] = str(e)
+    finally:
+        cur.close()
+        conn.close()
+
+    stats['seconds'] = time.time() - started
+    stats['run_stats'] = dict(RUN_STATS)
+    return stats
+
+def run_parallel(field_map, workers, csv_hash=None):
+    """Run the workers and print per-worker throughput, return True if all succeeded"""
+    print(f"PARALLEL MODE: {workers} workers, partitioned by master code")
+    # Hashes of the raw CSV taken by the parent (raw cache, checkpoints)
+    file_hashes = dict(FILE_HASH_CACHE)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_worker, worker_index, workers, field_map, csv_hash, file_hashes)
+                   for worker_index in range(workers)]
+        results = [future.result() for future in futures]
+
+    # Stage times of the workers are summed, they overlap in wall clock time
+    for stats in results:
+        merge_run_stats(stats['run_stats'])
+
+    print("\nWorker summary:")
+    for stats in results:
+        rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+        status = f"FAILED: {stats['error']}" if stats['error'] else "ok"
+        print(f"  Worker {stats['worker']}: {stats['master_codes']} master codes, {stats['rows']} rows "
+              f"in {stats['seconds']:.1f}s ({rate:.1f} rows/s) - {status}")
+
+    return all(stats['error'] is None for stats in results)
+
+def run_settings():
+    """Settings of this run, stored with its summary"""
+    return {
+        'csv_path': RAW_CSV_PATH,
+        'mapping_path': MAPPING_CSV_PATH,
+        'dry_run': DRY_RUN,
+        'bulk_load': BULK_LOAD,
+        'chunk_size': CHUNK_SIZE,
+        'workers': WORKERS,
+        'incremental': INCREMENTAL,
+        'plan_only': PLAN_ONLY,
+        'commit_every': COMMIT_EVERY,
+        'resume': RESUME,
+        'lazy_heavy_columns': LAZY_HEAVY_COLUMNS,
+        'write_batch_size': WRITE_BATCH_SIZE,
+        'categorical_max_ratio': CATEGORICAL_MAX_RATIO,
+        'stage_dir': STAGE_DIR,
+    }
+
+def report_run(conn, status):
+    """Print the run summary, write it to SUMMARY_PATH and store it in etl_run (except in dry runs)"""
+    summary = build_run_summary(status, run_settings())
+    print_run_summary(summary)
+    if SUMMARY_PATH:
+        write_run_summary(summary, SUMMARY_PATH)
+    # A dry run leaves the database untouched, including the run history
+    if DRY_RUN:
+        return
+    try:
+        save_run_summary(conn, summary)
+    except Exception as e:
+        conn.rollback()
+        print(f"Could not store the run summary in etl_run: {e}")
+
+def main():
+    print("Starting ETL process...")
+    reset_run_stats()
+
+    if DRY_RUN:
+        print("DRY RUN MODE: No changes will be committed to the database")
+
+    # 1. Load mapping configuration
+    print("Loading mapping configuration...")
+    with stage('mapping'):
+        mapping = load_mapping(MAPPING_CSV_PATH)
+        field_map = compile_mapping(mapping, read_raw_columns(RAW_CSV_PATH))
+
+    if PLAN_ONLY:
+        run_plan(field_map)
+        print_run_summary(build_run_summary('plan', run_settings()))
+        return
+
+    if STAGE_DIR:
+        run_staging(field_map)
+        print_run_summary(build_run_summary('staged', run_settings()))
+        return
+
+    # Connect to database
+    print("Connecting to database...")
+    conn = connect_db(DB_CONFIG)
+    cur = conn.cursor()
+    status = 'failed'
+
+    default_lang_id = ensure_default_lang(conn, cur)
+
+    try:
+        if DRY_RUN and WORKERS > 1:
+            # Workers use their own connections, they cannot see migrations the dry run would roll back
+            pending = pending_migrations(cur)
+            if pending:
+                raise RuntimeError(f"Dry run with workers needs {', '.join(pending)} applied first; "
+                                   f"run the SQL, a real import or a dry run without --workers")
+        # A dry run applies the migrations in its own transaction and rolls them back with the rest
+        if BULK_LOAD:
+            ensure_upsert_indexes(cur)
+        else:
+            ensure_content_hash_columns(cur)
+        if INCREMENTAL:
+            ensure_import_state_table(cur)
         if not DRY_RUN:
             conn.commit()
+        csv_hash = None
+        if checkpoints_enabled():
+            ensure_checkpoint_table(cur)
+            conn.commit()
+            # Checkpoints only apply to the exact same file content
+            csv_hash = file_content_hash(RAW_CSV_PATH)
+        elif COMMIT_EVERY > 0:
+            print("Dry run: --commit-every is ignored, everything runs in one transaction")
+
+        if WORKERS > 1:
+            # Shared dictionaries are committed before the workers read them
+            with stage('prepare'):
+                prepare_shared_dictionaries(cur, RAW_CSV_PATH, field_map)
+            finish_transaction(conn)
+            success = run_parallel(field_map, WORKERS, csv_hash)
+        else:
+            # 2. Read CSV data
+            master_groups = open_master_groups(RAW_CSV_PATH, field_map)
+            import_file(conn, cur, master_groups, field_map, csv_hash)
+            success = True
+
+        if not success:
+            status = 'partial'
+            print("ETL process finished with failed workers, their partitions were rolled back.")
+        elif not DRY_RUN:
+            status = 'success'
             print("ETL process completed successfully! All changes committed.")
         else:
-            conn.rollback()
+            status = 'dry_run'
             print("Dry run completed successfully! No changes were committed.")
-        
+
     except Exception as e:
         conn.rollback()
         print(f"Error during ETL process: {e}")
+        if checkpoints_enabled():
+            print("Committed batches are kept, continue with: python run_etl.py --resume")
     finally:
         cur.close()
+        report_run(conn, status)
         conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,77 @@
+-- Content-addressed storage for the blobs written by the ETL
+-- product_collection_img_array, custom_attributes_raw, details_html and
+-- product_attributes_raw_collection (Sku Attribute strings) get a content_hash
+-- (SHA-256 hex) with a unique index, so a re-import reuses the existing row.
+-- Hashes match ETL.content_hash(): image URL arrays are hashed as newline-joined items.
+
+ALTER TABLE product_collection_img_array ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE custom_attributes_raw ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE details_html ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE product_attributes_raw_collection ADD COLUMN IF NOT EXISTS content_hash text;
+
+-- Backfill: one row of each duplicate group gets the hash, the rest stay NULL
+UPDATE product_collection_img_array t
+SET content_hash = h.content_hash
+FROM (
+    SELECT DISTINCT ON (content_hash) id, content_hash
+    FROM (
+        SELECT id,
+               encode(sha256(convert_to(array_to_string(product_collection_img_array, E'\n'), 'UTF8')), 'hex') AS content_hash
+        FROM product_collection_img_array
+        WHERE product_collection_img_array IS NOT NULL
+    ) hashed
+    ORDER BY content_hash, id
+) h
+WHERE t.id = h.id AND t.content_hash IS NULL;
+
+UPDATE custom_attributes_raw t
+SET content_hash = h.content_hash
+FROM (
+    SELECT DISTINCT ON (content_hash) id, content_hash
+    FROM (
+        SELECT id,
+               encode(sha256(convert_to(custom_attributes_raw, 'UTF8')), 'hex') AS content_hash
+        FROM custom_attributes_raw
+        WHERE custom_attributes_raw IS NOT NULL
+    ) hashed
+    ORDER BY content_hash, id
+) h
+WHERE t.id = h.id AND t.content_hash IS NULL;
+
+UPDATE details_html t
+SET content_hash = h.content_hash
+FROM (
+    SELECT DISTINCT ON (content_hash) id, content_hash
+    FROM (
+        SELECT dh.id,
+               encode(sha256(convert_to(dht.value, 'UTF8')), 'hex') AS content_hash
+        FROM details_html dh
+        JOIN details_html_translations dht ON dht.id = dh.details_html
+        WHERE dht.field_name = 'details_html' AND dht.value IS NOT NULL
+    ) hashed
+    ORDER BY content_hash, id
+) h
+WHERE t.id = h.id AND t.content_hash IS NULL;
+
+UPDATE product_attributes_raw_collection t
+SET content_hash = h.content_hash
+FROM (
+    SELECT DISTINCT ON (content_hash) id, content_hash
+    FROM (
+        SELECT id,
+               encode(sha256(convert_to(product_attributes_collection, 'UTF8')), 'hex') AS content_hash
+        FROM product_attributes_raw_collection
+        WHERE product_attributes_collection IS NOT NULL
+    ) hashed
+    ORDER BY content_hash, id
+) h
+WHERE t.id = h.id AND t.content_hash IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_product_collection_img_array_content_hash
+    ON product_collection_img_array(content_hash);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_custom_attributes_raw_content_hash
+    ON custom_attributes_raw(content_hash);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_details_html_content_hash
+    ON details_html(content_hash);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_product_attributes_raw_collection_content_hash
+    ON product_attributes_raw_collection(content_hash);
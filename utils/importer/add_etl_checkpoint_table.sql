@@ -0,0 +1,14 @@
+-- Progress of checkpointed imports (run_etl.py --commit-every N / --resume)
+-- One row per raw file version (SHA-256 of the CSV) and partition ('all' or '<worker>/<workers>').
+-- master_codes_done counts the master codes of the partition, in file order, that are committed.
+
+CREATE TABLE IF NOT EXISTS etl_checkpoint (
+    csv_hash text NOT NULL,
+    partition text NOT NULL,
+    csv_path text,
+    master_codes_done integer NOT NULL DEFAULT 0,
+    last_master_code text,
+    status text NOT NULL,
+    modified_on timestamp with time zone DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (csv_hash, partition)
+);
@@ -0,0 +1,19 @@
+-- History of ETL runs with their timing and SQL statistics (written by ETL.py at the end of every run)
+-- status: 'success', 'dry_run', 'partial' (failed workers) or 'failed'
+-- summary: the full JSON summary, including per-stage timings and per-table statement/row counts
+
+CREATE TABLE IF NOT EXISTS etl_run (
+    id uuid PRIMARY KEY,
+    started_on timestamp with time zone NOT NULL,
+    finished_on timestamp with time zone NOT NULL,
+    status text NOT NULL,
+    csv_path text,
+    master_codes integer NOT NULL DEFAULT 0,
+    row_count integer NOT NULL DEFAULT 0,
+    wall_seconds numeric,
+    cpu_seconds numeric,
+    statements integer NOT NULL DEFAULT 0,
+    summary jsonb
+);
+
+CREATE INDEX IF NOT EXISTS etl_run_started_on_idx ON etl_run (started_on);
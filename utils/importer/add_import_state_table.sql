@@ -0,0 +1,10 @@
+-- Content fingerprints of the last import, used by the incremental ETL mode (run_etl.py --incremental)
+-- entity_type: 'collection' (keyed by master code) or 'product' (keyed by SKU)
+
+CREATE TABLE IF NOT EXISTS etl_import_state (
+    entity_type text NOT NULL,
+    entity_key text NOT NULL,
+    fingerprint text NOT NULL,
+    modified_on timestamp with time zone DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (entity_type, entity_key)
+);
@@ -0,0 +1,11 @@
+-- Unique indexes used as ON CONFLICT targets by the ETL bulk load mode (BULK_LOAD=true / run_etl.py --bulk)
+-- Run diagnosis_and_fix.sql / cleanup_incorrect_products.py first if duplicates exist
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_product_collection_master_code
+    ON product_collection(master_code);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_product_collection_sku
+    ON product(product_collection_sku);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_product_collection_translations_key
+    ON product_collection_translations(product_id, lang_id, field_name);
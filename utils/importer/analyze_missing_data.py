@@ -2,6 +2,7 @@ import psycopg2
 from dotenv import load_dotenv
 import os
 import psycopg2
+from raw_data_cache import load_raw_frame
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +16,9 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASS")
 }
 
+# Raw supplier CSV, read through the Parquet cache shared with ETL.py
+RAW_CSV_PATH = os.getenv('RAW_CSV_PATH', 'x:\\DATA_STORAGE\\Furnithai\\RAW_WXW\\latest_Raw Data.csv')
+
 def analyze_missing_data():
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
@@ -42,6 +46,20 @@ def analyze_missing_data():
     collections_without_details = cur.fetchall()
     print(f"Collections without details: {len(collections_without_details)}")
     
+    # Check for raw file rows that never made it into the database
+    if os.path.exists(RAW_CSV_PATH):
+        raw_df = load_raw_frame(RAW_CSV_PATH, ['Master Code', 'SKU Code']).dropna(subset=['Master Code'])
+        
+        cur.execute("SELECT master_code FROM product_collection")
+        db_master_codes = {str(row[0]) for row in cur.fetchall()}
+        cur.execute("SELECT product_collection_sku FROM product")
+        db_skus = {str(row[0]) for row in cur.fetchall()}
+        
+        raw_master_codes = set(raw_df['Master Code'].str.strip())
+        raw_skus = set(raw_df['SKU Code'].dropna().str.strip())
+        print(f"Master codes in raw file but not in database: {len(raw_master_codes - db_master_codes)}")
+        print(f"SKUs in raw file but not in database: {len(raw_skus - db_skus)}")
+    
     cur.close()
     conn.close()
 
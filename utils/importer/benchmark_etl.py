@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end importer benchmark.
+
+For every scale (number of master codes) a synthetic Raw Data CSV is
+generated (generate_raw_data.py), and for every import mode ETL.main()
+runs in a child process against a throwaway database on the local
+PostgreSQL server. The throwaway database gets the schema of DB_NAME
+(pg_dump --schema-only, or --schema-file), the importer migrations and
+the lang rows, and is dropped afterwards.
+
+Recorded per run: wall time, rows/s, peak RSS, SQL statements (total
+and per table) and the stage timings of the run summary.
+
+Usage:
+    python benchmark_etl.py --scales 100,1000,5000 --modes row,bulk --output bench.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from generate_raw_data import generate_raw_data, write_mapping
+
+# === UTF-8 консоль для Windows ===
+if os.name == "nt":
+    import ctypes
+    ctypes.windll.kernel32.SetConsoleOutputCP(65001)
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration, DB_NAME is the schema source and is never written to
+DB_CONFIG = {
+    "host": "localhost",
+    "port": os.getenv("DB_PORT", "5433"),
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASS")
+}
+
+IMPORTER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Migrations the importer expects, applied to every throwaway database in this order
+SETUP_SQL_FILES = [
+    'add_content_hash_columns.sql',
+    'make_category_fks_deferrable.sql',
+    'add_upsert_indexes.sql',
+    'add_import_state_table.sql',
+    'add_etl_run_table.sql',
+]
+# Must match ETL.ZH_LANG_ID
+ZH_LANG_ID = "365d96e3-9f08-4d2e-bf17-18a26a5072f7"
+
+# Import modes: environment of the ETL child process
+MODES = {
+    'row': {},
+    'bulk': {'BULK_LOAD': 'true'},
+    'bulk-stream': {'BULK_LOAD': 'true', 'CHUNK_SIZE': '5000'},
+    'workers': {'BULK_LOAD': 'true', 'ETL_WORKERS': '4'},
+}
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its waited-for children, in MB"""
+    try:
+        import resource
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+def postgres_env():
+    """Environment for pg_dump / psql"""
+    env = dict(os.environ)
+    env.update({'PGHOST': DB_CONFIG['host'], 'PGPORT': str(DB_CONFIG['port']),
+                'PGUSER': DB_CONFIG['user'] or '', 'PGPASSWORD': DB_CONFIG['password'] or ''})
+    return env
+
+def admin_connection():
+    """Autocommit connection to the maintenance database, for CREATE/DROP DATABASE"""
+    conn = psycopg2.connect(**{**DB_CONFIG, 'dbname': 'postgres'})
+    conn.autocommit = True
+    return conn
+
+def create_scratch_database(db_name, schema_file=None):
+    """Create db_name with the production schema, the importer migrations and the lang rows"""
+    conn = admin_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{db_name}"')
+    finally:
+        conn.close()
+
+    if schema_file:
+        with open(schema_file, 'r', encoding='utf-8') as f:
+            schema_sql = f.read()
+    else:
+        if not shutil.which('pg_dump'):
+            raise RuntimeError("pg_dump not found on PATH, pass --schema-file instead")
+        schema_sql = subprocess.run(
+            ['pg_dump', '--schema-only', '--no-owner', '--no-privileges', DB_CONFIG['dbname']],
+            env=postgres_env(), capture_output=True, text=True, encoding='utf-8', check=True).stdout
+    # psql meta-commands (\restrict, \connect, ...) cannot be sent as SQL
+    schema_sql = '\n'.join(line for line in schema_sql.splitlines() if not line.startswith('\\'))
+
+    source = psycopg2.connect(**DB_CONFIG)
+    scratch = psycopg2.connect(**{**DB_CONFIG, 'dbname': db_name})
+    try:
+        with source.cursor() as cur:
+            cur.execute("SELECT id, lang_code FROM lang")
+            lang_rows = cur.fetchall()
+
+        with scratch.cursor() as cur:
+            cur.execute(schema_sql)
+            # pg_dump leaves an empty search_path behind
+            cur.execute("SET search_path TO public")
+            for file_name in SETUP_SQL_FILES:
+                with open(os.path.join(IMPORTER_DIR, file_name), 'r', encoding='utf-8') as f:
+                    cur.execute(f.read())
+            if lang_rows:
+                execute_values(cur, "INSERT INTO lang (id, lang_code) VALUES %s ON CONFLICT DO NOTHING", lang_rows)
+            cur.execute("""
+            INSERT INTO lang (id, lang_code) SELECT %s, 'zh'
+            WHERE NOT EXISTS (SELECT 1 FROM lang WHERE id = %s)
+            """, (ZH_LANG_ID, ZH_LANG_ID))
+        scratch.commit()
+    finally:
+        source.close()
+        scratch.close()
+
+def drop_scratch_database(db_name):
+    """Drop the throwaway database, closing leftover connections first"""
+    conn = admin_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+            WHERE datname = %s AND pid <> pg_backend_pid()
+            """, (db_name,))
+            cur.execute(f'DROP DATABASE IF EXISTS "{db_name}"')
+    finally:
+        conn.close()
+
+def run_import(db_name, csv_path, mapping_path, mode, work_dir, label):
+    """Run ETL.main() in a child process, return its summary with peak RSS"""
+    summary_path = os.path.join(work_dir, f"summary_{label}.json")
+    env = dict(os.environ)
+    env.update(MODES[mode])
+    env.update({
+        'DB_NAME': db_name,
+        'RAW_CSV_PATH': csv_path,
+        'MAPPING_CSV_PATH': mapping_path,
+        'ETL_SUMMARY_PATH': summary_path,
+        'RAW_CACHE_DIR': os.path.join(work_dir, 'raw_cache'),
+        'DRY_RUN': 'false',
+    })
+
+    log_path = os.path.join(work_dir, f"etl_{label}.log")
+    with open(log_path, 'w', encoding='utf-8') as log:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'],
+                                   env=env, cwd=IMPORTER_DIR, stdout=log, stderr=subprocess.STDOUT)
+
+    if completed.returncode != 0 or not os.path.exists(summary_path):
+        raise RuntimeError(f"ETL run {label} failed, see {log_path}")
+    with open(summary_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def child_main():
+    """Entry point of the ETL child process: run the import, add peak RSS to its summary"""
+    # Import after the environment is set: ETL reads its settings at import time
+    from ETL import main as run_etl, SUMMARY_PATH
+    run_etl()
+
+    with open(SUMMARY_PATH, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    summary['peak_rss_mb'] = peak_rss_mb()
+    with open(SUMMARY_PATH, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+def benchmark_result(scale, mode, phase, summary):
+    """One line of the result table"""
+    return {
+        'master_codes': scale,
+        'mode': mode,
+        'phase': phase,
+        'status': summary['status'],
+        'rows': summary['rows'],
+        'wall_seconds': summary['wall_seconds'],
+        'rows_per_second': summary['rows_per_second'],
+        'peak_rss_mb': summary.get('peak_rss_mb'),
+        'statements': summary['statements'],
+        'stages': summary['stages'],
+        'tables': summary['tables'],
+    }
+
+def print_results(results):
+    """Print the result table"""
+    print(f"\n{'Masters':>8} {'Mode':<12} {'Phase':<9} {'Rows':>8} {'Seconds':>9} {'Rows/s':>9} {'Peak MB':>8} {'Statements':>11}  Status")
+    for result in results:
+        peak = f"{result['peak_rss_mb']:.1f}" if result['peak_rss_mb'] is not None else 'n/a'
+        print(f"{result['master_codes']:>8} {result['mode']:<12} {result['phase']:<9} {result['rows']:>8} "
+              f"{result['wall_seconds']:>9.2f} {result['rows_per_second']:>9.1f} {peak:>8} {result['statements']:>11}  {result['status']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the importer against throwaway databases')
+    parser.add_argument('--scales', type=str, default='100,1000,5000', help='Comma-separated master code counts (default: 100,1000,5000)')
+    parser.add_argument('--modes', type=str, default='row,bulk', help=f"Comma-separated import modes: {', '.join(MODES)} (default: row,bulk)")
+    parser.add_argument('--variants', type=int, default=4, help='SKU rows per master code (default: 4)')
+    parser.add_argument('--html-kb', type=int, default=20, help='Size of the Web Page Details HTML in KB (default: 20)')
+    parser.add_argument('--images', type=int, default=8, help='Images per collection (default: 8)')
+    parser.add_argument('--reimport', action='store_true', help='Import every file a second time into the same database (update path)')
+    parser.add_argument('--schema-file', type=str, help='Schema SQL for the throwaway databases (default: pg_dump --schema-only of DB_NAME)')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    parser.add_argument('--keep-files', action='store_true', help='Keep generated CSVs, logs and summaries')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main()
+        return
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}")
+
+    work_dir = tempfile.mkdtemp(prefix='etl_bench_')
+    print(f"Working directory: {work_dir}")
+    mapping_path = os.path.join(work_dir, 'map.csv')
+    write_mapping(mapping_path)
+
+    results = []
+    completed = False
+    try:
+        for scale in scales:
+            csv_path = os.path.join(work_dir, f"raw_data_{scale}.csv")
+            rows = generate_raw_data(csv_path, scale, args.variants, args.html_kb, args.images)
+            print(f"Generated {rows} rows for {scale} master codes")
+
+            for mode in modes:
+                db_name = f"etl_bench_{os.getpid()}_{scale}_{mode.replace('-', '_')}"
+                print(f"Running {mode} import of {scale} master codes in {db_name}...")
+                create_scratch_database(db_name, args.schema_file)
+                try:
+                    phases = ['initial', 'reimport'] if args.reimport else ['initial']
+                    for phase in phases:
+                        summary = run_import(db_name, csv_path, mapping_path, mode, work_dir, f"{scale}_{mode}_{phase}")
+                        results.append(benchmark_result(scale, mode, phase, summary))
+                        print(f"  {phase}: {summary['rows_per_second']:.1f} rows/s, {summary['statements']} statements")
+                finally:
+                    drop_scratch_database(db_name)
+        completed = True
+    finally:
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"Results written to {args.output}")
+        # Logs of a failed run are kept for inspection
+        if completed and not args.keep_files:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
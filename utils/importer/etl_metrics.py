@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Per-run instrumentation of the ETL process.
+
+Stages are timed with stage(name) (wall and CPU seconds), every SQL
+statement sent through a connection from connect_db() is counted per
+table together with the rows it returned or affected. A page of the
+batched writer counts as one statement (round trip) and as one row per
+queued execution. At the end of a run build_run_summary() turns the
+counters into a JSON-ready dict that is printed and stored in the
+etl_run history table.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import LoggingConnection
+
+# History table of ETL runs
+ETL_RUN_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_etl_run_table.sql')
+
+# First table named by a statement: INSERT INTO x, UPDATE x, DELETE FROM x, COPY x, ... FROM x
+SQL_TABLE_PATTERN = re.compile(r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|COPY|TABLE(?:\s+IF\s+EXISTS)?|FROM)\s+(\w+)', re.IGNORECASE)
+# Prepared statements of the batched writer are named etl_<table>_<n>
+EXECUTE_TABLE_PATTERN = re.compile(r'^\s*EXECUTE\s+etl_(\w+?)_\d+\b', re.IGNORECASE)
+# Only the head of a statement is inspected, execute_values pages can be megabytes long
+SQL_HEAD_LENGTH = 2000
+
+RUN_STATS = {}
+
+def reset_run_stats():
+    """Start a new run: clear all counters"""
+    RUN_STATS.clear()
+    RUN_STATS.update({
+        'started_at': time.perf_counter(),
+        'started_cpu': time.process_time(),
+        'started_on': datetime.now(timezone.utc).isoformat(),
+        'master_codes': 0,
+        'rows': 0,
+        'stages': {},
+        'tables': {},
+    })
+
+@contextmanager
+def stage(name):
+    """Add the wall and CPU time of the block to the named stage"""
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        yield
+    finally:
+        totals = RUN_STATS.setdefault('stages', {}).setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        totals['calls'] += 1
+        totals['wall_seconds'] += time.perf_counter() - wall_started
+        totals['cpu_seconds'] += time.process_time() - cpu_started
+
+def statement_table(query):
+    """Table a statement works on, 'other' for statements without one"""
+    if isinstance(query, bytes):
+        query = query[:SQL_HEAD_LENGTH].decode('utf-8', 'replace')
+    match = EXECUTE_TABLE_PATTERN.match(query) or SQL_TABLE_PATTERN.search(query[:SQL_HEAD_LENGTH])
+    return match.group(1).lower() if match else 'other'
+
+def count_statement(table, rows):
+    """Count one statement and its rows for a table"""
+    totals = RUN_STATS.setdefault('tables', {}).setdefault(table, {'statements': 0, 'rows': 0})
+    totals['statements'] += 1
+    totals['rows'] += max(rows, 0)
+
+def count_rows(table, rows):
+    """Add rows written by statements the hook only sees as one page (batched EXECUTEs)"""
+    totals = RUN_STATS.setdefault('tables', {}).setdefault(table, {'statements': 0, 'rows': 0})
+    totals['rows'] += max(rows, 0)
+
+def record_statement(query, curs):
+    """LoggingConnection hook, called after every execute()
+
+    A page of batched EXECUTEs is one statement (round trip) whose rowcount
+    is only that of its last EXECUTE; the writer counts its rows instead.
+    """
+    if isinstance(query, bytes):
+        query = query[:SQL_HEAD_LENGTH].decode('utf-8', 'replace')
+    batched = EXECUTE_TABLE_PATTERN.match(query) is not None
+    count_statement(statement_table(query), 0 if batched or curs is None else curs.rowcount)
+
+def count_master_groups(master_groups):
+    """Pass master code groups through, counting groups and rows"""
+    for master_code, master_rows in master_groups:
+        RUN_STATS['master_codes'] = RUN_STATS.get('master_codes', 0) + 1
+        RUN_STATS['rows'] = RUN_STATS.get('rows', 0) + len(master_rows)
+        yield master_code, master_rows
+
+def connect_db(db_config):
+    """Open a connection whose statements are counted in RUN_STATS
+
+    COPY (cursor.copy_expert) bypasses the hook and is counted by the caller.
+    """
+    conn = psycopg2.connect(**db_config, connection_factory=LoggingConnection)
+    conn.initialize(None)
+    conn.log = record_statement
+    return conn
+
+def merge_run_stats(worker_stats):
+    """Add the counters of a worker process to this process' RUN_STATS"""
+    RUN_STATS['master_codes'] = RUN_STATS.get('master_codes', 0) + worker_stats.get('master_codes', 0)
+    RUN_STATS['rows'] = RUN_STATS.get('rows', 0) + worker_stats.get('rows', 0)
+    for name, totals in worker_stats.get('stages', {}).items():
+        merged = RUN_STATS.setdefault('stages', {}).setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        for key in merged:
+            merged[key] += totals[key]
+    for table, totals in worker_stats.get('tables', {}).items():
+        merged = RUN_STATS.setdefault('tables', {}).setdefault(table, {'statements': 0, 'rows': 0})
+        for key in merged:
+            merged[key] += totals[key]
+
+def build_run_summary(status, settings):
+    """JSON-ready summary of the current run"""
+    wall_seconds = time.perf_counter() - RUN_STATS['started_at']
+    tables = RUN_STATS.get('tables', {})
+    return {
+        'run_id': str(uuid.uuid4()),
+        'started_on': RUN_STATS['started_on'],
+        'finished_on': datetime.now(timezone.utc).isoformat(),
+        'status': status,
+        'settings': settings,
+        'master_codes': RUN_STATS.get('master_codes', 0),
+        'rows': RUN_STATS.get('rows', 0),
+        'wall_seconds': round(wall_seconds, 3),
+        'cpu_seconds': round(time.process_time() - RUN_STATS['started_cpu'], 3),
+        'rows_per_second': round(RUN_STATS.get('rows', 0) / wall_seconds, 1) if wall_seconds else 0,
+        'statements': sum(totals['statements'] for totals in tables.values()),
+        'stages': {name: {key: round(value, 3) for key, value in totals.items()}
+                   for name, totals in RUN_STATS.get('stages', {}).items()},
+        'tables': dict(sorted(tables.items())),
+        # Raw DataFrame footprint before/after compact_frame(), when the whole file was loaded
+        'frame_memory_mb': RUN_STATS.get('frame_memory_mb'),
+    }
+
+def print_run_summary(summary):
+    """Print the stage and table breakdown, then the summary as one JSON line"""
+    print("\nStage timings (wall / CPU seconds):")
+    for name, totals in sorted(summary['stages'].items(), key=lambda item: -item[1]['wall_seconds']):
+        print(f"  {name:<20} {totals['wall_seconds']:>9.2f} / {totals['cpu_seconds']:>9.2f}  ({totals['calls']} calls)")
+
+    print("SQL statements per table:")
+    for table, totals in sorted(summary['tables'].items(), key=lambda item: -item[1]['statements']):
+        print(f"  {table:<40} {totals['statements']:>8} statements {totals['rows']:>10} rows")
+
+    print(f"ETL_RUN_SUMMARY {json.dumps(summary, ensure_ascii=False)}")
+
+def write_run_summary(summary, path):
+    """Write the summary to a JSON file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+def save_run_summary(conn, summary):
+    """Store the summary in etl_run, in its own transaction"""
+    cur = conn.cursor()
+    try:
+        with open(ETL_RUN_SQL_PATH, 'r', encoding='utf-8') as f:
+            cur.execute(f.read())
+        cur.execute("""
+        INSERT INTO etl_run (id, started_on, finished_on, status, csv_path, master_codes, row_count,
+                             wall_seconds, cpu_seconds, statements, summary)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (summary['run_id'], summary['started_on'], summary['finished_on'], summary['status'],
+              summary['settings'].get('csv_path'), summary['master_codes'], summary['rows'],
+              summary['wall_seconds'], summary['cpu_seconds'], summary['statements'],
+              json.dumps(summary, ensure_ascii=False)))
+        conn.commit()
+    finally:
+        cur.close()
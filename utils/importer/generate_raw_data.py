@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Raw Data generator for importer tests and benchmarks.
+
+Writes a supplier-style CSV (';'-separated, one template row per master
+code followed by its SKU rows) and a map.csv that matches its columns.
+Sizes are configurable: number of master codes, variants per master,
+HTML size, images per collection. Attribute strings are Chinese, like
+the real WXW export. The output is deterministic for a given seed.
+
+Usage:
+    python generate_raw_data.py --master-codes 1000 --variants 4 --out bench_data
+"""
+
+import os
+import sys
+import csv
+import random
+import argparse
+
+# === UTF-8 консоль для Windows ===
+if os.name == "nt":
+    import ctypes
+    ctypes.windll.kernel32.SetConsoleOutputCP(65001)
+    sys.stdout.reconfigure(encoding='utf-8')
+
+RAW_COLUMNS = [
+    'Master Code', 'SKU Code', 'Product Name', 'Product URL', 'Main Image', 'Product Image',
+    'Category Name', 'Custom Attributes', 'Web Page Details', 'Video', 'Sku Attribute',
+    'SKU Image', 'Selling Price', 'Inventory', 'Weight', 'Length', 'Width', 'Height',
+]
+
+# raw_input_field -> (db_table, field); unmapped raw columns are read by the importer directly
+MAPPING = [
+    ('Master Code', 'product_collection', 'master_code'),
+    ('Product Name', 'product_collection_translations', ''),
+    ('Product URL', 'product_collection', 'product_collection_url'),
+    ('Main Image', 'product_collection', 'product_collection_image'),
+    ('SKU Image', 'product', 'product_image'),
+    ('Selling Price', 'product', 'product_selling_price'),
+    ('Inventory', 'product', 'inventory'),
+    ('Weight', 'product', 'weight'),
+    ('Length', 'product', 'long'),
+    ('Width', 'product', 'width'),
+    ('Height', 'product', 'high'),
+]
+
+CATEGORIES = ['沙发', '餐桌', '餐椅', '床', '床头柜', '衣柜', '书桌', '办公椅', '茶几', '电视柜', '鞋柜', '书架']
+MATERIALS = ['实木', '橡木', '胡桃木', '松木', '布艺', '真皮', '金属', '大理石', '藤编']
+STYLES = ['现代简约', '北欧', '新中式', '美式', '轻奢', '工业风', '日式']
+COLORS = ['白色', '黑色', '原木色', '胡桃色', '灰色', '米色', '绿色']
+ORIGINS = ['广东佛山', '浙江湖州', '江西南康', '四川成都']
+DETAIL_SENTENCES = [
+    '精选优质木材，经过多道工序打磨，触感细腻。',
+    '人体工学设计，久坐不累，适合家庭与办公使用。',
+    '环保水性漆，无刺激气味，呵护家人健康。',
+    '加厚承重结构，稳固耐用，不易变形。',
+    '简约线条设计，百搭各种家居风格。',
+]
+
+def generate_master_row(rng, index, images, html_kb):
+    """Template row of one master code (collection level fields)"""
+    master_code = f"M{index:07d}"
+    image_urls = [f"https://img.example.com/{master_code}/{n}.jpg" for n in range(images)]
+
+    paragraphs = []
+    size = 0
+    while size < html_kb * 1024:
+        paragraph = f'<p>{rng.choice(DETAIL_SENTENCES)}</p><img src="https://img.example.com/{master_code}/detail_{len(paragraphs)}.jpg"/>'
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode('utf-8'))
+
+    return {
+        'Master Code': master_code,
+        'Product Name': f"{rng.choice(STYLES)}{rng.choice(MATERIALS)}{rng.choice(CATEGORIES)} {index}",
+        'Product URL': f"https://shop.example.com/item/{master_code}",
+        'Main Image': image_urls[0] if image_urls else '',
+        'Product Image': '[' + ', '.join(image_urls) + ']',
+        'Category Name': rng.choice(CATEGORIES),
+        'Custom Attributes': (f"材质:{rng.choice(MATERIALS)};风格:{rng.choice(STYLES)}"
+                              f"-产地:{rng.choice(ORIGINS)};是否可定制:{rng.choice(['是', '否'])}"),
+        'Web Page Details': '<div class="detail">' + ''.join(paragraphs) + '</div>',
+        'Video': f"https://video.example.com/{master_code}.mp4" if rng.random() < 0.3 else '',
+    }
+
+def generate_variant_row(rng, master_code, variant):
+    """SKU row of one variation"""
+    length, width, height = rng.randint(40, 240), rng.randint(30, 120), rng.randint(40, 200)
+    return {
+        'Master Code': master_code,
+        'SKU Code': f"{master_code}-{variant:02d}",
+        'Sku Attribute': f"颜色:{rng.choice(COLORS)};尺寸:{length}x{width}x{height}cm",
+        'SKU Image': f"https://img.example.com/{master_code}/sku_{variant}.jpg",
+        # Decimal comma, like the supplier export
+        'Selling Price': f"{rng.randint(199, 9999)},{rng.randint(0, 99):02d}",
+        'Inventory': str(rng.randint(0, 500)),
+        'Weight': f"{rng.uniform(2, 120):.1f}",
+        'Length': str(length),
+        'Width': str(width),
+        'Height': str(height),
+    }
+
+def generate_raw_data(csv_path, master_codes=1000, variants=4, html_kb=20, images=8, seed=42):
+    """Write a synthetic Raw Data CSV, return the number of data rows"""
+    rng = random.Random(seed)
+    rows = 0
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RAW_COLUMNS, delimiter=';', restval='')
+        writer.writeheader()
+        for index in range(master_codes):
+            master_row = generate_master_row(rng, index, images, html_kb)
+            writer.writerow(master_row)
+            rows += 1
+            for variant in range(variants):
+                writer.writerow(generate_variant_row(rng, master_row['Master Code'], variant))
+                rows += 1
+    return rows
+
+def write_mapping(mapping_path):
+    """Write the map.csv matching the generated columns"""
+    with open(mapping_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['raw_input_field', 'db_table', 'field'])
+        writer.writerows(MAPPING)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Raw Data CSV and its map.csv')
+    parser.add_argument('--out', type=str, default='.', help='Output directory (default: current directory)')
+    parser.add_argument('--master-codes', type=int, default=1000, help='Number of master codes (default: 1000)')
+    parser.add_argument('--variants', type=int, default=4, help='SKU rows per master code (default: 4)')
+    parser.add_argument('--html-kb', type=int, default=20, help='Size of the Web Page Details HTML in KB (default: 20)')
+    parser.add_argument('--images', type=int, default=8, help='Images per collection (default: 8)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    csv_path = os.path.join(args.out, 'raw_data.csv')
+    mapping_path = os.path.join(args.out, 'map.csv')
+
+    rows = generate_raw_data(csv_path, args.master_codes, args.variants, args.html_kb, args.images, args.seed)
+    write_mapping(mapping_path)
+    print(f"Wrote {rows} rows ({args.master_codes} master codes) to {csv_path}")
+    print(f"Wrote mapping to {mapping_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Loader of the offline staging files written by ETL.py (STAGE_DIR / run_etl.py --stage-dir).
+
+Every file is COPYed into a temp table shaped like its target table and
+applied with one set-based statement per table, parents first, in a
+single transaction. IDs come from the files; where a row already exists
+under its natural key (master_code, SKU, content hash) the file ID is
+replaced by the stored one before the children are applied.
+
+Usage:
+    python load_staging_files.py --stage-dir staged [--dry-run]
+"""
+
+import os
+import sys
+import json
+import argparse
+from ETL import (DB_CONFIG, STAGING_MANIFEST, ensure_upsert_indexes, get_details_html_placeholder,
+                 link_categories, load_category_ids, apply_collection_links, inherit_staged_collection_fields)
+from etl_metrics import (stage, count_statement, connect_db, reset_run_stats, build_run_summary,
+                         print_run_summary, save_run_summary, RUN_STATS)
+
+# === UTF-8 консоль для Windows ===
+if os.name == "nt":
+    import ctypes
+    ctypes.windll.kernel32.SetConsoleOutputCP(65001)
+    sys.stdout.reconfigure(encoding='utf-8')
+
+# Content-addressed blob tables linked to collections: (blob table, link table, child column)
+BLOB_LINKS = [
+    ('product_collection_img_array', 'product_collection_product_collection_img_array', 'product_collection_img_array'),
+    ('custom_attributes_raw', 'product_collection_custom_attributes_raw', 'custom_attributes_raw_id'),
+    ('details_html', 'product_collection_details_html', 'details_html_id'),
+]
+
+def load_manifest(stage_dir):
+    """Read the manifest of a complete staging file set"""
+    manifest_path = os.path.join(stage_dir, STAGING_MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No {STAGING_MANIFEST} in {stage_dir}, the staging files are missing or incomplete")
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def copy_staging_file(cur, stage_dir, entry):
+    """COPY one staging file into the temp table load_<table>, return its name"""
+    table = entry['table']
+    columns = entry['columns']
+    loading_table = f"load_{table}"
+    if table == 'product_collection_category':
+        # Links by category name, the category IDs are resolved while loading
+        select_list = "product_collection_id, ''::text AS category_name"
+    else:
+        # Column types come from the target table, constraints do not
+        select_list = ', '.join(columns)
+    cur.execute(f"""
+    CREATE TEMP TABLE {loading_table} ON COMMIT DROP AS
+    SELECT {select_list} FROM {table} WITH NO DATA
+    """)
+
+    with open(os.path.join(stage_dir, entry['file']), 'r', encoding='utf-8') as f:
+        cur.copy_expert(f"COPY {loading_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)", f)
+    # COPY does not go through the statement hook of the connection
+    count_statement(loading_table, entry['rows'])
+    return loading_table
+
+def upsert_loaded_rows(cur, table, columns, conflict_columns, keep_existing_on_null=False, keep_existing_columns=()):
+    """Apply load_<table> with one INSERT ... ON CONFLICT DO UPDATE, the last row wins for duplicate keys"""
+    update_cols = [col for col in columns if col != 'id' and col not in conflict_columns]
+    # Same as the row mode: empty values do not overwrite existing data
+    assignments = [f"{col} = COALESCE(EXCLUDED.{col}, {table}.{col})"
+                   if keep_existing_on_null or col in keep_existing_columns else f"{col} = EXCLUDED.{col}"
+                   for col in update_cols]
+    conflict_action = f"DO UPDATE SET {', '.join(assignments)}" if assignments else "DO NOTHING"
+
+    cur.execute(f"""
+    INSERT INTO {table} ({', '.join(columns)})
+    SELECT {', '.join(columns)} FROM (
+        SELECT DISTINCT ON ({', '.join(conflict_columns)}) {', '.join(columns)}
+        FROM load_{table}
+        ORDER BY {', '.join(conflict_columns)}, ctid DESC
+    ) s
+    ON CONFLICT ({', '.join(conflict_columns)}) {conflict_action}
+    """)
+    print(f"Loaded {cur.rowcount} rows into {table}")
+
+def remap_collection_ids(cur, loading_table, column):
+    """Replace file collection IDs by the IDs stored for the same master code"""
+    cur.execute(f"""
+    UPDATE {loading_table} SET {column} = m.id
+    FROM load_collection_ids m
+    WHERE {loading_table}.{column} = m.file_id AND m.id <> m.file_id
+    """)
+
+def load_collections(cur, entry):
+    """Upsert collections by master_code and map the file IDs to the stored ones"""
+    # Collections without a video are staged with an empty one, the stored video stays
+    upsert_loaded_rows(cur, 'product_collection', entry['columns'], ['master_code'], keep_existing_columns=['video'])
+    cur.execute("""
+    CREATE TEMP TABLE load_collection_ids ON COMMIT DROP AS
+    SELECT s.id AS file_id, pc.id
+    FROM load_product_collection s
+    JOIN product_collection pc ON pc.master_code = s.master_code
+    """)
+
+def load_blobs(cur, blob_table, entry):
+    """Insert blobs whose content hash is new"""
+    columns = entry['columns']
+    if blob_table == 'details_html':
+        load_details_html(cur)
+    else:
+        cur.execute(f"""
+        INSERT INTO {blob_table} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM load_{blob_table}
+        ON CONFLICT (content_hash) DO NOTHING
+        """)
+        print(f"Loaded {cur.rowcount} new rows into {blob_table}")
+
+def load_details_html(cur):
+    """Insert new details_html rows and their translations, through the placeholder translation"""
+    placeholder_trans_id = get_details_html_placeholder(cur)
+    cur.execute("""
+    INSERT INTO details_html (id, details_html, content_hash)
+    SELECT id, %s, content_hash FROM load_details_html
+    ON CONFLICT (content_hash) DO NOTHING
+    """, (placeholder_trans_id,))
+    print(f"Loaded {cur.rowcount} new rows into details_html")
+
+    # Only the rows inserted above still point to the placeholder
+    cur.execute("""
+    INSERT INTO details_html_translations (id, details_html_id, lang_id, field_name, value)
+    SELECT t.id, t.details_html_id, t.lang_id, t.field_name, t.value
+    FROM load_details_html_translations t
+    JOIN details_html d ON d.id = t.details_html_id AND d.details_html = %s
+    """, (placeholder_trans_id,))
+    cur.execute("""
+    UPDATE details_html SET details_html = s.details_html
+    FROM load_details_html s
+    WHERE details_html.id = s.id AND details_html.details_html = %s
+    """, (placeholder_trans_id,))
+
+def remap_blob_ids(cur, loading_table, column, blob_table):
+    """Replace file blob IDs by the IDs stored for the same content hash"""
+    cur.execute(f"""
+    UPDATE {loading_table} SET {column} = b.id
+    FROM load_{blob_table} s
+    JOIN {blob_table} b ON b.content_hash = s.content_hash
+    WHERE {loading_table}.{column} = s.id AND b.id <> s.id
+    """)
+
+def replace_links(cur, blob_table, link_table, child_column):
+    """Point the links of the loaded collections to their blobs, dropping links to previous versions"""
+    remap_collection_ids(cur, f"load_{link_table}", 'product_collection_id')
+    # Blobs that already existed keep their stored ID
+    remap_blob_ids(cur, f"load_{link_table}", child_column, blob_table)
+    apply_collection_links(cur, link_table, child_column, f"load_{link_table}")
+
+def load_staging_files(cur, stage_dir, manifest):
+    """COPY every staging file and apply the tables parents first"""
+    entries = {entry['table']: entry for entry in manifest['tables']}
+    with stage('copy_files'):
+        for entry in manifest['tables']:
+            copy_staging_file(cur, stage_dir, entry)
+
+    with stage('collections'):
+        load_collections(cur, entries['product_collection'])
+
+    with stage('translations'):
+        remap_collection_ids(cur, 'load_product_collection_translations', 'product_id')
+        upsert_loaded_rows(cur, 'product_collection_translations', entries['product_collection_translations']['columns'],
+                           ['product_id', 'lang_id', 'field_name'])
+
+    with stage('categories'):
+        remap_collection_ids(cur, 'load_product_collection_category', 'product_collection_id')
+        cur.execute("""
+        SELECT DISTINCT product_collection_id, category_name FROM load_product_collection_category
+        """)
+        link_categories(cur, cur.fetchall(), load_category_ids(cur))
+
+    with stage('collection_extras'):
+        for blob_table, link_table, child_column in BLOB_LINKS:
+            load_blobs(cur, blob_table, entries[blob_table])
+            replace_links(cur, blob_table, link_table, child_column)
+
+    with stage('sku_attributes'):
+        load_blobs(cur, 'product_attributes_raw_collection', entries['product_attributes_raw_collection'])
+
+    with stage('variations'):
+        remap_blob_ids(cur, 'load_product', 'product_attributes_raw_collection_id', 'product_attributes_raw_collection')
+        # Products without a Sku Attribute reference their collection, like the row mode
+        remap_collection_ids(cur, 'load_product', 'product_attributes_raw_collection_id')
+        upsert_loaded_rows(cur, 'product', entries['product']['columns'], ['product_collection_sku'], keep_existing_on_null=True)
+
+    # Products take the inherited fields of their stored collection, like the bulk mode
+    with stage('inheritance'):
+        inherit_staged_collection_fields(cur, 'load_product')
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the staging files written by run_etl.py --stage-dir')
+    parser.add_argument('--stage-dir', type=str, required=True, help='Directory with the staging files and their manifest.json')
+    parser.add_argument('--dry-run', action='store_true', help='Load and roll back instead of committing')
+    args = parser.parse_args()
+
+    reset_run_stats()
+    manifest = load_manifest(args.stage_dir)
+    RUN_STATS['master_codes'] = manifest['master_codes']
+    RUN_STATS['rows'] = manifest['rows']
+    print(f"Loading staging files of {manifest['csv_path']} ({manifest['master_codes']} master codes, created {manifest['created_on']})")
+
+    conn = connect_db(DB_CONFIG)
+    cur = conn.cursor()
+    status = 'failed'
+    try:
+        ensure_upsert_indexes(cur)
+        load_staging_files(cur, args.stage_dir, manifest)
+        if args.dry_run:
+            conn.rollback()
+            status = 'dry_run'
+            print("Dry run completed successfully! No changes were committed.")
+        else:
+            with stage('commit'):
+                conn.commit()
+            status = 'success'
+            print("Staging files loaded successfully! All changes committed.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error while loading staging files: {e}")
+    finally:
+        cur.close()
+        settings = {'csv_path': manifest['csv_path'], 'csv_hash': manifest['csv_hash'],
+                    'stage_dir': args.stage_dir, 'dry_run': args.dry_run, 'loader': True}
+        summary = build_run_summary(status, settings)
+        print_run_summary(summary)
+        if not args.dry_run:
+            try:
+                save_run_summary(conn, summary)
+            except Exception as e:
+                conn.rollback()
+                print(f"Could not store the run summary in etl_run: {e}")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
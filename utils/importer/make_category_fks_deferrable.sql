@@ -0,0 +1,21 @@
+-- Make the circular foreign keys between category and category_translations DEFERRABLE
+-- The ETL then creates new categories in one batch without the placeholder translation
+-- (SET CONSTRAINTS ALL DEFERRED). Constraints stay INITIALLY IMMEDIATE for everything else.
+
+DO $$
+DECLARE
+    fk record;
+BEGIN
+    FOR fk IN
+        SELECT conname, conrelid::regclass AS table_name
+        FROM pg_constraint
+        WHERE contype = 'f'
+          AND NOT condeferrable
+          AND conrelid IN ('category'::regclass, 'category_translations'::regclass)
+          AND confrelid IN ('category'::regclass, 'category_translations'::regclass)
+    LOOP
+        EXECUTE format('ALTER TABLE %s ALTER CONSTRAINT %I DEFERRABLE INITIALLY IMMEDIATE',
+                       fk.table_name, fk.conname);
+        RAISE NOTICE 'Constraint % on % is now deferrable', fk.conname, fk.table_name;
+    END LOOP;
+END $$;
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Typed Parquet cache of the raw supplier CSV.
+
+The CSV is parsed once per file version into a column-pruned Parquet file
+where every column is stored as text, so dtypes never depend on pandas'
+guessing (no more float SKUs with a .0 suffix). The cache file name is
+derived from the CSV content hash, its mtime and the selected columns;
+any change to the file produces a new cache and the old ones are removed.
+The content hash is computed once per file version and process, and
+handed to worker processes by the parent.
+
+Single records can also be read straight from the CSV by byte offset
+(index_record_offsets / read_record_fields), so heavy columns do not
+have to be held in a DataFrame.
+
+pyarrow is optional: without it every call falls back to reading the CSV.
+"""
+
+import io
+import os
+import csv
+import hashlib
+from array import array
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Cache directory, defaults to a .raw_cache folder next to the CSV
+RAW_CACHE_DIR = os.getenv('RAW_CACHE_DIR')
+# Set RAW_CACHE=false to always read the CSV directly
+RAW_CACHE_ENABLED = os.getenv('RAW_CACHE', 'true').lower() == 'true'
+
+CSV_OPTIONS = {'sep': ';', 'encoding': 'utf-8', 'dtype': str}
+# Rows per chunk while converting the CSV, bounds the memory of the conversion itself
+BUILD_CHUNK_SIZE = 20000
+
+def cache_available():
+    """True if the Parquet cache can be used"""
+    return RAW_CACHE_ENABLED and pq is not None
+
+# Content hashes computed in this process (or handed over by the parent), keyed by (path, mtime, size)
+FILE_HASH_CACHE = {}
+
+def file_version(path):
+    """Key of the current version of a file: (path, mtime, size)"""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def file_content_hash(path):
+    """SHA-256 of the file content, read once per file version and process"""
+    key = file_version(path)
+    if key not in FILE_HASH_CACHE:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        FILE_HASH_CACHE[key] = digest.hexdigest()
+    return FILE_HASH_CACHE[key]
+
+def raw_cache_path(csv_path, columns=None):
+    """Cache file for this CSV version and column selection"""
+    cache_dir = RAW_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(csv_path)), '.raw_cache')
+    stem = os.path.splitext(os.path.basename(csv_path))[0].replace(' ', '_')
+
+    columns_key = hashlib.sha256('\n'.join(columns or []).encode('utf-8')).hexdigest()[:8]
+    version_key = hashlib.sha256()
+    version_key.update(file_content_hash(csv_path).encode('utf-8'))
+    version_key.update(str(os.stat(csv_path).st_mtime_ns).encode('utf-8'))
+    return os.path.join(cache_dir, f"{stem}-{columns_key}-{version_key.hexdigest()[:16]}.parquet")
+
+def build_raw_cache(csv_path, cache_path, columns=None):
+    """Convert the CSV into a Parquet file with an all-text schema, chunk by chunk"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    usecols = (lambda col: col in columns) if columns else None
+    tmp_path = cache_path + '.tmp'
+
+    writer = None
+    try:
+        for chunk in pd.read_csv(csv_path, usecols=usecols, chunksize=BUILD_CHUNK_SIZE, **CSV_OPTIONS):
+            if writer is None:
+                schema = pa.schema([(col, pa.string()) for col in chunk.columns])
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp_path, cache_path)
+
+    # Older versions of the same CSV and column selection are no longer needed
+    prefix = os.path.basename(cache_path).rsplit('-', 1)[0] + '-'
+    cache_dir = os.path.dirname(cache_path)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.parquet') and name != os.path.basename(cache_path):
+            os.remove(os.path.join(cache_dir, name))
+
+def ensure_raw_cache(csv_path, columns=None):
+    """Return the cache file for the CSV, building it on first use"""
+    cache_path = raw_cache_path(csv_path, columns)
+    if not os.path.exists(cache_path):
+        print(f"Building Parquet cache {cache_path}...")
+        build_raw_cache(csv_path, cache_path, columns)
+    return cache_path
+
+def load_raw_frame(csv_path, columns=None):
+    """Load the raw CSV (only columns, if given) as an all-text DataFrame
+
+    Reads the Parquet cache memory-mapped when pyarrow is installed,
+    otherwise parses the CSV.
+    """
+    if cache_available():
+        try:
+            cache_path = ensure_raw_cache(csv_path, columns)
+            return pq.read_table(cache_path, memory_map=True).to_pandas()
+        except Exception as e:
+            print(f"[!] Parquet cache unavailable, reading CSV instead: {e}")
+
+    usecols = (lambda col: col in columns) if columns else None
+    return pd.read_csv(csv_path, usecols=usecols, **CSV_OPTIONS)
+
+def iter_raw_chunks(csv_path, chunk_size, columns=None):
+    """Yield the raw CSV as all-text DataFrames of chunk_size rows"""
+    if cache_available():
+        try:
+            cache_path = ensure_raw_cache(csv_path, columns)
+        except Exception as e:
+            print(f"[!] Parquet cache unavailable, reading CSV instead: {e}")
+            cache_path = None
+
+        if cache_path:
+            parquet_file = pq.ParquetFile(cache_path, memory_map=True)
+            start = 0
+            for batch in parquet_file.iter_batches(batch_size=chunk_size):
+                chunk = batch.to_pandas()
+                # Row labels continue across chunks, like pd.read_csv(chunksize=...)
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+                start += len(chunk)
+                yield chunk
+            return
+
+    usecols = (lambda col: col in columns) if columns else None
+    yield from pd.read_csv(csv_path, usecols=usecols, chunksize=chunk_size, **CSV_OPTIONS)
+
+def read_raw_columns(csv_path):
+    """Read only the header of the raw CSV"""
+    return list(pd.read_csv(csv_path, nrows=0, **CSV_OPTIONS).columns)
+
+def read_record_bytes(f):
+    """Read one CSV record from a binary file, following quoted line breaks"""
+    parts = []
+    quotes = 0
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        parts.append(line)
+        # Escaped quotes come in pairs, an odd count means a quoted field is still open
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            break
+    return b''.join(parts)
+
+# Record offset indexes built in this process, keyed by (path, mtime, size)
+RECORD_OFFSETS_CACHE = {}
+
+def index_record_offsets(csv_path):
+    """Byte offset of every data record, in the row order of pd.read_csv (blank lines skipped)
+
+    The index is built once per file version and process.
+    """
+    stat = os.stat(csv_path)
+    key = (os.path.abspath(csv_path), stat.st_mtime_ns, stat.st_size)
+    if key not in RECORD_OFFSETS_CACHE:
+        RECORD_OFFSETS_CACHE.clear()
+        RECORD_OFFSETS_CACHE[key] = scan_record_offsets(csv_path)
+    return RECORD_OFFSETS_CACHE[key]
+
+def scan_record_offsets(csv_path):
+    """Scan the CSV once and collect the byte offset of every data record"""
+    offsets = array('q')
+    with open(csv_path, 'rb') as f:
+        read_record_bytes(f)  # header
+        while True:
+            offset = f.tell()
+            record = read_record_bytes(f)
+            if not record:
+                break
+            if record.strip(b'\r\n'):
+                offsets.append(offset)
+    return offsets
+
+def parse_record(record):
+    """Split raw record bytes into field strings"""
+    return next(csv.reader(io.StringIO(record.decode('utf-8-sig')), delimiter=CSV_OPTIONS['sep']))
+
+def open_record_reader(csv_path):
+    """Open the CSV for random access to single records"""
+    f = open(csv_path, 'rb')
+    header = parse_record(read_record_bytes(f))
+    return {
+        'file': f,
+        'positions': {col: position for position, col in enumerate(header)},
+        'offsets': index_record_offsets(csv_path),
+    }
+
+def read_record_fields(reader, record_number, columns):
+    """Return {column: value} of one data record, empty fields as None"""
+    f = reader['file']
+    f.seek(reader['offsets'][record_number])
+    fields = parse_record(read_record_bytes(f))
+    values = {}
+    for col in columns:
+        position = reader['positions'][col]
+        value = fields[position] if position < len(fields) else ''
+        values[col] = value if value != '' else None
+    return values
+
+def close_record_reader(reader):
+    """Close the file of a record reader"""
+    reader['file'].close()
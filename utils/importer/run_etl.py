@@ -2,7 +2,6 @@
 import os
 import sys
 import argparse
-from ETL import main as run_etl
 
 # === UTF-8 консоль для Windows ===
 if os.name == "nt":
@@ -15,6 +14,20 @@ def main():
     parser.add_argument('--csv', type=str, help='Path to the CSV file (default: RAW_WXW/_Raw Data.csv)')
     parser.add_argument('--mapping', type=str, help='Path to the mapping CSV file (default: utils/importer/map.csv)')
     parser.add_argument('--dry-run', action='store_true', help='Perform a dry run without committing changes to the database')
+    parser.add_argument('--bulk', action='store_true', help='Bulk load: COPY into staging tables and upsert each table in one statement')
+    parser.add_argument('--chunk-size', type=int, help='Stream the CSV in chunks of N rows instead of loading it at once')
+    parser.add_argument('--workers', type=int, help='Import master code partitions in N parallel processes')
+    parser.add_argument('--incremental', action='store_true', help='Skip master codes whose content did not change since the last incremental run')
+    parser.add_argument('--commit-every', type=int, help='Commit every N master codes and record a checkpoint')
+    parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint of the same CSV file after a failure')
+    parser.add_argument('--categorical-max-ratio', type=float, help='Hold raw columns with at most this share of distinct values as categoricals, 0 disables (default: 0.5)')
+    parser.add_argument('--write-batch-size', type=int, help='Statements per page of the batched row writer (default: 500)')
+    parser.add_argument('--lazy-heavy-columns', action='store_true', help='Read Web Page Details / Custom Attributes by byte offset for template rows only')
+    parser.add_argument('--plan', action='store_true', help='Only compute the insert/update/skip plan from one read-only snapshot, write nothing')
+    parser.add_argument('--stage-dir', type=str, help='Write COPY-ready staging files to this directory instead of the database (load them with load_staging_files.py)')
+    parser.add_argument('--plan-report', type=str, help='Path of the plan diff report (default: etl_plan.json)')
+    parser.add_argument('--summary-json', type=str, help='Also write the run summary (stage timings, SQL counts) to this JSON file')
+    parser.add_argument('--no-cache', action='store_true', help='Read the CSV directly instead of the Parquet cache')
     
     args = parser.parse_args()
     
@@ -25,7 +38,38 @@ def main():
         os.environ['MAPPING_CSV_PATH'] = args.mapping
     if args.dry_run:
         os.environ['DRY_RUN'] = 'true'
+    if args.bulk:
+        os.environ['BULK_LOAD'] = 'true'
+    if args.chunk_size:
+        os.environ['CHUNK_SIZE'] = str(args.chunk_size)
+    if args.workers:
+        os.environ['ETL_WORKERS'] = str(args.workers)
+    if args.incremental:
+        os.environ['INCREMENTAL'] = 'true'
+    if args.commit_every:
+        os.environ['COMMIT_EVERY'] = str(args.commit_every)
+    if args.resume:
+        os.environ['RESUME'] = 'true'
+    if args.categorical_max_ratio is not None:
+        os.environ['CATEGORICAL_MAX_RATIO'] = str(args.categorical_max_ratio)
+    if args.write_batch_size:
+        os.environ['WRITE_BATCH_SIZE'] = str(args.write_batch_size)
+    if args.lazy_heavy_columns:
+        os.environ['LAZY_HEAVY_COLUMNS'] = 'true'
+    if args.plan:
+        os.environ['PLAN_ONLY'] = 'true'
+    if args.stage_dir:
+        os.environ['STAGE_DIR'] = args.stage_dir
+    if args.plan_report:
+        os.environ['PLAN_REPORT_PATH'] = args.plan_report
+    if args.summary_json:
+        os.environ['ETL_SUMMARY_PATH'] = args.summary_json
+    if args.no_cache:
+        os.environ['RAW_CACHE'] = 'false'
     
+    # Import after the environment is set: ETL reads its settings at import time
+    from ETL import main as run_etl
+
     # Run the ETL process
     run_etl()
 
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import json
+import tempfile
 import pandas as pd
 from dotenv import load_dotenv
 
@@ -17,7 +19,18 @@ load_dotenv()
 os.environ['DRY_RUN'] = 'true'
 
 # Import ETL functions after setting environment variables
-from ETL import parse_array, parse_attributes, clean_string
+from ETL import (parse_array, parse_attributes, clean_string, format_copy_value, iter_master_groups_chunked,
+                 master_code_partition, group_fingerprints, content_hash, compile_mapping, normalize_frame,
+                 load_mapping, read_raw_columns, plan_master_group, load_plan_snapshot, skip_committed_groups, counted_groups,
+                 new_writer, queue_statement, flush_writer, staging_columns, open_staging_files,
+                 stage_master_group, close_staging_files, write_staging_manifest, compact_frame, iter_master_groups,
+                 resolve_inherited_fields, inherit_collection_fields, inherit_staged_collection_fields, sku_attribute_id, upsert_product, product_write_columns, bulk_upsert,
+                 link_collection_blobs)
+import raw_data_cache
+from raw_data_cache import load_raw_frame, iter_raw_chunks, raw_cache_path, open_record_reader, read_record_fields, close_record_reader
+from generate_raw_data import generate_raw_data, write_mapping
+from load_staging_files import load_collections
+from etl_metrics import statement_table, record_statement, stage, reset_run_stats, merge_run_stats, RUN_STATS
 
 def test_parse_array():
     """Test the parse_array function"""
@@ -68,12 +81,567 @@ def test_clean_string():
     
     print("✅ clean_string tests passed")
 
+def test_format_copy_value():
+    """Test the format_copy_value function used by the bulk COPY"""
+    test_cases = [
+        (None, '\\N'),
+        ('plain', 'plain'),
+        ('tab\there', 'tab\\there'),
+        ('line\nbreak', 'line\\nbreak'),
+        ('back\\slash', 'back\\\\slash'),
+        (12.5, '12.5'),
+        (True, 't'),
+        (['https://a.com/1.jpg', 'say "hi"'], '{"https://a.com/1.jpg","say \\\\"hi\\\\""}')
+    ]
+    
+    for input_val, expected in test_cases:
+        result = format_copy_value(input_val)
+        assert result == expected, f"Expected '{expected}', got '{result}' for input: {input_val}"
+    
+    print("✅ format_copy_value tests passed")
+
+def test_iter_master_groups_chunked():
+    """Test that chunked reading keeps every master code's rows together"""
+    rows = ['Master Code;SKU Code', 'A;a0', 'A;a1', 'A;a2', 'B;b0', 'B;b1', 'C;c0', ';orphan', 'C;c1']
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+        f.write('\n'.join(rows) + '\n')
+        csv_path = f.name
+    
+    cache_dir = tempfile.TemporaryDirectory()
+    raw_data_cache.RAW_CACHE_DIR = cache_dir.name
+    try:
+        for chunk_size in (1, 2, 3, 100):
+            field_map = compile_mapping({}, ['Master Code', 'SKU Code'])
+            groups = [(code, list(group['SKU Code'])) for code, group in iter_master_groups_chunked(csv_path, chunk_size, field_map)]
+            expected = [('A', ['a0', 'a1', 'a2']), ('B', ['b0', 'b1']), ('C', ['c0', 'c1'])]
+            assert groups == expected, f"Expected {expected}, got {groups} for chunk size {chunk_size}"
+    finally:
+        raw_data_cache.RAW_CACHE_DIR = None
+        cache_dir.cleanup()
+        os.remove(csv_path)
+    
+    print("✅ iter_master_groups_chunked tests passed")
+
+def test_raw_data_cache():
+    """Test that the raw data cache keeps every column as text and follows file changes"""
+    rows = ['Master Code;SKU Code;Stock;Notes', '10001;00123;5;', '10001;00124;0;x', '10002;1.50;7;y']
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+        f.write('\n'.join(rows) + '\n')
+        csv_path = f.name
+    
+    cache_dir = tempfile.TemporaryDirectory()
+    raw_data_cache.RAW_CACHE_DIR = cache_dir.name
+    try:
+        columns = ['Master Code', 'SKU Code', 'Stock']
+        for _ in range(2):  # Second read comes from the cache
+            df = load_raw_frame(csv_path, columns)
+            assert list(df.columns) == columns, f"Expected pruned columns {columns}, got {list(df.columns)}"
+            assert list(df['SKU Code']) == ['00123', '00124', '1.50'], f"SKUs changed type: {list(df['SKU Code'])}"
+            assert list(df['Master Code']) == ['10001', '10001', '10002'], "Master codes must stay text"
+        
+        chunks = [list(chunk['SKU Code']) for chunk in iter_raw_chunks(csv_path, 2, columns)]
+        assert chunks == [['00123', '00124'], ['1.50']], f"Unexpected chunks {chunks}"
+        
+        if raw_data_cache.cache_available():
+            cache_path = raw_cache_path(csv_path, columns)
+            assert os.path.exists(cache_path), "Cache file was not written"
+            # The CSV is hashed once per version: a known hash is used as is
+            raw_data_cache.FILE_HASH_CACHE[raw_data_cache.file_version(csv_path)] = 'handed-over-hash'
+            assert raw_cache_path(csv_path, columns) != cache_path, "Known hash of the file was not reused"
+            raw_data_cache.FILE_HASH_CACHE.clear()
+            assert raw_cache_path(csv_path, columns) == cache_path, "Hash changed without a file change"
+            with open(csv_path, 'a', encoding='utf-8') as f:
+                f.write('10003;00125;1;z\n')
+            assert raw_cache_path(csv_path, columns) != cache_path, "Changed file must get a new cache"
+            assert len(load_raw_frame(csv_path, columns)) == 4, "Stale cache was read"
+            assert not os.path.exists(cache_path), "Old cache version was not removed"
+    finally:
+        raw_data_cache.RAW_CACHE_DIR = None
+        cache_dir.cleanup()
+        os.remove(csv_path)
+    
+    print("✅ raw_data_cache tests passed")
+
+def test_read_record_fields():
+    """Test byte-offset access to single records against pandas' row numbers"""
+    rows = ['Master Code;SKU Code;Web Page Details', 'A;;"<p>line 1', 'line 2 ""quoted""; x</p>"', 'A;a1;', '', 'B;;"材质:实木"']
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+        f.write('\n'.join(rows) + '\n')
+        csv_path = f.name
+    
+    try:
+        df = pd.read_csv(csv_path, sep=';', encoding='utf-8', dtype=str)
+        reader = open_record_reader(csv_path)
+        try:
+            assert len(reader['offsets']) == len(df), f"Expected {len(df)} records, indexed {len(reader['offsets'])}"
+            for record_number in range(len(df)):
+                values = read_record_fields(reader, record_number, ['Master Code', 'Web Page Details'])
+                expected = df.iloc[record_number]['Web Page Details']
+                expected = None if pd.isna(expected) else expected
+                assert values['Web Page Details'] == expected, f"Record {record_number}: {values} != {expected}"
+                assert values['Master Code'] == df.iloc[record_number]['Master Code'], f"Record {record_number} is misaligned"
+        finally:
+            close_record_reader(reader)
+    finally:
+        os.remove(csv_path)
+    
+    print("✅ read_record_fields tests passed")
+
+def test_compact_frame():
+    """Test that categorical columns give the same master code groups as plain text"""
+    raw_df = pd.DataFrame({
+        'Master Code': ['B', 'B', 'B', 'A', 'A', None, 'C'],
+        'SKU Code': [None, 'B-1', 'B-2', None, 'A-1', 'X-1', None],
+        'Category Name': ['沙发', None, None, '沙发', None, None, '床'],
+        'Inventory': [None, '3', '3', None, '3', '1', None],
+    }, dtype=object)
+    plain_groups = [(master_code, rows.copy()) for master_code, rows in iter_master_groups(raw_df)]
+    
+    compact_df = compact_frame(raw_df.copy(), max_ratio=0.5)
+    assert isinstance(compact_df['Category Name'].dtype, pd.CategoricalDtype), "Repetitive column not categorical"
+    assert compact_df['SKU Code'].dtype == object, "Unique column must stay plain text"
+    
+    compact_groups = list(iter_master_groups(compact_df))
+    assert [key for key, _ in compact_groups] == ['B', 'A', 'C'], f"Unexpected group order {[key for key, _ in compact_groups]}"
+    for (_, expected), (_, rows) in zip(plain_groups, compact_groups):
+        assert list(rows.index) == list(expected.index), "Row labels changed"
+        assert rows.values.tolist() == expected.values.tolist(), f"Values changed: {rows.values.tolist()}"
+        assert rows.iloc[1:]['Category Name'].tolist() == [None] * (len(rows) - 1), "Missing values must be None"
+    
+    print("✅ compact_frame tests passed")
+
+def test_master_code_partition():
+    """Test that master code partitions are stable and in range"""
+    codes = ['66862c', '10001', 10001, 'A-17', '']
+    for workers in (1, 2, 4, 16):
+        for code in codes:
+            partition = master_code_partition(code, workers)
+            assert 0 <= partition < workers, f"Partition {partition} out of range for {workers} workers"
+            assert partition == master_code_partition(code, workers), f"Unstable partition for {code}"
+        # Numeric and text master codes must land in the same partition
+        assert master_code_partition('10001', workers) == master_code_partition(10001, workers)
+    
+    print("✅ master_code_partition tests passed")
+
+def test_normalize_frame():
+    """Test the vectorized normalization applied before the row loop"""
+    mapping = {
+        'Name': {'table': 'product_collection_translations', 'column': ''},
+        'Price': {'table': 'product', 'column': 'product_selling_price'},
+        'Stock': {'table': 'product', 'column': 'inventory'}
+    }
+    raw_df = pd.DataFrame({
+        'Master Code': [' M1 ', 'M1'],
+        'SKU Code': ['00123', 'S2'],
+        'Name': ['  Chair ', None],
+        'Price': ['10,5', 12.0],
+        'Stock': [3, 4],
+        'Web Page Details': ['  <p>kept as is</p> ', float('nan')]
+    })
+    field_map = compile_mapping(mapping, list(raw_df.columns))
+    assert field_map['product'] == [('Price', 'product_selling_price'), ('Stock', 'inventory')], f"Unexpected product columns: {field_map['product']}"
+    assert field_map['product_collection_translations'] == ['Name'], f"Unexpected translation columns: {field_map['product_collection_translations']}"
+    
+    result = normalize_frame(raw_df, field_map)
+    assert result.loc[0, 'Master Code'] == 'M1', "Master Code was not stripped"
+    assert result.loc[0, 'SKU Code'] == '00123', "SKU Code lost its leading zeros"
+    assert result.loc[0, 'Name'] == 'Chair', "Mapped text was not stripped"
+    assert result.loc[1, 'Name'] is None, "Missing value did not become None"
+    assert result.loc[0, 'Price'] == '10.5', "Decimal comma was not converted"
+    assert type(result.loc[0, 'Stock']) is int, "numpy integer was not converted to int"
+    assert result.loc[0, 'Web Page Details'] == '  <p>kept as is</p> ', "Raw HTML must not be stripped"
+    assert result.loc[1, 'Web Page Details'] is None, "NaN did not become None"
+    
+    print("✅ normalize_frame tests passed")
+
+def test_group_fingerprints():
+    """Test that fingerprints only change when mapped content changes"""
+    mapping = {'Price': {'table': 'product', 'column': 'product_selling_price'}}
+    rows = pd.DataFrame({
+        'Master Code': ['M1', 'M1', 'M1'],
+        'SKU Code': [None, 'S1', 'S2'],
+        'Price': [None, '10,5', '12'],
+        'Unmapped': ['x', 'y', 'z']
+    })
+    field_map = compile_mapping(mapping, list(rows.columns))
+    base = group_fingerprints('M1', normalize_frame(rows, field_map), field_map)
+    assert set(base) == {('collection', 'M1'), ('product', 'S1'), ('product', 'S2')}, f"Unexpected keys: {set(base)}"
+    
+    # Unmapped columns and surrounding whitespace do not matter
+    same = rows.copy()
+    same['Unmapped'] = ['a', 'b', 'c']
+    same.loc[1, 'Price'] = ' 10,5 '
+    assert group_fingerprints('M1', normalize_frame(same, field_map), field_map) == base, "Fingerprint changed without a content change"
+    
+    # A mapped value change only touches that SKU
+    changed = rows.copy()
+    changed.loc[2, 'Price'] = '13'
+    result = group_fingerprints('M1', normalize_frame(changed, field_map), field_map)
+    assert result[('product', 'S2')] != base[('product', 'S2')], "Changed SKU kept its fingerprint"
+    assert result[('product', 'S1')] == base[('product', 'S1')], "Unchanged SKU got a new fingerprint"
+    
+    print("✅ group_fingerprints tests passed")
+
+def test_content_hash():
+    """Test the content_hash function used to deduplicate blobs"""
+    assert content_hash('abc') == content_hash('abc'), "Hash is not stable"
+    assert content_hash('abc') != content_hash('abd'), "Different content got the same hash"
+    assert content_hash(['https://a.com/1.jpg', 'https://a.com/2.jpg']) == content_hash('https://a.com/1.jpg\nhttps://a.com/2.jpg'), "List hash does not match the SQL backfill"
+    assert len(content_hash('')) == 64, "Expected a SHA-256 hex digest"
+    
+    print("✅ content_hash tests passed")
+
+def test_statement_table():
+    """Test that SQL statements are attributed to the table they work on"""
+    test_cases = [
+        ("INSERT INTO product_collection (id, master_code) VALUES ('1', 'A')", 'product_collection'),
+        (b"UPDATE product SET images = pc.images FROM product_collection pc", 'product'),
+        ("SELECT id FROM lang WHERE lang_code = 'en'", 'lang'),
+        ("DELETE FROM product_collection_category WHERE product_collection_id = %s", 'product_collection_category'),
+        ("DROP TABLE IF EXISTS stage_product", 'stage_product'),
+        ("CREATE TEMP TABLE stage_product ON COMMIT DROP AS SELECT id FROM product WITH NO DATA", 'stage_product'),
+        ("WITH ins AS (INSERT INTO details_html (id) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id) SELECT id FROM ins", 'details_html'),
+        ("SET CONSTRAINTS ALL DEFERRED", 'other'),
+        ("EXECUTE etl_product_collection_translations_3 ('1', 'DELETE FROM lang')", 'product_collection_translations'),
+        (b"EXECUTE etl_product_12 ('1');EXECUTE etl_product_12 ('2')", 'product'),
+    ]
+    
+    for query, expected in test_cases:
+        result = statement_table(query)
+        assert result == expected, f"Expected {expected}, got {result} for: {query}"
+    
+    print("✅ statement_table tests passed")
+
+def test_run_stats():
+    """Test stage timers and merging of worker counters"""
+    reset_run_stats()
+    with stage('read_csv'):
+        sum(range(10000))
+    with stage('read_csv'):
+        pass
+    assert RUN_STATS['stages']['read_csv']['calls'] == 2, "Expected two timed calls"
+    assert RUN_STATS['stages']['read_csv']['wall_seconds'] >= 0, "Negative wall time"
+    
+    worker = {'master_codes': 3, 'rows': 10,
+              'stages': {'read_csv': {'calls': 1, 'wall_seconds': 1.0, 'cpu_seconds': 0.5}},
+              'tables': {'product': {'statements': 4, 'rows': 7}}}
+    merge_run_stats(worker)
+    merge_run_stats(worker)
+    assert RUN_STATS['master_codes'] == 6 and RUN_STATS['rows'] == 20, "Worker totals not merged"
+    assert RUN_STATS['stages']['read_csv']['calls'] == 4, "Worker stages not merged"
+    assert RUN_STATS['tables']['product'] == {'statements': 8, 'rows': 14}, "Worker table counts not merged"
+    
+    # A page of batched EXECUTEs reports only the rowcount of its last statement
+    class PageCursor:
+        rowcount = 1
+    record_statement(b"EXECUTE etl_lang_0 ('1');EXECUTE etl_lang_0 ('2')", PageCursor())
+    record_statement("UPDATE lang SET lang_code = 'en'", PageCursor())
+    assert RUN_STATS['tables']['lang'] == {'statements': 2, 'rows': 1}, "Batched pages must leave their rows to the writer"
+    
+    print("✅ run stats tests passed")
+
+def test_batched_writer():
+    """Test that queued statements are prepared once and flushed parents first"""
+    class RecordingCursor:
+        def __init__(self):
+            self.statements = []
+        def execute(self, query, params=None):
+            self.statements.append(query.decode('utf-8') if isinstance(query, bytes) else query)
+        def mogrify(self, query, params):
+            return (query % tuple(repr(param) for param in params)).encode('utf-8')
+    
+    reset_run_stats()
+    cur = RecordingCursor()
+    writer = new_writer(cur, batch_size=100)
+    queue_statement(writer, 'product', 'product', "INSERT INTO product (id, sku) VALUES (%s, %s)", ('p1', 'A-1'))
+    queue_statement(writer, 'product_collection', 'product_collection', "INSERT INTO product_collection (id) VALUES (%s)", ('c1',))
+    queue_statement(writer, 'product', 'product', "INSERT INTO product (id, sku) VALUES (%s, %s)", ('p2', 'A-2'))
+    
+    assert cur.statements[0] == "DEALLOCATE ALL", "Previous prepared statements not dropped"
+    assert cur.statements[1] == "PREPARE etl_product_0 AS INSERT INTO product (id, sku) VALUES ($1, $2)", cur.statements[1]
+    assert len(cur.statements) == 3, "Statements must only be prepared until the flush"
+    
+    flush_writer(writer)
+    executed = cur.statements[3:]
+    assert executed[0] == "EXECUTE etl_product_collection_1 ('c1')", "Collections must be written before products"
+    assert executed[1] == "EXECUTE etl_product_0 ('p1', 'A-1');EXECUTE etl_product_0 ('p2', 'A-2')", "Products must share one page"
+    assert writer['pending'] == 0, "Queue not emptied"
+    assert RUN_STATS['tables']['product']['rows'] == 2, "Rows of a page must be counted per queued statement"
+    
+    # Sku Attributes: one row per distinct string, stored ones are reused
+    cache = {'writer': writer, 'sku_attribute_ids': {content_hash('颜色:白色'): 'stored-id'}}
+    assert sku_attribute_id('颜色:白色', cache) == 'stored-id', "Stored attribute not reused"
+    new_id = sku_attribute_id('颜色:黑色', cache)
+    assert sku_attribute_id('颜色:黑色', cache) == new_id, "Attribute string inserted twice"
+    assert writer['pending'] == 1, f"Expected one queued insert, got {writer['pending']}"
+    
+    # Products with different empty fields share one INSERT and one UPDATE statement
+    cur = RecordingCursor()
+    writer = new_writer(cur, batch_size=100)
+    cache = {'writer': writer, 'product_ids': {'A-9': 'stored-id'}}
+    columns = product_write_columns({'product': [('Selling Price', 'product_selling_price'), ('Weight', 'weight')]})
+    upsert_product(cur, {'id': 'p1', 'product_collection_sku': 'A-1', 'weight': '2'}, cache, columns)
+    upsert_product(cur, {'id': 'p2', 'product_collection_sku': 'A-2', 'product_selling_price': '9.50'}, cache, columns)
+    upsert_product(cur, {'id': 'p3', 'product_collection_sku': 'A-9', 'weight': '3'}, cache, columns)
+    upsert_product(cur, {'id': 'p4', 'product_collection_sku': 'A-9', 'product_selling_price': '1.00'}, cache, columns)
+    prepared = [statement for statement in cur.statements if statement.startswith('PREPARE')]
+    assert len(prepared) == 2, f"Expected one INSERT and one UPDATE, got {prepared}"
+    assert "weight = COALESCE($" in prepared[1], "Empty values must keep the stored data"
+    flush_writer(writer)
+    assert len(cur.statements) == len(prepared) + 3, "Each statement must be sent in a single page"
+    assert "None" in cur.statements[-2].split(';')[0], "Empty fields must be sent as NULL"
+    
+    print("✅ batched writer tests passed")
+
+def test_bulk_upsert():
+    """Test that a column only some rows carry does not wipe the stored values of the others"""
+    class RecordingCursor:
+        rowcount = 2
+        def __init__(self):
+            self.statements = []
+        def execute(self, query, params=None):
+            self.statements.append(query)
+        def copy_expert(self, query, buffer):
+            self.copied = buffer.read()
+        def fetchall(self):
+            return [('id-1', 'M1'), ('id-2', 'M2')]
+    
+    cur = RecordingCursor()
+    collections = [{'master_code': 'M1', 'product_collection_name': 'Chair', 'video': 'https://v/1.mp4'},
+                   {'master_code': 'M2', 'product_collection_name': 'Table'}]
+    returned = bulk_upsert(cur, 'product_collection', collections, ['master_code'], returning=['id', 'master_code'],
+                           keep_existing_columns=['video'])
+    upsert = cur.statements[-1]
+    assert "video = COALESCE(EXCLUDED.video, product_collection.video)" in upsert, "Missing video overwrites the stored one"
+    assert "product_collection_name = EXCLUDED.product_collection_name" in upsert, "Other columns must still be replaced"
+    assert cur.copied.split('\n')[1] == "M2\tTable\t\\N", "Missing column not staged as NULL"
+    assert returned == [('id-1', 'M1'), ('id-2', 'M2')], "RETURNING rows not handed back"
+    
+    
+    # Blob links of a batch cost the same statements for 3 or 300 collections
+    statement_counts = []
+    for collections_count in [3, 300]:
+        cur = RecordingCursor()
+        links = [(f"collection-{i}", f"html-{i % 2}") for i in range(collections_count)]
+        link_collection_blobs(cur, 'product_collection_details_html', 'details_html_id', links)
+        assert len(cur.copied.splitlines()) == collections_count, "Every link must be staged"
+        statement_counts.append(len(cur.statements))
+    assert statement_counts[0] == statement_counts[1], f"Link statements grow with the batch: {statement_counts}"
+    assert "l.details_html_id <> s.details_html_id" in cur.statements[-2], "Links to previous versions must be dropped"
+    
+    print("✅ bulk upsert tests passed")
+
+def test_inherited_fields():
+    """Test that products inherit from the collection record, querying only unmapped stored columns"""
+    class StoredCollectionCursor:
+        def __init__(self, row):
+            self.row = row
+            self.queries = []
+        def execute(self, query, params=None):
+            self.queries.append(query)
+        def fetchone(self):
+            return self.row
+    
+    collection_data = {'id': 'new-id', 'master_code': 'A', 'product_collection_url': 'https://a.com',
+                       'product_collection_image': None}
+    cur = StoredCollectionCursor(None)
+    inherited = resolve_inherited_fields(cur, collection_data, 'new-id')
+    assert cur.queries == [], "A new collection has nothing stored to read"
+    assert inherited == {'product_collection_url': 'https://a.com', 'product_collection_image': None}, f"Unexpected {inherited}"
+    
+    cur = StoredCollectionCursor((['https://a.com/1.jpg'],))
+    inherited = resolve_inherited_fields(cur, collection_data, 'stored-id')
+    assert len(cur.queries) == 1 and 'images' in cur.queries[0], "Only the unmapped column must be read"
+    assert inherited['images'] == ['https://a.com/1.jpg'], "Stored value of an unmapped column not inherited"
+    
+    product_data = {'product_collection_sku': 'A-1', 'product_collection_image': 'https://a.com/sku.jpg'}
+    inherit_collection_fields(product_data, inherited)
+    assert product_data['product_collection_url'] == 'https://a.com', "URL not inherited"
+    assert product_data['product_collection_image'] == 'https://a.com/sku.jpg', "Empty collection values must not overwrite"
+    
+    print("✅ inherited fields tests passed")
+
+def test_generate_raw_data():
+    """Test that generated Raw Data goes through mapping, grouping and parsing"""
+    work_dir = tempfile.TemporaryDirectory()
+    raw_data_cache.RAW_CACHE_DIR = work_dir.name
+    try:
+        csv_path = os.path.join(work_dir.name, 'raw_data.csv')
+        mapping_path = os.path.join(work_dir.name, 'map.csv')
+        rows = generate_raw_data(csv_path, master_codes=5, variants=3, html_kb=1, images=4)
+        write_mapping(mapping_path)
+        assert rows == 20, f"Expected 20 rows, got {rows}"
+        
+        field_map = compile_mapping(load_mapping(mapping_path), read_raw_columns(csv_path))
+        df = normalize_frame(load_raw_frame(csv_path, field_map['columns']), field_map)
+        groups = list(iter_master_groups_chunked(csv_path, 7, field_map))
+        assert len(groups) == 5 and all(len(group) == 4 for _, group in groups), "Expected 5 master codes with 4 rows each"
+        
+        template = df.iloc[0]
+        assert len(parse_array(template['Product Image'])) == 4, "Expected 4 images"
+        assert len(parse_attributes(template['Custom Attributes'])) == 4, "Expected 4 Chinese attributes"
+        assert len(template['Web Page Details'].encode('utf-8')) >= 1024, "HTML smaller than requested"
+        assert '.' in df.iloc[1]['Selling Price'], "Decimal comma was not converted"
+    finally:
+        raw_data_cache.RAW_CACHE_DIR = None
+        work_dir.cleanup()
+    
+    print("✅ generate_raw_data tests passed")
+
+def test_staging_files():
+    """Test that offline staging files hold resolved rows with consistent IDs"""
+    work_dir = tempfile.TemporaryDirectory()
+    raw_data_cache.RAW_CACHE_DIR = work_dir.name
+    try:
+        csv_path = os.path.join(work_dir.name, 'raw_data.csv')
+        mapping_path = os.path.join(work_dir.name, 'map.csv')
+        generate_raw_data(csv_path, master_codes=3, variants=2, html_kb=1, images=2)
+        write_mapping(mapping_path)
+        field_map = compile_mapping(load_mapping(mapping_path), read_raw_columns(csv_path))
+        
+        stage_dir = os.path.join(work_dir.name, 'staged')
+        staging = open_staging_files(stage_dir, staging_columns(field_map))
+        for master_code, master_rows in iter_master_groups_chunked(csv_path, 4, field_map):
+            stage_master_group(staging, master_rows, field_map)
+            # The same group twice: blobs must not be written again
+            stage_master_group(staging, master_rows, field_map)
+        close_staging_files(staging)
+        write_staging_manifest(staging, csv_path)
+        
+        with open(os.path.join(stage_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        tables = [entry['table'] for entry in manifest['tables']]
+        assert tables.index('product_collection') < tables.index('product_collection_translations') < tables.index('product'), "Parents must be loaded first"
+        rows = {entry['table']: entry['rows'] for entry in manifest['tables']}
+        assert rows['product_collection'] == 6 and rows['product'] == 12, f"Unexpected row counts {rows}"
+        assert rows['details_html'] == 3 and rows['product_collection_details_html'] == 6, "HTML must be written once per content"
+        
+        def read_copy_file(table):
+            entry = manifest['tables'][tables.index(table)]
+            with open(os.path.join(stage_dir, entry['file']), 'r', encoding='utf-8') as f:
+                return [dict(zip(entry['columns'], line.rstrip('\n').split('\t'))) for line in f]
+        
+        collections = read_copy_file('product_collection')
+        products = read_copy_file('product')
+        attributes = {row['id'] for row in read_copy_file('product_attributes_raw_collection')}
+        assert all(row['product_attributes_raw_collection_id'] in attributes for row in products), "Products must reference their Sku Attribute rows"
+        collection_urls = {row['master_code']: row['product_collection_url'] for row in collections}
+        assert all(row['product_collection_url'] == collection_urls[row['product_collection_master_code']] for row in products), "Collection URL not inherited"
+        details_ids = {row['id'] for row in read_copy_file('details_html')}
+        assert all(row['details_html_id'] in details_ids for row in read_copy_file('product_collection_details_html')), "Dangling HTML link"
+        
+        # Collections are staged with an empty video when they have none, loading must keep the stored one
+        class RecordingCursor:
+            rowcount = 0
+            def __init__(self):
+                self.statements = []
+            def execute(self, query, params=None):
+                self.statements.append(query)
+        cur = RecordingCursor()
+        load_collections(cur, manifest['tables'][tables.index('product_collection')])
+        assert "video = COALESCE(EXCLUDED.video, product_collection.video)" in cur.statements[0], "Empty video overwrites the stored one"
+        # Loaded products inherit the unmapped fields of their stored collection, like the bulk mode
+        inherit_staged_collection_fields(cur, 'load_product')
+        assert "images = COALESCE(pc.images, product.images)" in cur.statements[-1] and "load_product s" in cur.statements[-1], cur.statements[-1]
+    finally:
+        raw_data_cache.RAW_CACHE_DIR = None
+        work_dir.cleanup()
+    
+    print("✅ staging files tests passed")
+
+def test_plan_master_group():
+    """Test the in-memory insert/update/skip plan against a key snapshot"""
+    mapping = {
+        'Master Code': {'table': 'product_collection', 'column': 'master_code'},
+        'Product URL': {'table': 'product_collection', 'column': 'product_collection_url'},
+        'Price': {'table': 'product', 'column': 'product_selling_price'},
+        'Stock': {'table': 'product', 'column': 'inventory'},
+    }
+    columns = ['Master Code', 'SKU Code', 'Product URL', 'Price', 'Stock', 'Category Name', 'Custom Attributes']
+    field_map = compile_mapping(mapping, columns)
+    rows = normalize_frame(pd.DataFrame({
+        'Master Code': ['A', 'A', 'A', 'A'],
+        'SKU Code': [None, 'A-1', 'A-2', 'A-3'],
+        'Product URL': ['https://a.com/new', None, None, None],
+        'Price': [None, '10,50', '12', None],
+        'Stock': [None, '3', '5', '7'],
+        'Category Name': ['沙发', None, None, None],
+        'Custom Attributes': ['材质:实木', None, None, None],
+    }), field_map)
+    
+    snapshot = {
+        'collection_columns': ['product_collection_url', 'video'],
+        'product_columns': ['product_selling_price', 'inventory'],
+        'collections': {'A': {'product_collection_url': 'https://a.com/old', 'video': None}},
+        'products': {
+            'A-1': {'product_collection_master_code': 'A', 'sku_attribute': None, 'product_selling_price': 10.5, 'inventory': 3},
+            'A-2': {'product_collection_master_code': 'A', 'sku_attribute': None, 'product_selling_price': 11, 'inventory': 5},
+        },
+        'translations': {},
+        'category_ids': {},
+        'category_links': set(),
+        'images': {},
+        'custom_attributes': {'A': [content_hash('材质:实木')]},
+        'details_html': {},
+    }
+    plan = {'summary': {}, 'new_categories': [], 'changes': []}
+    plan_master_group(rows, field_map, snapshot, plan)
+    
+    assert plan['summary']['product_collection'] == {'insert': 0, 'update': 1, 'skip': 0}, f"Unexpected collection plan: {plan['summary']}"
+    assert plan['summary']['product'] == {'insert': 1, 'update': 1, 'skip': 1}, f"Unexpected product plan: {plan['summary']['product']}"
+    assert plan['summary']['custom_attributes'] == {'insert': 0, 'update': 0, 'skip': 1}, "Unchanged attributes must be skipped"
+    assert plan['new_categories'] == ['沙发'], f"Expected one new category, got {plan['new_categories']}"
+    product_update = [change for change in plan['changes'] if change['entity'] == 'product' and change['action'] == 'update'][0]
+    assert product_update['key'] == 'A-2' and list(product_update['fields']) == ['product_selling_price'], f"Unexpected change {product_update}"
+    
+    # Before the content hash migration the snapshot hashes the blobs itself
+    class SnapshotCursor:
+        def __init__(self, hashed_tables):
+            self.hashed_tables = hashed_tables
+            self.statements = []
+        def execute(self, query, params=None):
+            self.statements.append(query)
+        def fetchall(self):
+            return [(table,) for table in self.hashed_tables] if 'information_schema' in self.statements[-1] else []
+    cur = SnapshotCursor(['custom_attributes_raw'])
+    snapshot = load_plan_snapshot(cur, field_map)
+    blob_queries = [query for query in cur.statements if 'JOIN product_collection pc ON pc.id = l.product_collection_id' in query]
+    assert snapshot['pending_migrations'] == ['add_content_hash_columns.sql'], "Missing migration not reported"
+    assert len(blob_queries) == 3 and sum('b.content_hash' in query for query in blob_queries) == 1, "Only migrated tables may read content_hash"
+    cur = SnapshotCursor(['product_collection_img_array', 'custom_attributes_raw', 'details_html'])
+    assert load_plan_snapshot(cur, field_map)['pending_migrations'] == [], "Migrated tables reported as pending"
+    
+    print("✅ plan_master_group tests passed")
+
+def test_skip_committed_groups():
+    """Test that resuming skips exactly the committed master codes"""
+    groups = [('A', 1), ('B', 2), ('C', 3), ('D', 4)]
+    
+    assert list(skip_committed_groups(iter(groups), 2, 'B')) == [('C', 3), ('D', 4)], "Expected to resume after B"
+    assert list(skip_committed_groups(iter(groups), 0, None)) == groups, "Nothing committed, nothing skipped"
+    assert list(skip_committed_groups(iter(groups), 4, 'D')) == [], "Completed file must not be imported again"
+    
+    try:
+        list(skip_committed_groups(iter(groups), 2, 'C'))
+        assert False, "Expected a mismatching checkpoint to fail"
+    except ValueError:
+        pass
+    
+    # Checkpoint batches are counted while they stream, nothing is read ahead
+    progress = {'master_codes': 0, 'last_master_code': None}
+    counted = counted_groups(iter(groups), progress)
+    assert next(counted) == ('A', 1) and progress == {'master_codes': 1, 'last_master_code': 'A'}, "Groups read ahead"
+    list(counted)
+    assert progress == {'master_codes': 4, 'last_master_code': 'D'}, f"Unexpected progress {progress}"
+    
+    print("✅ skip_committed_groups tests passed")
+
 def test_csv_reading():
     """Test reading the CSV file"""
     try:
         # Get the CSV path from environment or use default
         csv_path = os.getenv('RAW_CSV_PATH', 'x:\\DATA_STORAGE\\Furnithai\\RAW_WXW\\_Raw Data.csv')
-        df = pd.read_csv(csv_path, sep=';', encoding='utf-8')
+        df = load_raw_frame(csv_path)
         print(f"✅ Successfully read CSV file with {len(df)} rows and {len(df.columns)} columns")
         print(f"Column names: {', '.join(df.columns[:5])}...")
         return True
@@ -101,6 +669,24 @@ def run_tests():
     test_parse_array()
     test_parse_attributes()
     test_clean_string()
+    test_format_copy_value()
+    test_iter_master_groups_chunked()
+    test_raw_data_cache()
+    test_read_record_fields()
+    test_compact_frame()
+    test_master_code_partition()
+    test_normalize_frame()
+    test_group_fingerprints()
+    test_content_hash()
+    test_statement_table()
+    test_run_stats()
+    test_batched_writer()
+    test_bulk_upsert()
+    test_inherited_fields()
+    test_generate_raw_data()
+    test_staging_files()
+    test_plan_master_group()
+    test_skip_committed_groups()
     
     # Test file reading
     csv_ok = test_csv_reading()